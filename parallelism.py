@@ -1,37 +1,95 @@
 import logging
 import string
+import csv
+import json
+import resource
+import tempfile
 import sys
 import time
 import os
 import math
+import mmap
+import queue
+import shutil
 import numpy as np
 import multiprocessing as mp
 from multiprocessing import shared_memory
 import threading as th
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
-def gen_rand_strings(cnt_str, min_str_len, max_str_len, out_path):
+# The number of bytes counted at a time from a mapped file. `np.bincount` makes a temporary array of 8 bytes per
+# input byte, so counting in blocks keeps the memory constant.
+BLOCK_SIZE = 1 << 22
+# In the pool mode, the input is split into this many byte ranges per worker, so that a worker done early takes more.
+POOL_TASKS_PER_WORKER = 4
+# The number of blocks read ahead in the streaming mode.
+STREAM_QUEUE_LEN = 4
+# In the streaming mode, how often in seconds the reader checks whether the counting has stopped while the queue is
+# full, and how long the counting waits for the reader to quit.
+STREAM_STOP_POLL_SEC = 0.1
+STREAM_JOIN_SEC = 1.0
+# All candidate characters of random strings as byte codes.
+ND_RAND_CHAR = np.frombuffer(string.ascii_letters.encode('ascii'), dtype=np.uint8)
+
+
+def _gen_rand_strings_part(cnt_str, min_str_len, max_str_len, out_path, seed_seq):
+    """
+    Generate random strings into a file from one independent random stream. The strings of a block are drawn as one
+    uint8 array with the newlines put at the cumulative length offsets, and each block is written out at once, so
+    the memory is bounded by `BLOCK_SIZE` whatever `cnt_str` is. Every string, including the last, ends with a newline.
+    :param seed_seq: (np.random.SeedSequence) The seed of the random stream.
+    :return: (int) The number of bytes written.
+    """
+    rng = np.random.default_rng(seed_seq)
+    cnt_str_per_block = max(1, BLOCK_SIZE // ((min_str_len + max_str_len) // 2 + 1))
+    cnt_byte = 0
+    with open(out_path, 'wb') as out_fd:
+        for block_start in range(0, cnt_str, cnt_str_per_block):
+            cnt_block_str = min(cnt_str_per_block, cnt_str - block_start)
+            nd_str_len = rng.integers(low=min_str_len, high=max_str_len, size=cnt_block_str)
+            nd_block = ND_RAND_CHAR[rng.integers(0, len(ND_RAND_CHAR), size=nd_str_len.sum() + cnt_block_str)]
+            nd_block[np.cumsum(nd_str_len + 1) - 1] = ord('\n')
+            out_fd.write(nd_block.data)
+            cnt_byte += len(nd_block)
+    return cnt_byte
+
+
+def gen_rand_strings(cnt_str, min_str_len, max_str_len, out_path, cnt_task=1, seed=None):
     """
     Generate random strings. The generated strings will be written in a text file. Each line holds a string.
     :param cnt_str: (str) The total number random string to be generated.
     :param min_str_len: (int) The min length of random strings.
-    :param max_str_len: (int) The max length of random strings.
+    :param max_str_len: (int) The max length of random strings (exclusive).
     :param out_path: (str) The path to the output text file.
+    :param cnt_task: (int) The number of processes. If >1, each process generates a part file from its own random
+    stream spawned from `seed`, and the parts are concatenated in order.
+    :param seed: (int) The seed. None for a random seed. The output is reproducible given `seed` and `cnt_task`.
     :return: None.
     """
     logging.debug('[gen_rand_strings] Start:\n cnt_str = %s\n out_path = %s' % (cnt_str, out_path))
-    # The number of characters of each random string.
-    l_cnt_char = np.random.randint(low=min_str_len, high=max_str_len, size=cnt_str)
-    # All candidate characters.
-    l_char = list(string.ascii_letters)
-    # Generate random strings.
-    l_rand_str = []
-    for i in range(cnt_str):
-        l_rand_str.append(''.join(np.random.choice(l_char, size=l_cnt_char[i])))
-    # Write to a file.
-    with open(out_path, 'w+') as out_fd:
-        out_str = '\n'.join(l_rand_str)
-        out_fd.write(out_str)
+    seed_seq = np.random.SeedSequence(seed)
+    if cnt_task <= 1 or cnt_str < cnt_task:
+        _gen_rand_strings_part(cnt_str, min_str_len, max_str_len, out_path, seed_seq)
+    else:
+        cnt_str_per_task = math.ceil(cnt_str / cnt_task)
+        l_part = [(min(cnt_str_per_task, cnt_str - idx * cnt_str_per_task), min_str_len, max_str_len,
+                   '%s.part%s' % (out_path, idx), part_seed_seq)
+                  for idx, part_seed_seq in enumerate(seed_seq.spawn(cnt_task))]
+        try:
+            with mp.Pool(cnt_task) as pool:
+                pool.starmap(_gen_rand_strings_part, l_part)
+            with open(out_path, 'wb') as out_fd:
+                for part in l_part:
+                    with open(part[3], 'rb') as in_fd:
+                        shutil.copyfileobj(in_fd, out_fd, BLOCK_SIZE)
+        finally:
+            for part in l_part:
+                if os.path.exists(part[3]):
+                    os.remove(part[3])
+    # No newline after the last string.
+    if cnt_str > 0:
+        os.truncate(out_path, os.path.getsize(out_path) - 1)
     logging.debug('[gen_rand_strings] All done.')
 
 
@@ -82,32 +140,536 @@ def gen_rand_strings(cnt_str, min_str_len, max_str_len, out_path):
 #     return cnt_char
 
 
+def get_char_codes(l_s_char):
+    """
+    Map the specified characters to their byte values. Counting works on the bytes of the input, so only the
+    characters encoded in a single byte, i.e., ASCII, are supported.
+    :param l_s_char: (list of str) The specified characters.
+    :return: (1D ndarray of uint8) The byte value of each character. None if any character is not ASCII.
+    """
+    try:
+        return np.frombuffer(''.join(l_s_char).encode('ascii'), dtype=np.uint8)
+    except (UnicodeEncodeError, TypeError):
+        logging.error('[get_char_codes] `l_s_char` needs to be a list of ASCII characters: %s' % l_s_char)
+        return None
+
+
+def byte_hist(buf):
+    """
+    The histogram of byte values of a buffer in one vectorized pass.
+    :param buf: (bytes-like) E.g., bytes, memoryview, mmap.
+    :return: (1D ndarray of int64) 256 elements. The ith element is the count of the byte value i.
+    """
+    return np.bincount(np.frombuffer(buf, dtype=np.uint8), minlength=256).astype(np.int64, copy=False)
+
+
 def multi_s_char_cnt(in_str, l_s_char):
-    nd_char_cnt = np.zeros(len(l_s_char), dtype=int)
-    for char in in_str:
-        if char in l_s_char:
-            idx = l_s_char.index(char)
-            nd_char_cnt[idx] += 1
-    return nd_char_cnt
+    """
+    Count the number of occurrences of each specified character in a given string.
+    :param in_str: (str or bytes) The given string.
+    :param l_s_char: (list of str) The specified characters.
+    :return: (1D ndarray of int64) Each element corresponds to a character in `l_s_char`.
+    """
+    nd_char_code = get_char_codes(l_s_char)
+    if nd_char_code is None:
+        return None
+    if isinstance(in_str, str):
+        in_str = in_str.encode('utf-8')
+    return byte_hist(in_str)[nd_char_code]
 
 def _batch_multi_s_char_cnt(l_str, l_s_char, out_array=None):
     """
-    Count the number of occurrences of each specified characters in a given list of strings.
+    Count the number of occurrences of each specified characters in a given list of strings. The strings are
+    concatenated and counted in one pass.
     :param l_str: (list of str) Guaranteed to be not None or empty. The given list of strings.
     :param l_s_char: (list of str) Guaranteed to be not None or empty. The specified characters.
     :param out_array: (1D ndarray) If `out_array` is not None, it will carry the output.
-    :return: (1D ndarray) Each element corresponds to a character in `l_s_char`.
+    :return: (1D ndarray) Each element corresponds to a character in `l_s_char`. If the characters are invalid,
+    `out_array` carries zeros, and None is returned without `out_array`.
     """
+    nd_char_cnt = multi_s_char_cnt(''.join(l_str), l_s_char)
     if out_array is not None and type(out_array) == np.ndarray:
-        out_array.fill(0)
-        nd_char_cnt = out_array
-    else:
-        nd_char_cnt = np.zeros(len(l_s_char))
-    for rand_str in l_str:
-        nd_each = multi_s_char_cnt(rand_str, l_s_char)
-        nd_char_cnt += nd_each
+        out_array[:] = 0 if nd_char_cnt is None else nd_char_cnt
+        return out_array
     return nd_char_cnt
 
+def get_newline_chunks(in_path, cnt_chunk):
+    """
+    Split a file into byte ranges of roughly equal sizes. Each range but the last ends right after a newline, so no
+    line is split between two ranges.
+    :param in_path: (str) The path to the input file.
+    :param cnt_chunk: (int) >0 The desired number of ranges.
+    :return: (list of (int, int)) The (offset, length) of each nonempty range, in file order.
+    """
+    file_size = os.path.getsize(in_path)
+    if file_size <= 0:
+        return []
+    chunk_size = max(1, math.ceil(file_size / cnt_chunk))
+    l_chunk = []
+    with open(in_path, 'rb') as in_fd, mmap.mmap(in_fd.fileno(), 0, access=mmap.ACCESS_READ) as in_mm:
+        offset = 0
+        while offset < file_size:
+            end = in_mm.find(b'\n', min(offset + chunk_size, file_size) - 1)
+            end = file_size if end < 0 else end + 1
+            l_chunk.append((offset, end - offset))
+            offset = end
+    return l_chunk
+
+
+def view_byte_hist(in_view, offset, end):
+    """
+    The histogram of byte values of `in_view[offset:end]`, counted in blocks of `BLOCK_SIZE`. `np.bincount` releases
+    the GIL while counting, so threads running this count in parallel.
+    :param in_view: (memoryview) A byte view, e.g., of a mapped file.
+    :return: (1D ndarray of int64) See `byte_hist`.
+    """
+    nd_hist = np.zeros(256, dtype=np.int64)
+    for block_start in range(offset, end, BLOCK_SIZE):
+        nd_hist += byte_hist(in_view[block_start: min(block_start + BLOCK_SIZE, end)])
+    return nd_hist
+
+
+def mmap_byte_hist(in_path, offset=0, length=None):
+    """
+    The histogram of byte values of a byte range of a file. The file is memory-mapped and counted in blocks of
+    `BLOCK_SIZE`, so that no line objects are made and the memory stays constant.
+    :param in_path: (str) The path to the input file.
+    :param offset: (int) The start of the range.
+    :param length: (int) The length of the range. None for the rest of the file.
+    :return: (1D ndarray of int64) See `byte_hist`.
+    """
+    nd_hist = np.zeros(256, dtype=np.int64)
+    file_size = os.path.getsize(in_path)
+    end = file_size if length is None else min(offset + length, file_size)
+    if end <= offset:
+        return nd_hist
+    with open(in_path, 'rb') as in_fd, mmap.mmap(in_fd.fileno(), 0, access=mmap.ACCESS_READ) as in_mm:
+        in_view = memoryview(in_mm)
+        try:
+            nd_hist = view_byte_hist(in_view, offset, end)
+        finally:
+            in_view.release()
+    return nd_hist
+
+
+##################################################
+#   Map-Reduce Executor
+##################################################
+class MapReduceExecutor:
+    """
+    A parallel map-reduce over a list of tasks. `map_func` maps each task to a result array of a fixed shape and
+    dtype, and `reduce_func` folds the results as the tasks complete.
+    In the process backend, the workers write the results into the rows of one shared memory matrix, so only the task
+    and its row index are pickled. In the thread backend, the matrix is a plain array shared by the threads. Either
+    way, the matrix is released when a run ends, on errors too.
+    For file inputs, `run_file` splits a file into newline-aligned byte ranges, and each task is (path, offset, length).
+    Unless given, the chunk size is autotuned by timing `map_func` on a probe range.
+    """
+    BACKEND_PROCESS = 'process'
+    BACKEND_THREAD = 'thread'
+    # The size of the probe range for autotuning.
+    AUTOTUNE_PROBE_SIZE = 1 << 20
+    # The target elapse of one task. Long enough to hide the dispatching cost.
+    AUTOTUNE_TASK_SEC = 0.2
+    # The bounds of autotuned chunk sizes.
+    MIN_CHUNK_SIZE = 1 << 20
+    MAX_CHUNK_SIZE = 1 << 28
+
+    # Task -> result array. Needs to be picklable, i.e., a module level function, for the process backend.
+    m_map_func = None
+    # The map function run in the current process, i.e., by the thread backend and the autotuning.
+    m_local_map_func = None
+    # Invoked with `m_init_arg` once in each worker process.
+    m_init_func = None
+    m_init_arg = None
+    # (Result array, result array) -> result array.
+    m_reduce_func = None
+    m_res_shape = None
+    m_res_dtype = None
+    m_backend = None
+    m_cnt_worker = None
+    # A persistent process pool to run on. If None, a pool is made for each run.
+    m_pool = None
+    # The interval of progress logs. None for no progress log.
+    m_progress_sec = None
+
+    def __init__(self, map_func, res_shape, res_dtype=np.int64, reduce_func=None, backend=BACKEND_PROCESS,
+                 cnt_worker=os.cpu_count(), pool=None, progress_sec=None, init_func=None, init_arg=(),
+                 local_map_func=None):
+        """
+        Constructor.
+        :param reduce_func: (callable) None for the element-wise sum.
+        :param backend: (str) `BACKEND_PROCESS` or `BACKEND_THREAD`.
+        :param cnt_worker: (int) >0 The number of worker processes or threads. Ignored if `pool` is given.
+        :param pool: (mp.pool.Pool) Only for `BACKEND_PROCESS`. Needs to be made with `init_func` as its initializer
+        if `init_func` is given.
+        :param init_func: (callable) Binds the state read by `map_func` in each worker process, e.g., a large lookup
+        structure, so that it is pickled once per worker process instead of once per task. Picklable. It is never
+        invoked in the current process.
+        :param init_arg: (tuple) The arguments of `init_func`.
+        :param local_map_func: (callable) Task -> result array, run in the current process by the thread backend and
+        the autotuning. Needed if `map_func` reads the state bound by `init_func`. None for `map_func`.
+        """
+        if backend not in (MapReduceExecutor.BACKEND_PROCESS, MapReduceExecutor.BACKEND_THREAD):
+            raise Exception('[MapReduceExecutor:__init__] Unknown backend: %s' % backend)
+        self.m_map_func = map_func
+        self.m_reduce_func = np.add if reduce_func is None else reduce_func
+        self.m_res_shape = tuple(res_shape)
+        self.m_res_dtype = np.dtype(res_dtype)
+        self.m_backend = backend
+        self.m_cnt_worker = cnt_worker
+        self.m_pool = pool
+        self.m_progress_sec = progress_sec
+        self.m_local_map_func = map_func if local_map_func is None else local_map_func
+        self.m_init_func = init_func
+        self.m_init_arg = tuple(init_arg)
+
+    @staticmethod
+    def _run_task(task_arg):
+        """
+        Map one task and write the result into its row of the result matrix.
+        :param task_arg: (tuple) (map_func, the result matrix or the name of its shared memory, the matrix shape,
+        the dtype, the row, the task).
+        :return: (int) The row.
+        """
+        map_func, res, res_shape, res_dtype, row, task = task_arg
+        if isinstance(res, np.ndarray):
+            res[row] = map_func(task)
+            return row
+        shm = shared_memory.SharedMemory(name=res)
+        try:
+            nd_res = np.ndarray(res_shape, dtype=res_dtype, buffer=shm.buf)
+            nd_res[row] = map_func(task)
+            del nd_res
+        finally:
+            shm.close()
+        return row
+
+    def run(self, l_task, l_task_size=None):
+        """
+        :param l_task: (list) The tasks. Picklable for the process backend.
+        :param l_task_size: (list of int) The size of each task in bytes, only for the progress logs.
+        :return: (ndarray) The reduced result. Zeros if there is no task.
+        """
+        if len(l_task) <= 0:
+            return np.zeros(self.m_res_shape, dtype=self.m_res_dtype)
+        start_time = time.time()
+        res_shape = (len(l_task),) + self.m_res_shape
+        shm = None
+        nd_acc = None
+        try:
+            if self.m_backend == MapReduceExecutor.BACKEND_PROCESS:
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(1, int(np.prod(res_shape)) * self.m_res_dtype.itemsize))
+                nd_res = np.ndarray(res_shape, dtype=self.m_res_dtype, buffer=shm.buf)
+                res = shm.name
+            else:
+                nd_res = np.zeros(res_shape, dtype=self.m_res_dtype)
+                res = nd_res
+            map_func = self.m_map_func if self.m_backend == MapReduceExecutor.BACKEND_PROCESS else self.m_local_map_func
+            l_task_arg = [(map_func, res, res_shape, self.m_res_dtype, row, task) for row, task in enumerate(l_task)]
+
+            last_report_time = start_time
+            cnt_done = 0
+            size_done = 0
+            for row in self.__gen_done_rows(l_task_arg):
+                nd_acc = nd_res[row].copy() if nd_acc is None else self.m_reduce_func(nd_acc, nd_res[row])
+                cnt_done += 1
+                size_done += l_task_size[row] if l_task_size is not None else 0
+                if self.m_progress_sec is not None and time.time() - last_report_time >= self.m_progress_sec:
+                    last_report_time = time.time()
+                    elapse = last_report_time - start_time
+                    logging.info('[MapReduceExecutor:run] %s/%s tasks done, %.1f MB, %.1f MB/s.'
+                                 % (cnt_done, len(l_task), size_done / (1 << 20), size_done / (1 << 20) / elapse))
+            del nd_res
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        logging.debug('[MapReduceExecutor:run] %s tasks in %s secs.' % (len(l_task), time.time() - start_time))
+        return nd_acc
+
+    def __gen_done_rows(self, l_task_arg):
+        """
+        Run the tasks on the backend, and yield the row of each task as it completes.
+        """
+        if self.m_backend == MapReduceExecutor.BACKEND_THREAD:
+            with ThreadPoolExecutor(max_workers=self.m_cnt_worker) as executor:
+                l_future = [executor.submit(MapReduceExecutor._run_task, task_arg) for task_arg in l_task_arg]
+                for future in as_completed(l_future):
+                    yield future.result()
+        elif self.m_pool is not None:
+            yield from self.m_pool.imap_unordered(MapReduceExecutor._run_task, l_task_arg)
+        else:
+            with mp.Pool(min(self.m_cnt_worker, len(l_task_arg)), initializer=self.m_init_func,
+                         initargs=self.m_init_arg) as pool:
+                yield from pool.imap_unordered(MapReduceExecutor._run_task, l_task_arg)
+
+    def autotune_chunk_size(self, in_path):
+        """
+        Pick a chunk size so that one task takes about `AUTOTUNE_TASK_SEC`, and every worker gets at least
+        `POOL_TASKS_PER_WORKER` tasks for load balancing. The throughput is measured by mapping the probe range at
+        the start of the file.
+        :return: (int) The chunk size in bytes.
+        """
+        file_size = os.path.getsize(in_path)
+        probe_size = min(file_size, MapReduceExecutor.AUTOTUNE_PROBE_SIZE)
+        start_time = time.time()
+        self.m_local_map_func((in_path, 0, probe_size))
+        probe_sec = max(time.time() - start_time, 1e-6)
+        chunk_size = int(probe_size / probe_sec * MapReduceExecutor.AUTOTUNE_TASK_SEC)
+        chunk_size = min(chunk_size, math.ceil(file_size / (self.m_cnt_worker * POOL_TASKS_PER_WORKER)))
+        chunk_size = max(MapReduceExecutor.MIN_CHUNK_SIZE, min(chunk_size, MapReduceExecutor.MAX_CHUNK_SIZE))
+        logging.debug('[MapReduceExecutor:autotune_chunk_size] %s bytes per chunk.' % chunk_size)
+        return chunk_size
+
+    def run_file(self, in_path, chunk_size=None, cnt_chunk=None):
+        """
+        Map-reduce over the newline-aligned byte ranges of a file.
+        :param chunk_size: (int) The bytes of each range. Ignored if `cnt_chunk` is given.
+        :param cnt_chunk: (int) The number of ranges. If both are None, the chunk size is autotuned.
+        :return: (ndarray) See `run`.
+        """
+        file_size = os.path.getsize(in_path)
+        if file_size <= 0:
+            return self.run([])
+        if cnt_chunk is None:
+            if chunk_size is None:
+                chunk_size = self.autotune_chunk_size(in_path)
+            cnt_chunk = math.ceil(file_size / chunk_size)
+        l_chunk = get_newline_chunks(in_path, cnt_chunk)
+        return self.run([(in_path, offset, length) for offset, length in l_chunk],
+                        [length for _, length in l_chunk])
+
+
+def _task_byte_hist(task):
+    """
+    The map function of the char count. The worker maps the file itself, so only the small task tuple is pickled.
+    :param task: (str, int, int) The input path, the byte offset and the length.
+    :return: (1D ndarray of int64) See `mmap_byte_hist`.
+    """
+    in_path, offset, length = task
+    return mmap_byte_hist(in_path, offset, length)
+
+
+def pool_multi_s_char_cnt(in_path, nd_char_code, cnt_task=os.cpu_count(), pool=None):
+    """
+    Count the specified characters with a pool of worker processes. Runs on `MapReduceExecutor` with autotuned
+    chunks.
+    :param nd_char_code: (1D ndarray of uint8) See `get_char_codes`.
+    :param cnt_task: (int) The number of worker processes. Ignored if `pool` is given.
+    :param pool: (mp.pool.Pool) A persistent pool to run on. If None, a pool is made for this call.
+    :return: (1D ndarray of int64) Each element corresponds to a character code.
+    """
+    executor = MapReduceExecutor(_task_byte_hist, (256,), backend=MapReduceExecutor.BACKEND_PROCESS,
+                                 cnt_worker=cnt_task, pool=pool)
+    return executor.run_file(in_path)[nd_char_code]
+
+
+def thread_multi_s_char_cnt(in_path, nd_char_code, cnt_task=os.cpu_count()):
+    """
+    Count the specified characters with a pool of threads. Runs on `MapReduceExecutor` with autotuned chunks. Each
+    task counts with `mmap_byte_hist`, which releases the GIL while counting.
+    :param nd_char_code: (1D ndarray of uint8) See `get_char_codes`.
+    :param cnt_task: (int) The number of threads.
+    :return: (1D ndarray of int64) Each element corresponds to a character code.
+    """
+    executor = MapReduceExecutor(_task_byte_hist, (256,), backend=MapReduceExecutor.BACKEND_THREAD,
+                                 cnt_worker=cnt_task)
+    return executor.run_file(in_path)[nd_char_code]
+
+
+##################################################
+#   Multi-Pattern Count
+##################################################
+class MultiPatternCounter:
+    """
+    Counts the occurrences of many patterns in one scan, overlapping ones included, e.g., 'aa' occurs twice in 'aaa'.
+    The patterns are grouped by length. For each length L, every position of the input gets the key of the L bytes
+    starting there in L vectorized passes, and the keys are looked up among the sorted pattern keys. Up to
+    `MAX_PACK_LEN` bytes, a key packs the bytes into a uint64, so a key match is exact. Beyond that, a key is a
+    polynomial hash, and every match is verified against the pattern bytes. The time is linear in the input size for
+    each distinct pattern length, and only logarithmic in the number of patterns.
+    A pattern may not contain a newline, so the counts of newline-aligned chunks add up to the count of the file.
+    """
+    MAX_PACK_LEN = 8
+    HASH_MUL = np.uint64(1099511628211)
+
+    # The distinct patterns in bytes.
+    m_l_pattern = None
+    m_max_len = None
+    # Pattern length -> (the sorted keys, the pattern index of each key, the pattern bytes of each key as a matrix)
+    m_d_group = None
+
+    def __init__(self, l_pattern):
+        """
+        Constructor. The patterns are deduplicated keeping the order.
+        :param l_pattern: (list of str or bytes) Nonempty patterns without newlines. `str` patterns are encoded in
+        UTF-8.
+        """
+        self.m_l_pattern = list(dict.fromkeys(pattern.encode('utf-8') if isinstance(pattern, str) else bytes(pattern)
+                                              for pattern in l_pattern))
+        if len(self.m_l_pattern) <= 0:
+            raise Exception('[MultiPatternCounter:__init__] No pattern.')
+        for pattern in self.m_l_pattern:
+            if len(pattern) <= 0 or b'\n' in pattern:
+                raise Exception('[MultiPatternCounter:__init__] A pattern needs to be nonempty without newlines: %r'
+                                % pattern)
+        self.m_max_len = max(len(pattern) for pattern in self.m_l_pattern)
+
+        self.m_d_group = dict()
+        for pattern_len in sorted(set(len(pattern) for pattern in self.m_l_pattern)):
+            nd_pattern_idx = np.array([idx for idx, pattern in enumerate(self.m_l_pattern)
+                                       if len(pattern) == pattern_len], dtype=np.int64)
+            nd_pattern_mat = np.frombuffer(b''.join(self.m_l_pattern[idx] for idx in nd_pattern_idx),
+                                           dtype=np.uint8).reshape(-1, pattern_len)
+            nd_key = np.concatenate([self.__get_keys(nd_pattern, pattern_len, 1) for nd_pattern in nd_pattern_mat])
+            nd_order = np.argsort(nd_key, kind='stable')
+            self.m_d_group[pattern_len] = (nd_key[nd_order], nd_pattern_idx[nd_order], nd_pattern_mat[nd_order])
+
+    @staticmethod
+    def __get_keys(nd_buf, pattern_len, cnt_pos):
+        """
+        :return: (1D ndarray of uint64) The key of the `pattern_len` bytes starting at each of the first `cnt_pos`
+        positions of `nd_buf`.
+        """
+        nd_pos_key = nd_buf[:cnt_pos].astype(np.uint64)
+        for k in range(1, pattern_len):
+            if pattern_len <= MultiPatternCounter.MAX_PACK_LEN:
+                nd_pos_key <<= np.uint64(8)
+                nd_pos_key |= nd_buf[k: k + cnt_pos]
+            else:
+                nd_pos_key *= MultiPatternCounter.HASH_MUL
+                nd_pos_key += nd_buf[k: k + cnt_pos]
+        return nd_pos_key
+
+    def count(self, buf, cnt_start=None):
+        """
+        Count the occurrences starting at the first `cnt_start` positions of a buffer. The bytes after are only read
+        by the occurrences starting before, so consecutive blocks overlapping by `m_max_len` - 1 bytes are counted
+        exactly.
+        :param buf: (bytes-like)
+        :param cnt_start: (int) None for all positions.
+        :return: (1D ndarray of int64) The count of each pattern in `m_l_pattern`.
+        """
+        nd_buf = np.frombuffer(buf, dtype=np.uint8)
+        cnt_start = len(nd_buf) if cnt_start is None else min(cnt_start, len(nd_buf))
+        nd_cnt = np.zeros(len(self.m_l_pattern), dtype=np.int64)
+        for pattern_len, (nd_key, nd_pattern_idx, nd_pattern_mat) in self.m_d_group.items():
+            cnt_pos = min(cnt_start, len(nd_buf) - pattern_len + 1)
+            if cnt_pos <= 0:
+                continue
+            nd_pos_key = self.__get_keys(nd_buf, pattern_len, cnt_pos)
+            nd_lo = np.searchsorted(nd_key, nd_pos_key, side='left')
+            if pattern_len <= MultiPatternCounter.MAX_PACK_LEN:
+                # Packed keys are distinct and exact.
+                nd_lo = np.minimum(nd_lo, len(nd_key) - 1)
+                nd_row = nd_lo[nd_key[nd_lo] == nd_pos_key]
+                nd_cnt += np.bincount(nd_pattern_idx[nd_row], minlength=len(nd_cnt))
+                continue
+            # Hashed keys may collide, so each pattern with the key of a position is verified in turn.
+            nd_hi = np.searchsorted(nd_key, nd_pos_key, side='right')
+            nd_pos = np.nonzero(nd_hi > nd_lo)[0]
+            nd_row = nd_lo[nd_pos]
+            nd_hi = nd_hi[nd_pos]
+            while len(nd_pos) > 0:
+                nd_window = nd_buf[nd_pos[:, None] + np.arange(pattern_len)]
+                nd_ok = (nd_window == nd_pattern_mat[nd_row]).all(axis=1)
+                nd_cnt += np.bincount(nd_pattern_idx[nd_row[nd_ok]], minlength=len(nd_cnt))
+                nd_row += 1
+                nd_next = nd_row < nd_hi
+                nd_pos, nd_row, nd_hi = nd_pos[nd_next], nd_row[nd_next], nd_hi[nd_next]
+        return nd_cnt
+
+    def count_file_range(self, in_path, offset=0, length=None):
+        """
+        Count the occurrences in a byte range of a file. The file is memory-mapped and counted in blocks of
+        `BLOCK_SIZE`.
+        :return: (1D ndarray of int64) See `count`.
+        """
+        nd_cnt = np.zeros(len(self.m_l_pattern), dtype=np.int64)
+        file_size = os.path.getsize(in_path)
+        end = file_size if length is None else min(offset + length, file_size)
+        if end <= offset:
+            return nd_cnt
+        with open(in_path, 'rb') as in_fd, mmap.mmap(in_fd.fileno(), 0, access=mmap.ACCESS_READ) as in_mm:
+            in_view = memoryview(in_mm)
+            try:
+                for block_start in range(offset, end, BLOCK_SIZE):
+                    block_end = min(block_start + BLOCK_SIZE, end)
+                    nd_cnt += self.count(in_view[block_start: min(block_end + self.m_max_len - 1, end)],
+                                         block_end - block_start)
+            finally:
+                in_view.release()
+        return nd_cnt
+
+
+# The counter of the multi-pattern count in a worker process. Bound once per worker by `_init_pattern_cnt`, and never
+# set in the calling process.
+_pattern_counter = None
+
+
+def _init_pattern_cnt(counter):
+    """
+    The pool initializer of the multi-pattern count.
+    :param counter: (MultiPatternCounter)
+    :return: None.
+    """
+    global _pattern_counter
+    _pattern_counter = counter
+
+
+def _task_pattern_cnt(task):
+    """
+    The map function of the multi-pattern count, on the counter bound by `_init_pattern_cnt`.
+    :param task: (str, int, int) The input path, the byte offset and the length.
+    :return: (1D ndarray of int64) See `MultiPatternCounter.count`.
+    """
+    return _pattern_counter.count_file_range(*task)
+
+
+def multi_pattern_cnt(in_path, l_pattern, cnt_task=os.cpu_count(), type=0):
+    """
+    Count the occurrences of each pattern in a file, overlapping ones included. The automaton-free equivalent of
+    Aho-Corasick, see `MultiPatternCounter`, runs on `MapReduceExecutor` with autotuned chunks.
+    :param l_pattern: (list of str) Nonempty patterns without newlines.
+    :param cnt_task: (int) The number of tasks. 1 for the single task.
+    :param type: (int) 0 - multiprocessing; 1 - multithreading.
+    :return: (1D ndarray of int64) Each element corresponds to a pattern in `l_pattern`. None on failure.
+    """
+    logging.debug('[multi_pattern_cnt] Start.')
+    if not os.path.exists(in_path):
+        logging.error('[multi_pattern_cnt] The input file path does not exist: %s' % in_path)
+        return None
+
+    if type not in (0, 1):
+        logging.error('[multi_pattern_cnt] Unknown type: %s' % type)
+        return None
+
+    start_time = time.time()
+    try:
+        counter = MultiPatternCounter(l_pattern)
+        if cnt_task <= 1:
+            nd_cnt = counter.count_file_range(in_path)
+        else:
+            backend = MapReduceExecutor.BACKEND_PROCESS if type == 0 else MapReduceExecutor.BACKEND_THREAD
+            executor = MapReduceExecutor(_task_pattern_cnt, (len(counter.m_l_pattern),), backend=backend,
+                                         cnt_worker=cnt_task, init_func=_init_pattern_cnt, init_arg=(counter,),
+                                         local_map_func=lambda task: counter.count_file_range(*task))
+            nd_cnt = executor.run_file(in_path)
+    except Exception as err:
+        logging.error('[multi_pattern_cnt] Failed: %s' % err)
+        return None
+
+    # Map back to the patterns as given, duplicates included.
+    d_pattern_idx = {pattern: idx for idx, pattern in enumerate(counter.m_l_pattern)}
+    nd_out = nd_cnt[[d_pattern_idx[pattern.encode('utf-8') if isinstance(pattern, str) else bytes(pattern)]
+                     for pattern in l_pattern]]
+    logging.debug('[multi_pattern_cnt] All done.\n Pattern counts = %s\n Elapse = %s'
+                  % (nd_out, time.time() - start_time))
+    return nd_out
+
+
 def single_task_multi_s_char_cnt(in_path, l_s_char):
     """
     Count the number of occurrences of each character in a given list of characters.
@@ -124,21 +686,25 @@ def single_task_multi_s_char_cnt(in_path, l_s_char):
         logging.error('[single_task_multi_s_char_cnt] `l_s_char` needs to be a nonempty list of characters.')
         return None
 
-    with open(in_path, 'r') as in_fd:
-        l_rand_str = in_fd.readlines()
+    nd_char_code = get_char_codes(l_s_char)
+    if nd_char_code is None:
+        return None
 
     start_time = time.time()
-    nd_char_cnt = _batch_multi_s_char_cnt(l_rand_str, l_s_char)
+    nd_char_cnt = mmap_byte_hist(in_path)[nd_char_code]
     logging.debug('[single_task_multi_s_char_cnt] All done.\n Char counts = %s\n Elapse = %s'
                   % (nd_char_cnt, time.time() - start_time))
     return nd_char_cnt
 
 
-def multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task=os.cpu_count(), type=0):
+def multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task=os.cpu_count(), type=0, pool=None):
     """
-    The multitask version of `single_task_multi_s_char_cnt`.
+    The multitask version of `single_task_multi_s_char_cnt`. All modes run on `MapReduceExecutor`. The mode 0 splits
+    the file into one byte range per process.
     :param cnt_task: (int) The number of tasks running in parallel.
-    :param type: (int) 0 - multiprocessing; 1 - multithreading.
+    :param type: (int) 0 - multiprocessing; 1 - multithreading, see `thread_multi_s_char_cnt`; 2 - process pool.
+    :param pool: (mp.pool.Pool) Only for `type` = 2. See `pool_multi_s_char_cnt`.
+    :return: (1D ndarray of int64) Each element corresponds to a character in `l_s_char`. None on failure.
     """
     logging.debug('[multitask_multi_s_char_cnt] Start.')
     if not os.path.exists(in_path):
@@ -149,55 +715,232 @@ def multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task=os.cpu_count(), type=
         logging.error('[multitask_multi_s_char_cnt] `l_s_char` needs to be a nonempty list of characters.')
         return None
 
-    with open(in_path, 'r') as in_fd:
-        l_rand_str = in_fd.readlines()
+    if type not in (0, 1, 2):
+        logging.error('[multitask_multi_s_char_cnt] Unknown type: %s' % type)
+        return None
 
-    if type == 0:
-        task_carrier = mp.Process
-    else:
-        task_carrier = th.Thread
+    nd_char_code = get_char_codes(l_s_char)
+    if nd_char_code is None:
+        return None
 
     start_time = time.time()
-    # Split the input for multiple tasks.
-    cnt_str_per_task = math.floor(len(l_rand_str) / cnt_task)
-    l_task = [l_rand_str[i * cnt_str_per_task: (i + 1) * cnt_str_per_task] for i in range(cnt_task)]
-
-    # Output array
-    nd_out = np.zeros(len(l_s_char))
-
-    # Spawn tasks
-    nd_size_test = np.zeros(len(l_s_char), dtype=float)
-    shm_size = nd_size_test.nbytes
-    del nd_size_test
-    l_task_ins = []
-    l_out_array = []
-    l_shm = []
-    for idx, l_task_str in enumerate(l_task):
-        shm = shared_memory.SharedMemory(name='shm_%s' % idx, create=True, size=shm_size)
-        out_array = np.ndarray(len(l_s_char), dtype=int, buffer=shm.buf)
-        task_ins = task_carrier(target=_batch_multi_s_char_cnt, args=(l_task_str, l_s_char, out_array))
-        task_ins.start()
-        l_task_ins.append(task_ins)
-        l_out_array.append(out_array)
-        l_shm.append(shm)
-
-    while len(l_task_ins) > 0:
-        for task_ins in l_task_ins:
-            if task_ins.is_alive():
-                task_ins.join(0.1)
-            else:
-                l_task_ins.remove(task_ins)
-
-    for out_array in l_out_array:
-        nd_out += out_array
-        del out_array
-
-    for shm in l_shm:
-        shm.close()
-        shm.unlink()
+    try:
+        if type == 0:
+            executor = MapReduceExecutor(_task_byte_hist, (256,), backend=MapReduceExecutor.BACKEND_PROCESS,
+                                         cnt_worker=cnt_task)
+            nd_out = executor.run_file(in_path, cnt_chunk=cnt_task)[nd_char_code]
+        elif type == 1:
+            nd_out = thread_multi_s_char_cnt(in_path, nd_char_code, cnt_task)
+        else:
+            nd_out = pool_multi_s_char_cnt(in_path, nd_char_code, cnt_task, pool)
+    except Exception as err:
+        logging.error('[multitask_multi_s_char_cnt] Failed: %s' % err)
+        return None
 
     logging.debug('[multitask_multi_s_char_cnt] All done.\n Char Counts = %s\n Elapse = %s'
                   % (nd_out, time.time() - start_time))
+    return nd_out
+
+
+def _stream_reader(in_fd, block_size, q_block, stop_event):
+    """
+    The reader thread of `stream_multi_s_char_cnt`. Blocks are put into `q_block`, followed by None at EOF, or by the
+    exception if the read fails. `read1` is used when available, so the data of a slow stream is passed on as it
+    arrives instead of waiting for a full block. The reader quits once `stop_event` is set, even if the queue is full.
+    """
+    def put_block(block):
+        while not stop_event.is_set():
+            try:
+                q_block.put(block, timeout=STREAM_STOP_POLL_SEC)
+                return
+            except queue.Full:
+                continue
+
+    read_func = getattr(in_fd, 'read1', in_fd.read)
+    try:
+        while not stop_event.is_set():
+            block = read_func(block_size)
+            if not block:
+                break
+            put_block(block)
+        put_block(None)
+    except Exception as err:
+        put_block(err)
+
+
+def stream_multi_s_char_cnt(in_fd, l_s_char, report_sec=None, block_size=BLOCK_SIZE):
+    """
+    Count the specified characters over a binary stream of unknown length, e.g., `sys.stdin.buffer`. A reader thread
+    reads fixed-size blocks ahead into a bounded queue while the counts are updated, so the reading overlaps the
+    counting and the memory stays at most `STREAM_QUEUE_LEN` + 1 blocks.
+    :param in_fd: (binary file object) The input stream.
+    :param report_sec: (float) If not None, the running counts are logged every `report_sec` seconds.
+    :param block_size: (int) >0 The max number of bytes of each read.
+    :return: (1D ndarray of int64) Each element corresponds to a character in `l_s_char`. None on failure.
+    """
+    logging.debug('[stream_multi_s_char_cnt] Start.')
+    nd_char_code = get_char_codes(l_s_char)
+    if nd_char_code is None:
+        return None
+
+    start_time = time.time()
+    q_block = queue.Queue(maxsize=STREAM_QUEUE_LEN)
+    stop_event = th.Event()
+    reader = th.Thread(target=_stream_reader, args=(in_fd, block_size, q_block, stop_event), daemon=True)
+    reader.start()
+    nd_hist = np.zeros(256, dtype=np.int64)
+    cnt_byte = 0
+    last_report_time = start_time
+    try:
+        while True:
+            try:
+                block = q_block.get(timeout=report_sec)
+            except queue.Empty:
+                block = b''
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                logging.error('[stream_multi_s_char_cnt] Failed to read the input: %s' % block)
+                return None
+            nd_hist += byte_hist(block)
+            cnt_byte += len(block)
+            if report_sec is not None and time.time() - last_report_time >= report_sec:
+                last_report_time = time.time()
+                logging.info('[stream_multi_s_char_cnt] %s bytes so far.\n Char counts = %s'
+                             % (cnt_byte, nd_hist[nd_char_code]))
+    finally:
+        # The reader may still be blocked on a read of a stream with no data. It is a daemon thread, so it does not
+        # hold the process on exit.
+        stop_event.set()
+        reader.join(timeout=STREAM_JOIN_SEC)
+        if reader.is_alive():
+            logging.warning('[stream_multi_s_char_cnt] The reader is still blocked on the input.')
+
+    nd_char_cnt = nd_hist[nd_char_code]
+    logging.debug('[stream_multi_s_char_cnt] All done.\n Bytes = %s\n Char counts = %s\n Elapse = %s'
+                  % (cnt_byte, nd_char_cnt, time.time() - start_time))
+    return nd_char_cnt
+
+
+def _best_elapse(run_func, cnt_repeat):
+    """
+    Run `run_func` `cnt_repeat` times.
+    :return: (float, object) The best elapse in seconds, and the output of the last run. (None, None) if any run
+    returns None.
+    """
+    l_elapse = []
+    nd_out = None
+    for _ in range(cnt_repeat):
+        start_time = time.time()
+        nd_out = run_func()
+        l_elapse.append(time.time() - start_time)
+        if nd_out is None:
+            return None, None
+    return min(l_elapse), nd_out
+
+
+def bench_multi_s_char_cnt(in_path, l_s_char, cnt_task=os.cpu_count(), cnt_repeat=3):
+    """
+    Compare the single task, the threads, the processes and the process pool on the same input. Each is run
+    `cnt_repeat` times and the best elapse is taken.
+    :return: (dict) The name of each mode to its best elapse in seconds. None on failure.
+    """
+    l_mode = [('single', lambda: single_task_multi_s_char_cnt(in_path, l_s_char)),
+              ('threads', lambda: multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task, 1)),
+              ('processes', lambda: multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task, 0)),
+              ('pool', lambda: multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task, 2))]
+    d_elapse = dict()
+    nd_ref = None
+    for mode, run_func in l_mode:
+        elapse, nd_out = _best_elapse(run_func, cnt_repeat)
+        if nd_out is None:
+            logging.error('[bench_multi_s_char_cnt] %s failed.' % mode)
+            return None
+        if nd_ref is None:
+            nd_ref = nd_out
+        elif not np.array_equal(nd_ref, nd_out):
+            logging.error('[bench_multi_s_char_cnt] %s disagrees with the single task.' % mode)
+            return None
+        d_elapse[mode] = elapse
+
+    file_mb = os.path.getsize(in_path) / (1 << 20)
+    l_line = ['%-10s %10s %10s %8s' % ('mode', 'elapse', 'MB/s', 'speedup')]
+    for mode, elapse in d_elapse.items():
+        l_line.append('%-10s %10.4f %10.1f %8.2f' % (mode, elapse, file_mb / elapse, d_elapse['single'] / elapse))
+    logging.info('[bench_multi_s_char_cnt] %s MB, %s tasks:\n%s' % (round(file_mb, 1), cnt_task, '\n'.join(l_line)))
+    return d_elapse
+
+
+def bench_scaling(l_corpus_mb, max_task, out_prefix, cnt_repeat=3, min_str_len=10, max_str_len=100, seed=0):
+    """
+    The scaling benchmark of the char count. For each corpus size, a corpus is generated by `gen_rand_strings` into a
+    temporary folder, and the single task, the processes, the threads and the process pool are run with 1 to
+    `max_task` tasks. Each run reports the best elapse, the throughput, the speedup over the single task and the
+    parallel efficiency (speedup / tasks). Memory is reported as the peak RSS of this process and of the largest
+    child so far, i.e., high-water marks since the start of the benchmark.
+    The records are saved into '[out_prefix].csv' and '[out_prefix].json'.
+    :param l_corpus_mb: (list of float) The corpus sizes in MB.
+    :param max_task: (int) >0 The max number of tasks.
+    :param out_prefix: (str) The path prefix of the output files.
+    :return: (list of dict) The records. None on failure.
+    """
+    logging.debug('[bench_scaling] Start.')
+    l_s_char = list(string.ascii_letters)
+    l_rec = []
+    work_folder = tempfile.mkdtemp(prefix='bench_scaling_')
+    try:
+        for corpus_mb in l_corpus_mb:
+            in_path = os.path.join(work_folder, 'corpus_%s.txt' % corpus_mb)
+            cnt_str = max(1, int(corpus_mb * (1 << 20) / ((min_str_len + max_str_len) / 2 + 1)))
+            gen_rand_strings(cnt_str, min_str_len, max_str_len, in_path, seed=seed)
+            file_mb = os.path.getsize(in_path) / (1 << 20)
+
+            l_run = [('single', 1, lambda cnt_task: single_task_multi_s_char_cnt(in_path, l_s_char))]
+            for cnt_task in range(1, max_task + 1):
+                for mode, task_type in [('processes', 0), ('threads', 1), ('pool', 2)]:
+                    l_run.append((mode, cnt_task, lambda cnt_task, task_type=task_type:
+                                  multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task, task_type)))
+            single_elapse = None
+            nd_ref = None
+            for mode, cnt_task, run_func in l_run:
+                elapse, nd_out = _best_elapse(lambda: run_func(cnt_task), cnt_repeat)
+                if nd_out is None:
+                    logging.error('[bench_scaling] %s with %s tasks failed.' % (mode, cnt_task))
+                    return None
+                if nd_ref is None:
+                    nd_ref = nd_out
+                    single_elapse = elapse
+                elif not np.array_equal(nd_ref, nd_out):
+                    logging.error('[bench_scaling] %s with %s tasks disagrees with the single task.' % (mode, cnt_task))
+                    return None
+                speedup = single_elapse / elapse
+                # `ru_maxrss` is in KB on Linux.
+                l_rec.append({'corpus_mb': round(file_mb, 3), 'mode': mode, 'cnt_task': cnt_task,
+                              'elapse': elapse, 'mb_per_sec': file_mb / elapse, 'speedup': speedup,
+                              'efficiency': speedup / cnt_task,
+                              'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                              'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024})
+            os.remove(in_path)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    l_field = list(l_rec[0].keys()) if len(l_rec) > 0 else []
+    with open(out_prefix + '.csv', 'w', newline='') as out_fd:
+        csv_writer = csv.DictWriter(out_fd, fieldnames=l_field)
+        csv_writer.writeheader()
+        csv_writer.writerows(l_rec)
+    with open(out_prefix + '.json', 'w') as out_fd:
+        json.dump(l_rec, out_fd, indent=4)
+
+    l_line = ['%10s %-10s %6s %10s %10s %8s %10s %10s' % ('MB', 'mode', 'tasks', 'elapse', 'MB/s', 'speedup',
+                                                           'efficiency', 'peak MB')]
+    for rec in l_rec:
+        l_line.append('%10.1f %-10s %6d %10.4f %10.1f %8.2f %10.2f %10.1f'
+                      % (rec['corpus_mb'], rec['mode'], rec['cnt_task'], rec['elapse'], rec['mb_per_sec'],
+                         rec['speedup'], rec['efficiency'], max(rec['peak_rss_mb'], rec['peak_child_rss_mb'])))
+    logging.info('[bench_scaling] All done. Saved to %s.csv and %s.json:\n%s'
+                 % (out_prefix, out_prefix, '\n'.join(l_line)))
+    return l_rec
 
 
 if __name__ == '__main__':
@@ -210,15 +953,18 @@ if __name__ == '__main__':
 
     cmd = sys.argv[1]
     if cmd == 'gen_rand_strings':
-        if len(sys.argv) < 5:
+        if len(sys.argv) < 6:
             logging.error('[__main__] The format of this cmd is:\n'
-                          '> python parallelism.py gen_rand_strings [COUNT OF STRINGS] [MIN STRING LENGTH] [MAX STRING LENGTH] [OUTPUT PATH]')
+                          '> python parallelism.py gen_rand_strings [COUNT OF STRINGS] [MIN STRING LENGTH] [MAX STRING LENGTH] [OUTPUT PATH] '
+                          '[COUNT OF TASKS] [SEED]')
             sys.exit(-1)
         cnt_str = int(sys.argv[2])
         min_str_len = int(sys.argv[3])
         max_str_len = int(sys.argv[4])
         out_path = sys.argv[5]
-        gen_rand_strings(cnt_str, min_str_len, max_str_len, out_path)
+        cnt_task = int(sys.argv[6]) if len(sys.argv) > 6 else 1
+        seed = int(sys.argv[7]) if len(sys.argv) > 7 else None
+        gen_rand_strings(cnt_str, min_str_len, max_str_len, out_path, cnt_task, seed)
 
     elif cmd == 'single_task_multi_s_char_cnt':
         if len(sys.argv) < 2:
@@ -235,11 +981,72 @@ if __name__ == '__main__':
     elif cmd == 'multitask_multi_s_char_cnt':
         if len(sys.argv) < 2:
             logging.error('[__main__] The format of this cmd is:\n'
-                          '> python parallelism.py multitask_multi_s_char_cnt [INPUT PATH] [LIST OF CHARACTERS]')
+                          '> python parallelism.py multitask_multi_s_char_cnt [INPUT PATH] [LIST OF CHARACTERS] '
+                          '[COUNT OF TASKS] [TYPE: 0 - processes, 1 - threads, 2 - process pool]')
+            sys.exit(-1)
+        in_path = sys.argv[2]
+        if len(sys.argv) > 3:
+            l_s_char = list(sys.argv[3].strip())
+        else:
+            l_s_char = list(string.ascii_letters)
+        cnt_task = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count()
+        task_type = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+        multitask_multi_s_char_cnt(in_path, l_s_char, cnt_task, task_type)
+
+    elif cmd == 'bench_multi_s_char_cnt':
+        if len(sys.argv) < 3:
+            logging.error('[__main__] The format of this cmd is:\n'
+                          '> python parallelism.py bench_multi_s_char_cnt [INPUT PATH] [LIST OF CHARACTERS] '
+                          '[COUNT OF TASKS]')
+            sys.exit(-1)
+        logging.getLogger().setLevel(logging.INFO)
+        in_path = sys.argv[2]
+        if len(sys.argv) > 3:
+            l_s_char = list(sys.argv[3].strip())
+        else:
+            l_s_char = list(string.ascii_letters)
+        cnt_task = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count()
+        bench_multi_s_char_cnt(in_path, l_s_char, cnt_task)
+
+    elif cmd == 'stream_multi_s_char_cnt':
+        if len(sys.argv) < 3:
+            logging.error('[__main__] The format of this cmd is:\n'
+                          '> python parallelism.py stream_multi_s_char_cnt [INPUT PATH, - FOR STDIN] [LIST OF CHARACTERS] '
+                          '[REPORT INTERVAL IN SECONDS]')
             sys.exit(-1)
         in_path = sys.argv[2]
         if len(sys.argv) > 3:
             l_s_char = list(sys.argv[3].strip())
         else:
             l_s_char = list(string.ascii_letters)
-        multitask_multi_s_char_cnt(in_path, l_s_char)
+        report_sec = float(sys.argv[4]) if len(sys.argv) > 4 else None
+        if in_path == '-':
+            stream_multi_s_char_cnt(sys.stdin.buffer, l_s_char, report_sec)
+        else:
+            with open(in_path, 'rb') as in_fd:
+                stream_multi_s_char_cnt(in_fd, l_s_char, report_sec)
+
+    elif cmd == 'bench_scaling':
+        if len(sys.argv) < 5:
+            logging.error('[__main__] The format of this cmd is:\n'
+                          '> python parallelism.py bench_scaling [CORPUS SIZES IN MB, COMMA SEPARATED] [MAX COUNT OF TASKS] '
+                          '[OUTPUT PATH PREFIX] [COUNT OF REPEATS]')
+            sys.exit(-1)
+        logging.getLogger().setLevel(logging.INFO)
+        l_corpus_mb = [float(corpus_mb) for corpus_mb in sys.argv[2].split(',')]
+        max_task = int(sys.argv[3])
+        out_prefix = sys.argv[4]
+        cnt_repeat = int(sys.argv[5]) if len(sys.argv) > 5 else 3
+        bench_scaling(l_corpus_mb, max_task, out_prefix, cnt_repeat)
+
+    elif cmd == 'multi_pattern_cnt':
+        if len(sys.argv) < 4:
+            logging.error('[__main__] The format of this cmd is:\n'
+                          '> python parallelism.py multi_pattern_cnt [INPUT PATH] [PATTERNS, COMMA SEPARATED] '
+                          '[COUNT OF TASKS] [TYPE: 0 - processes, 1 - threads]')
+            sys.exit(-1)
+        in_path = sys.argv[2]
+        l_pattern = sys.argv[3].split(',')
+        cnt_task = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count()
+        task_type = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+        multi_pattern_cnt(in_path, l_pattern, cnt_task, task_type)
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import shutil
+import pathlib
+import hashlib
+
+
+##################################################
+#   Run Cache
+##################################################
+class RunCache:
+    """
+    A disk cache of run results keyed by (config hash, seed, code version).
+    Layout:
+        [ROOT]/[KEY]/
+            - meta.json: The key fields, the result names, the aggregates, and the total size in bytes.
+            - [NAME]: One result file for each name.
+    An entry is written into a temporary folder and renamed into place, so a reader never sees a partial entry. The
+    modification time of 'meta.json' is the last access time, and the least recently used entries are evicted
+    whenever the total size exceeds the quota.
+    """
+    META_FILE = 'meta.json'
+
+    # The root folder
+    m_root = None
+    # The disk quota in bytes
+    m_quota = None
+
+    def __init__(self, root, quota):
+        """
+        Constructor.
+        :param root: (str or pathlib.Path) The cache folder. Created if absent.
+        :param quota: (int) >0 The max total size of all entries in bytes.
+        """
+        self.m_root = pathlib.Path(root)
+        self.m_root.mkdir(parents=True, exist_ok=True)
+        self.m_quota = quota
+
+    @staticmethod
+    def get_code_version(l_src_path):
+        """
+        The code version is the SHA-256 of the source files affecting the results, so any edit invalidates the
+        entries of the old code.
+        :param l_src_path: (list of str or pathlib.Path)
+        :return: (str)
+        """
+        hasher = hashlib.sha256()
+        for src_path in l_src_path:
+            with open(src_path, 'rb') as in_fd:
+                hasher.update(in_fd.read())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def get_key(config_hash, seed, code_version):
+        """
+        :return: (str) A file name safe key.
+        """
+        key_str = '%s#%s#%s' % (config_hash, seed, code_version)
+        return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Look up an entry, and mark it as recently used.
+        :param key: (str) See `get_key`.
+        :return: (dict, dict) The path of each cached result by name, and the aggregates. (None, None) on a miss.
+        """
+        entry_folder = pathlib.Path(self.m_root, key)
+        meta_file = pathlib.Path(entry_folder, RunCache.META_FILE)
+        try:
+            with open(meta_file, 'r') as in_fd:
+                d_meta = json.load(in_fd)
+            os.utime(meta_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+        d_path = {name: pathlib.Path(entry_folder, name) for name in d_meta['l_name']}
+        if not all(path.exists() for path in d_path.values()):
+            return None, None
+        return d_path, d_meta['agg']
+
+    def put(self, key, d_path, d_agg=None, d_key_info=None):
+        """
+        Store the results of a run, and evict entries if over the quota.
+        :param key: (str) See `get_key`.
+        :param d_path: (dict) Result names to the files to be copied in.
+        :param d_agg: (dict) JSON serializable aggregates of the run.
+        :param d_key_info: (dict) JSON serializable key fields, for inspection only.
+        :return: None.
+        """
+        entry_folder = pathlib.Path(self.m_root, key)
+        if entry_folder.exists():
+            return
+        tmp_folder = pathlib.Path(self.m_root, '.tmp_%s_%s' % (key, os.getpid()))
+        tmp_folder.mkdir(parents=True)
+        size = 0
+        for name, src_path in d_path.items():
+            shutil.copyfile(src_path, pathlib.Path(tmp_folder, name))
+            size += os.path.getsize(src_path)
+        d_meta = {'key': d_key_info, 'l_name': list(d_path.keys()), 'agg': d_agg, 'size': size,
+                  'created': time.time()}
+        with open(pathlib.Path(tmp_folder, RunCache.META_FILE), 'w') as out_fd:
+            json.dump(d_meta, out_fd, indent=4)
+        try:
+            os.rename(tmp_folder, entry_folder)
+        except OSError:
+            # Another process has stored the same entry.
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total size is within the quota.
+        :return: (int) The number of entries removed.
+        """
+        l_entry = []
+        total_size = 0
+        for entry_folder in self.m_root.iterdir():
+            meta_file = pathlib.Path(entry_folder, RunCache.META_FILE)
+            if entry_folder.name.startswith('.') or not meta_file.exists():
+                continue
+            try:
+                with open(meta_file, 'r') as in_fd:
+                    size = json.load(in_fd)['size']
+                l_entry.append((os.path.getmtime(meta_file), size, entry_folder))
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                continue
+            total_size += size
+        cnt_evict = 0
+        for _, size, entry_folder in sorted(l_entry):
+            if total_size <= self.m_quota:
+                break
+            shutil.rmtree(entry_folder, ignore_errors=True)
+            total_size -= size
+            cnt_evict += 1
+        return cnt_evict
@@ -0,0 +1,317 @@
+import os
+import json
+import pathlib
+import typing
+import hashlib
+import dataclasses
+from dataclasses import dataclass, field
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+
+##################################################
+#   Run Config
+##################################################
+# Fields marked by `NO_HASH` tune the infrastructure only, and do not change the results of a run. They are left out
+# of the config hash.
+NO_HASH = {'hash': False}
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    The typed and frozen configuration of a run. It is validated once when created, and is cheap to pickle, so
+    workers receive it by value instead of re-reading config files.
+    The config hash is the SHA-256 of the canonical JSON of all fields but those marked by `NO_HASH`. Two runs with
+    the same hash and the same seed are duplicates.
+    The defaults below are the only defaults of the project. `GameConfig` takes its class attributes from them.
+    NOTE:
+        `DB_PASSWORD` is not a field, so that it never lands in config summaries.
+    """
+    # ----- Simulation Config -----#
+    # Max iterations
+    MAX_ITER: int = 2000
+    # Total number of agents
+    NUM_AGENTS: int = 500
+    # Number of neighbors for each agent
+    #   NOTE: Only applicable to cases of a constant number of neighbors.
+    NUM_NEIG: int = 10
+    # Probabilities of agents
+    H_PROB: float = 0.25
+    D_PROB: float = 0.25
+    Z_PROB: float = 0.5
+    # Initial energies
+    H_ENERGY: int = 500
+    D_ENERGY: int = 500
+    Z_ENERGY: int = 100
+    # ----- Zombie Config -----#
+    BITE_PROB: float = 0.3
+    # The energy increase from a bite.
+    BITE_GAIN: int = 5
+    # The energy change of being a Zombie
+    Z_DECAY: int = -1
+    # ----- Human Config -----#
+    # The energy change caused by a bite.
+    BITE_HURT: int = -5
+    # The energy change due to the infection.
+    H_DECAY: int = -1
+    # The energy increase due to the healing.
+    LIFE_GAIN: int = 1
+    # ----- Doctor Config -----#
+    BITE_EFF: int = 5
+
+    # ----- Orchestration Config -----#
+    # The number of worker processes. None for all cores up to `SIM_MAX_AUTO_WORKER`. The worker count sets the
+    # partitions and the seeds of workers, so the resolved count is hashed, see `get_n_worker`.
+    SIM_N_WORKER: typing.Optional[int] = None
+    # Each worker is a `BrClient` sharing the `BR_Q_EXP_LEN` credits of DataBroker, so the default worker count is
+    # bounded to keep the credit window of each worker above `BR_CREDIT_BATCH`.
+    SIM_MAX_AUTO_WORKER: int = field(default=8, metadata=NO_HASH)
+    # Persist the state of agents through DataBroker. Needs a running DataBroker, otherwise each snapshot stalls on
+    # credits.
+    SIM_EN_BROKER: bool = field(default=False, metadata=NO_HASH)
+    # Send a snapshot every this many ticks.
+    SIM_SNAP_INTERVAL: int = field(default=1, metadata=NO_HASH)
+    # Worker i binds its `BrClient` to this port + i. None lets the OS pick free ports, so concurrent runs never
+    # collide.
+    SIM_CLIENT_PORT_BASE: typing.Optional[int] = field(default=None, metadata=NO_HASH)
+    # Record structured events, one event file per worker. See `EventLog`.
+    SIM_EN_EVENT: bool = field(default=True, metadata=NO_HASH)
+    # Workers give up after waiting this many seconds at a barrier or for a message.
+    SIM_BARRIER_TIMEOUT: float = field(default=60.0, metadata=NO_HASH)
+
+    # ----- Transport Config -----#
+    # 'udp' or 'shm'. See `GameTransport`.
+    TRANSPORT: str = field(default='udp', metadata=NO_HASH)
+    # The requested receive buffer of UDP servers in bytes. The kernel caps it at `net.core.rmem_max`.
+    UDP_RCVBUF: int = field(default=4 << 20, metadata=NO_HASH)
+    # The max number of shared memory channels of each role.
+    SHM_MAX_CHANNEL: int = field(default=64, metadata=NO_HASH)
+    # The number of slots of each shared memory ring. Needs to be larger than `BR_CREDIT_WINDOW`.
+    SHM_N_SLOT: int = field(default=256, metadata=NO_HASH)
+    # The sleep time of a poll finding nothing.
+    SHM_POLL_SEC: float = field(default=0.0005, metadata=NO_HASH)
+    # The interval of discovering new shared memory channels.
+    SHM_SCAN_SEC: float = field(default=0.5, metadata=NO_HASH)
+
+    # ----- Logger Config -----#
+    LG_HOST: str = field(default='localhost', metadata=NO_HASH)
+    LG_PORT: int = field(default=1234, metadata=NO_HASH)
+    LG_BUFF_SIZE: int = field(default=4096, metadata=NO_HASH)
+    # A process ships its buffered log records in one message when any of the following holds:
+    #   - `LG_BATCH_MAX_REC` records are buffered.
+    #   - The next record would grow the message beyond `LG_BUFF_SIZE`.
+    #   - `LG_BATCH_FLUSH_SEC` has passed since the last shipping, checked at each record.
+    #   - A record at or above `LG_BATCH_FLUSH_LEVEL` arrives. 30 is `logging.WARNING`.
+    #   - The process exits.
+    LG_BATCH_MAX_REC: int = field(default=64, metadata=NO_HASH)
+    LG_BATCH_FLUSH_SEC: float = field(default=0.5, metadata=NO_HASH)
+    LG_BATCH_FLUSH_LEVEL: int = field(default=30, metadata=NO_HASH)
+    # The write buffer of the log file in bytes.
+    LG_FILE_BUFF_SIZE: int = field(default=1 << 16, metadata=NO_HASH)
+    # The max number of received batches waiting for the writer thread of the listener. A batch arriving at a full
+    # queue is dropped and counted, so that the receive loop never waits on the disk.
+    LG_WRITE_Q_LEN: int = field(default=1024, metadata=NO_HASH)
+    # Log file rotation: None, 'size' or 'time'.
+    LG_ROTATE: typing.Optional[str] = field(default=None, metadata=NO_HASH)
+    # 'size': Rotate when the file reaches this many bytes.
+    LG_ROTATE_MAX_BYTES: int = field(default=64 << 20, metadata=NO_HASH)
+    # 'time': Rotate at this interval, see `logging.handlers.TimedRotatingFileHandler`.
+    LG_ROTATE_WHEN: str = field(default='H', metadata=NO_HASH)
+    LG_ROTATE_INTERVAL: int = field(default=1, metadata=NO_HASH)
+    # The number of rotated files kept.
+    LG_ROTATE_BACKUP: int = field(default=10, metadata=NO_HASH)
+    # Gzip rotated files.
+    LG_ROTATE_GZIP: bool = field(default=True, metadata=NO_HASH)
+
+    # ----- Database Config -----#
+    DB_HOST: str = field(default='localhost', metadata=NO_HASH)
+    DB_PORT: int = field(default=5432, metadata=NO_HASH)
+    DB_NAME: str = field(default='zombie_game_db', metadata=NO_HASH)
+    DB_USER: str = field(default='fmeng', metadata=NO_HASH)
+    # Number of ticks of each partition of `agent_status`.
+    DB_TICK_PART_SIZE: int = field(default=100, metadata=NO_HASH)
+    # Bulk ingestion mode: `agent_status` is ingested unlogged and without indexes, and is finalized at the end.
+    DB_BULK_INGEST: bool = field(default=False, metadata=NO_HASH)
+
+    # ----- DataBroker Config -----#
+    BR_HOST: str = field(default='localhost', metadata=NO_HASH)
+    BR_PORT: int = field(default=2345, metadata=NO_HASH)
+    BR_BUFF_SIZE: int = field(default=10240, metadata=NO_HASH)
+    BR_Q_EXP_LEN: int = field(default=1000, metadata=NO_HASH)
+    # The max number of credits held by each client.
+    BR_CREDIT_WINDOW: int = field(default=64, metadata=NO_HASH)
+    # Credits are granted back in batches of this size, ...
+    BR_CREDIT_BATCH: int = field(default=16, metadata=NO_HASH)
+    # ... or after this many seconds.
+    BR_CREDIT_FLUSH_SEC: float = field(default=0.05, metadata=NO_HASH)
+    # A client waiting this many seconds for credits re-registers to resync its credits.
+    BR_CREDIT_TIMEOUT: float = field(default=1.0, metadata=NO_HASH)
+    # The max number of consecutive re-registrations before a client gives up.
+    BR_CREDIT_MAX_RETRY: int = field(default=10, metadata=NO_HASH)
+    # The number of DB workers, each holding one DB connection.
+    BR_DB_POOL_SIZE: int = field(default=4, metadata=NO_HASH)
+
+    def __post_init__(self):
+        self.__check_types()
+        self.__check_values()
+
+    def __check_types(self):
+        for fld in dataclasses.fields(self):
+            val = getattr(self, fld.name)
+            fld_type = fld.type
+            l_type_arg = typing.get_args(fld_type)
+            if typing.get_origin(fld_type) is typing.Union and type(None) in l_type_arg:
+                # `typing.Optional`
+                if val is None:
+                    continue
+                fld_type = [type_arg for type_arg in l_type_arg if type_arg is not type(None)][0]
+            # `bool` is a subclass of `int`, and is only taken by `bool` fields.
+            if fld_type in (int, 'int'):
+                is_valid = type(val) == int
+            elif fld_type in (float, 'float'):
+                is_valid = type(val) in (int, float)
+                if is_valid:
+                    object.__setattr__(self, fld.name, float(val))
+            elif fld_type in (bool, 'bool'):
+                is_valid = type(val) == bool
+            elif fld_type in (str, 'str'):
+                is_valid = type(val) == str
+            else:
+                is_valid = True
+            if not is_valid:
+                raise Exception('[RunConfig:__check_types] `%s` = %r is not of type %s.'
+                                % (fld.name, val, getattr(fld_type, '__name__', fld_type)))
+
+    def __check_values(self):
+        l_error = []
+        for name in ['MAX_ITER', 'NUM_AGENTS', 'NUM_NEIG', 'H_ENERGY', 'D_ENERGY', 'Z_ENERGY', 'SIM_MAX_AUTO_WORKER',
+                     'SIM_SNAP_INTERVAL', 'SIM_BARRIER_TIMEOUT', 'UDP_RCVBUF', 'SHM_MAX_CHANNEL', 'SHM_N_SLOT',
+                     'SHM_POLL_SEC', 'SHM_SCAN_SEC', 'LG_BUFF_SIZE', 'LG_BATCH_MAX_REC', 'LG_BATCH_FLUSH_SEC',
+                     'LG_FILE_BUFF_SIZE', 'LG_WRITE_Q_LEN', 'LG_ROTATE_MAX_BYTES', 'LG_ROTATE_INTERVAL',
+                     'DB_TICK_PART_SIZE', 'BR_BUFF_SIZE', 'BR_Q_EXP_LEN', 'BR_CREDIT_WINDOW', 'BR_CREDIT_BATCH',
+                     'BR_CREDIT_FLUSH_SEC', 'BR_CREDIT_TIMEOUT', 'BR_CREDIT_MAX_RETRY', 'BR_DB_POOL_SIZE']:
+            if getattr(self, name) <= 0:
+                l_error.append('`%s` needs to be positive.' % name)
+        if self.SIM_N_WORKER is not None and self.SIM_N_WORKER <= 0:
+            l_error.append('`SIM_N_WORKER` needs to be None or positive.')
+        for name in ['SIM_CLIENT_PORT_BASE', 'LG_PORT', 'DB_PORT', 'BR_PORT']:
+            if getattr(self, name) is not None and not 0 < getattr(self, name) < 65536:
+                l_error.append('`%s` needs to be a port number.' % name)
+        if self.TRANSPORT not in ('udp', 'shm'):
+            l_error.append("`TRANSPORT` needs to be 'udp' or 'shm'.")
+        if self.LG_ROTATE not in (None, 'size', 'time'):
+            l_error.append("`LG_ROTATE` needs to be None, 'size' or 'time'.")
+        if self.BR_CREDIT_BATCH > self.BR_CREDIT_WINDOW:
+            l_error.append('`BR_CREDIT_BATCH` needs to be at most `BR_CREDIT_WINDOW`.')
+        if self.SHM_N_SLOT <= self.BR_CREDIT_WINDOW:
+            l_error.append('`SHM_N_SLOT` needs to be larger than `BR_CREDIT_WINDOW`.')
+        for name in ['H_PROB', 'D_PROB', 'Z_PROB', 'BITE_PROB']:
+            if not 0.0 <= getattr(self, name) <= 1.0:
+                l_error.append('`%s` needs to be in [0, 1].' % name)
+        if abs(self.H_PROB + self.D_PROB + self.Z_PROB - 1.0) > 1e-9:
+            l_error.append('`H_PROB` + `D_PROB` + `Z_PROB` needs to be 1.')
+        for name in ['Z_DECAY', 'BITE_HURT', 'H_DECAY']:
+            if getattr(self, name) > 0:
+                l_error.append('`%s` needs to be non-positive.' % name)
+        for name in ['BITE_GAIN', 'LIFE_GAIN', 'BITE_EFF', 'LG_BATCH_FLUSH_LEVEL', 'LG_ROTATE_BACKUP']:
+            if getattr(self, name) < 0:
+                l_error.append('`%s` needs to be non-negative.' % name)
+        if self.NUM_NEIG > self.NUM_AGENTS:
+            l_error.append('`NUM_NEIG` needs to be at most `NUM_AGENTS`.')
+        if len(l_error) > 0:
+            raise Exception('[RunConfig:__check_values] Invalid config: %s' % ' '.join(l_error))
+
+    @staticmethod
+    def from_dict(d_config, base=None):
+        """
+        Create a config from a dict, on top of `base`.
+        :param d_config: (dict) Field names to values. Unknown names are rejected.
+        :param base: (RunConfig) The values of the fields absent from `d_config`. None for the defaults.
+        :return: (RunConfig)
+        """
+        s_name = {fld.name for fld in dataclasses.fields(RunConfig)}
+        l_unknown = sorted(set(d_config) - s_name)
+        if len(l_unknown) > 0:
+            raise Exception('[RunConfig:from_dict] Unknown config fields: %s' % l_unknown)
+        if base is None:
+            return RunConfig(**d_config)
+        return dataclasses.replace(base, **d_config)
+
+    @staticmethod
+    def from_file(config_file_path, base=None):
+        """
+        Load a config from a JSON ('.json') or TOML ('.toml') file. TOML tables are flattened, so the fields can be
+        grouped, e.g., under '[zombie]'.
+        :param config_file_path: (str or pathlib.Path)
+        :param base: (RunConfig) See `from_dict`.
+        :return: (RunConfig)
+        """
+        config_file_path = pathlib.Path(config_file_path)
+        if not config_file_path.exists():
+            raise Exception('[RunConfig:from_file] Config file does not exist: %s' % config_file_path)
+        if config_file_path.suffix == '.toml':
+            if tomllib is None:
+                raise Exception('[RunConfig:from_file] TOML needs Python 3.11+: %s' % config_file_path)
+            with open(config_file_path, 'rb') as in_fd:
+                d_raw = tomllib.load(in_fd)
+            d_config = dict()
+            for key, val in d_raw.items():
+                if isinstance(val, dict):
+                    d_config.update(val)
+                else:
+                    d_config[key] = val
+        else:
+            with open(config_file_path, 'r') as in_fd:
+                d_config = json.load(in_fd)
+        return RunConfig.from_dict(d_config, base=base)
+
+    def to_dict(self, only_hashed=False):
+        """
+        :param only_hashed: (bool) Leave out the fields marked by `NO_HASH`.
+        :return: (dict)
+        """
+        return {fld.name: getattr(self, fld.name) for fld in dataclasses.fields(self)
+                if not only_hashed or fld.metadata.get('hash', True)}
+
+    def get_n_worker(self):
+        """
+        Resolve the number of worker processes of the lockstep simulation on this host.
+        :return: (int)
+        """
+        if self.SIM_N_WORKER is not None:
+            n_worker = self.SIM_N_WORKER
+        else:
+            n_worker = min(os.cpu_count() or 1, self.SIM_MAX_AUTO_WORKER)
+        return max(1, min(n_worker, self.NUM_AGENTS))
+
+    def get_hash(self):
+        """
+        The worker count is hashed as resolved, since a default `SIM_N_WORKER` means different counts on different
+        hosts.
+        :return: (str) The hex SHA-256 of the hashed fields. Stable across processes and Python versions.
+        """
+        d_hashed = self.to_dict(only_hashed=True)
+        d_hashed['SIM_N_WORKER'] = self.get_n_worker()
+        config_str = json.dumps(d_hashed, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(config_str.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def dedup(l_run_config):
+        """
+        Drop the duplicates of a sweep, i.e., the configs with the same hash as an earlier one.
+        :param l_run_config: (list of RunConfig)
+        :return: (list of RunConfig) In the original order.
+        """
+        s_hash = set()
+        l_uniq = []
+        for run_config in l_run_config:
+            config_hash = run_config.get_hash()
+            if config_hash in s_hash:
+                continue
+            s_hash.add(config_hash)
+            l_uniq.append(run_config)
+        return l_uniq
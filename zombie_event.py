@@ -0,0 +1,408 @@
+import os
+import pathlib
+import struct
+
+import numpy as np
+
+
+##################################################
+#   Event Definitions
+##################################################
+# Event types
+EV_BITE = 1
+EV_CURE = 2
+EV_DEATH = 4
+
+EV_NAMES = {EV_BITE: 'BITE', EV_CURE: 'CURE', EV_DEATH: 'DEATH'}
+
+# Event record
+#   - tick: The moment of the event.
+#   - etype: Event type.
+#   - actor: The aid of the agent who acts, e.g., the Zombie of a bite, the Doctor of a cure.
+#   - target: The aid of the agent acted on. Equal to `actor` for a self-treatment and a death.
+#   - e_before, e_after: The energy of the target before and after the event. 32-bit, as energies are only bounded
+#     by the initial energies and the gains of the config.
+EVENT_DTYPE = np.dtype([('tick', '<i4'), ('etype', '<u1'), ('actor', '<i4'), ('target', '<i4'),
+                        ('e_before', '<i4'), ('e_after', '<i4')])
+# The event record of version 1 files, with 16-bit energies.
+EVENT_DTYPE_V1 = np.dtype([('tick', '<i4'), ('etype', '<u1'), ('actor', '<i4'), ('target', '<i4'),
+                           ('e_before', '<i2'), ('e_after', '<i2')])
+
+# The number of records buffered in memory before being appended to the file.
+EVENT_BUFF_LEN = 1 << 16
+
+
+##################################################
+#   Event Log
+##################################################
+class EventLog:
+    """
+    An appendable binary file of event records.
+    File Format:
+        - Header: magic (4 bytes, b'ZEVT'), version (uint16), record size (uint16), little-endian.
+        - Body: Packed records of `EVENT_DTYPE`, or `EVENT_DTYPE_V1` for version 1 files.
+    Emitting a record only writes into a preallocated buffer, which is appended to the file when it is full.
+    """
+    MAGIC = b'ZEVT'
+    VERSION = 2
+    HDR = struct.Struct('<4sHH')
+    # The record of each readable version.
+    D_VERSION_DTYPE = {1: EVENT_DTYPE_V1, 2: EVENT_DTYPE}
+
+    # The output file
+    m_path = None
+    # The file descriptor
+    m_fd = None
+    # The record buffer
+    m_nd_buff = None
+    # The number of records in the buffer
+    m_cnt_buff = None
+    # The number of records emitted
+    m_cnt_event = None
+
+    def __init__(self, path, buff_len=EVENT_BUFF_LEN):
+        """
+        Constructor. Appends to `path` if it exists.
+        :param path: (str or pathlib.Path) The event file.
+        :param buff_len: (int) >0 The number of records buffered.
+        """
+        self.m_path = pathlib.Path(path)
+        is_new = not self.m_path.exists() or os.path.getsize(self.m_path) == 0
+        if not is_new and EventLog.__check_header(self.m_path) != EVENT_DTYPE:
+            raise Exception('[EventLog:__init__] Cannot append to an event file of an older version: %s'
+                            % self.m_path)
+        self.m_fd = open(self.m_path, 'ab')
+        if is_new:
+            self.m_fd.write(EventLog.HDR.pack(EventLog.MAGIC, EventLog.VERSION, EVENT_DTYPE.itemsize))
+        self.m_nd_buff = np.empty(buff_len, dtype=EVENT_DTYPE)
+        self.m_cnt_buff = 0
+        self.m_cnt_event = 0
+
+    @staticmethod
+    def __check_header(path):
+        """
+        :param path: (str or pathlib.Path) The event file.
+        :return: (numpy.dtype) The record of the file version.
+        """
+        with open(path, 'rb') as in_fd:
+            hdr = in_fd.read(EventLog.HDR.size)
+        if len(hdr) < EventLog.HDR.size:
+            raise Exception('[EventLog:__check_header] Truncated header: %s' % path)
+        magic, version, rec_size = EventLog.HDR.unpack(hdr)
+        rec_dtype = EventLog.D_VERSION_DTYPE.get(version)
+        if magic != EventLog.MAGIC or rec_dtype is None or rec_size != rec_dtype.itemsize:
+            raise Exception('[EventLog:__check_header] Not an event file of versions %s: %s'
+                            % (sorted(EventLog.D_VERSION_DTYPE), path))
+        return rec_dtype
+
+    def emit(self, tick, etype, actor, target, e_before, e_after):
+        """
+        Record an event.
+        :return: None.
+        """
+        self.m_nd_buff[self.m_cnt_buff] = (tick, etype, actor, target, e_before, e_after)
+        self.m_cnt_buff += 1
+        self.m_cnt_event += 1
+        if self.m_cnt_buff >= len(self.m_nd_buff):
+            self.flush()
+
+    def emit_array(self, tick, etype, nd_actor, nd_target, nd_e_before, nd_e_after):
+        """
+        Record a batch of events of the same tick and type.
+        :param nd_actor, nd_target, nd_e_before, nd_e_after: (1D-ndarray) Of the same length.
+        :return: None.
+        """
+        cnt = len(nd_actor)
+        if cnt <= 0:
+            return
+        if self.m_cnt_buff + cnt > len(self.m_nd_buff):
+            self.flush()
+        if cnt > len(self.m_nd_buff):
+            nd_event = np.empty(cnt, dtype=EVENT_DTYPE)
+        else:
+            nd_event = self.m_nd_buff[self.m_cnt_buff:self.m_cnt_buff + cnt]
+        nd_event['tick'] = tick
+        nd_event['etype'] = etype
+        nd_event['actor'] = nd_actor
+        nd_event['target'] = nd_target
+        nd_event['e_before'] = nd_e_before
+        nd_event['e_after'] = nd_e_after
+        if cnt > len(self.m_nd_buff):
+            self.m_fd.write(nd_event.tobytes())
+        else:
+            self.m_cnt_buff += cnt
+        self.m_cnt_event += cnt
+
+    def flush(self):
+        if self.m_cnt_buff <= 0:
+            return
+        self.m_fd.write(self.m_nd_buff[:self.m_cnt_buff].tobytes())
+        self.m_fd.flush()
+        self.m_cnt_buff = 0
+
+    def get_cnt_event(self):
+        return self.m_cnt_event
+
+    def close(self):
+        if self.m_fd is None:
+            return
+        self.flush()
+        self.m_fd.close()
+        self.m_fd = None
+
+    @staticmethod
+    def load(path, etype=None, mmap=False):
+        """
+        Load events into a structured array without parsing any text.
+        :param path: (str or pathlib.Path) The event file.
+        :param etype: (int) Keep only the events whose types are in this bit mask. None keeps all.
+        :param mmap: (bool) Memory-map the file instead of reading it. Ignored if `etype` is given, or for a version 1
+            file, which is converted.
+        :return: (1D-ndarray of EVENT_DTYPE)
+        """
+        rec_dtype = EventLog.__check_header(path)
+        if mmap and etype is None and rec_dtype == EVENT_DTYPE:
+            return np.memmap(path, dtype=EVENT_DTYPE, mode='r', offset=EventLog.HDR.size)
+        nd_event = np.fromfile(path, dtype=rec_dtype, offset=EventLog.HDR.size)
+        if rec_dtype != EVENT_DTYPE:
+            nd_event = nd_event.astype(EVENT_DTYPE)
+        if etype is not None:
+            nd_event = nd_event[(nd_event['etype'] & etype) != 0]
+        return nd_event
+
+    @staticmethod
+    def load_df(path, etype=None):
+        """
+        Load events into a DataFrame.
+        :return: (DataFrame) Columns: 'tick', 'etype', 'actor', 'target', 'e_before', 'e_after'
+        """
+        import pandas as pd
+
+        return pd.DataFrame(EventLog.load(path, etype=etype))
+
+
+##################################################
+#   Event Index
+##################################################
+class EventIndex:
+    """
+    An index over the bite and cure events for lineage and rate queries.
+        - Bites as a CSR adjacency by source agent: The bites of the Zombie `aid` are
+          `m_nd_bite_dst[m_nd_bite_ptr[aid]:m_nd_bite_ptr[aid + 1]]`, at ticks `m_nd_bite_tick[...]`, in tick order.
+        - Cures as a CSR adjacency by Doctor likewise, excluding self-treatments.
+        - All bite and cure events sorted by tick, for tick range queries.
+        - The first infection tick of each agent, -1 if never bitten.
+    """
+    # The number of agents, i.e., the max aid + 1.
+    m_n_agent = None
+    # Bite CSR
+    m_nd_bite_ptr = None
+    m_nd_bite_dst = None
+    m_nd_bite_tick = None
+    # Cure CSR
+    m_nd_cure_ptr = None
+    m_nd_cure_dst = None
+    m_nd_cure_tick = None
+    # Bite and cure events sorted by tick
+    m_nd_event = None
+    # The first infection tick of each agent
+    m_nd_inf_tick = None
+
+    def __init__(self, nd_event):
+        """
+        Constructor.
+        :param nd_event: (1D-ndarray of EVENT_DTYPE) Events of any types. Only bites and cures are indexed.
+        """
+        nd_event = nd_event[(nd_event['etype'] & (EV_BITE | EV_CURE)) != 0]
+        self.m_n_agent = int(max(nd_event['actor'].max(initial=-1), nd_event['target'].max(initial=-1))) + 1
+        self.m_nd_event = nd_event[np.argsort(nd_event['tick'], kind='stable')]
+
+        nd_bite = self.m_nd_event[self.m_nd_event['etype'] == EV_BITE]
+        self.m_nd_bite_ptr, self.m_nd_bite_dst, self.m_nd_bite_tick = self.__build_csr(nd_bite)
+        nd_cure = self.m_nd_event[self.m_nd_event['etype'] == EV_CURE]
+        nd_cure = nd_cure[nd_cure['actor'] != nd_cure['target']]
+        self.m_nd_cure_ptr, self.m_nd_cure_dst, self.m_nd_cure_tick = self.__build_csr(nd_cure)
+
+        # Bites are in tick order, so the first bite of each target is its first infection.
+        self.m_nd_inf_tick = np.full(self.m_n_agent, -1, dtype=np.int64)
+        nd_target, nd_first = np.unique(nd_bite['target'], return_index=True)
+        self.m_nd_inf_tick[nd_target] = nd_bite['tick'][nd_first]
+
+    def __build_csr(self, nd_edge):
+        """
+        :param nd_edge: (1D-ndarray of EVENT_DTYPE) Edges from 'actor' to 'target' in tick order.
+        :return: (1D-ndarray, 1D-ndarray, 1D-ndarray) Row pointers, destinations, and ticks.
+        """
+        # A stable sort by source keeps each row in tick order.
+        nd_order = np.argsort(nd_edge['actor'], kind='stable')
+        nd_ptr = np.zeros(self.m_n_agent + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nd_edge['actor'], minlength=self.m_n_agent), out=nd_ptr[1:])
+        return nd_ptr, nd_edge['target'][nd_order].astype(np.int64), nd_edge['tick'][nd_order].astype(np.int64)
+
+    @staticmethod
+    def from_file(path):
+        return EventIndex(EventLog.load(path, etype=EV_BITE | EV_CURE))
+
+    @staticmethod
+    def __gather(nd_ptr, nd_src):
+        """
+        The positions of all edges of the sources in a CSR, without a Python loop over the sources.
+        :return: (1D-ndarray, 1D-ndarray) Edge positions, and the index into `nd_src` of each edge.
+        """
+        nd_start = nd_ptr[nd_src]
+        nd_len = nd_ptr[nd_src + 1] - nd_start
+        nd_owner = np.repeat(np.arange(len(nd_src)), nd_len)
+        nd_offset = np.arange(nd_len.sum()) - np.repeat(np.cumsum(nd_len) - nd_len, nd_len)
+        return nd_start[nd_owner] + nd_offset, nd_owner
+
+    def get_descendants(self, aid, max_tick=None):
+        """
+        The agents infected down the chain of bites from `aid` by `max_tick`. A bite extends the chain only if it
+        happens no earlier than the infection of the biter. Each descendant is counted at its earliest infection
+        reachable from `aid`.
+        This is an earliest-arrival search: each agent carries the earliest reachable infection tick found so far, a
+        bite is followed only if it happens no earlier than the label of the biter, and an agent is searched again
+        whenever its label improves, since a later label may have hidden some of its bites.
+        :param aid: (int) The patient zero.
+        :param max_tick: (int) Only bites at or before this tick count. None counts all.
+        :return: (DataFrame) Columns: 'aid', 'tick', 'gen' (the number of bites from `aid` on the earliest chain, 1
+            for the direct victims of `aid`), sorted by 'tick'. Empty for an agent in no event.
+        """
+        import pandas as pd
+
+        if aid < 0:
+            raise Exception('[EventIndex:get_descendants] Invalid aid: %s' % aid)
+        if aid >= self.m_n_agent:
+            nd_empty = np.zeros(0, dtype=np.int64)
+            return pd.DataFrame({'aid': nd_empty, 'tick': nd_empty, 'gen': nd_empty})
+        if max_tick is None:
+            max_tick = np.iinfo(np.int64).max
+        nd_best_tick = np.full(self.m_n_agent, np.iinfo(np.int64).max, dtype=np.int64)
+        nd_best_tick[aid] = np.iinfo(np.int64).min
+        nd_gen = np.zeros(self.m_n_agent, dtype=np.int64)
+        nd_front = np.array([aid], dtype=np.int64)
+        while len(nd_front) > 0:
+            nd_pos, nd_owner = EventIndex.__gather(self.m_nd_bite_ptr, nd_front)
+            nd_src = nd_front[nd_owner]
+            nd_dst = self.m_nd_bite_dst[nd_pos]
+            nd_tick = self.m_nd_bite_tick[nd_pos]
+            nd_keep = (nd_tick >= nd_best_tick[nd_src]) & (nd_tick <= max_tick) & (nd_tick < nd_best_tick[nd_dst])
+            nd_src, nd_dst, nd_tick = nd_src[nd_keep], nd_dst[nd_keep], nd_tick[nd_keep]
+            # Keep the earliest bite of each improved victim, with the fewest generations on ties.
+            nd_order = np.lexsort((nd_gen[nd_src], nd_tick, nd_dst))
+            nd_src, nd_dst, nd_tick = nd_src[nd_order], nd_dst[nd_order], nd_tick[nd_order]
+            nd_dst, nd_first = np.unique(nd_dst, return_index=True)
+            nd_best_tick[nd_dst] = nd_tick[nd_first]
+            nd_gen[nd_dst] = nd_gen[nd_src[nd_first]] + 1
+            nd_front = nd_dst
+        nd_best_tick[aid] = np.iinfo(np.int64).max
+        nd_desc = np.flatnonzero(nd_best_tick < np.iinfo(np.int64).max)
+        df_desc = pd.DataFrame({'aid': nd_desc, 'tick': nd_best_tick[nd_desc], 'gen': nd_gen[nd_desc]})
+        return df_desc.sort_values('tick', kind='stable', ignore_index=True)
+
+    def get_events_in_range(self, start_tick, end_tick):
+        """
+        :return: (1D-ndarray of EVENT_DTYPE) Bites and cures with `start_tick` <= tick < `end_tick`.
+        """
+        start, end = np.searchsorted(self.m_nd_event['tick'], [start_tick, end_tick], side='left')
+        return self.m_nd_event[start:end]
+
+    def get_incidence(self):
+        """
+        :return: (1D-ndarray) The number of first infections at each tick, indexed by tick.
+        """
+        nd_inf_tick = self.m_nd_inf_tick[self.m_nd_inf_tick >= 0]
+        return np.bincount(nd_inf_tick, minlength=int(self.m_nd_event['tick'].max(initial=-1)) + 1)
+
+    def get_r_over_time(self):
+        """
+        The case reproduction number by infection tick, i.e., the mean number of bites made by the agents first
+        infected at each tick. Agents that bite without ever being bitten, e.g., the initial Zombies, are not in
+        any cohort.
+        :return: (DataFrame) Columns: 'tick', 'n_infected', 'r'. Only ticks with new infections.
+        """
+        nd_offspring = np.diff(self.m_nd_bite_ptr)
+        nd_is_inf = self.m_nd_inf_tick >= 0
+        nd_inf_tick = self.m_nd_inf_tick[nd_is_inf]
+        nd_n_inf = np.bincount(nd_inf_tick)
+        nd_n_bite = np.bincount(nd_inf_tick, weights=nd_offspring[nd_is_inf], minlength=len(nd_n_inf))
+        nd_tick = np.flatnonzero(nd_n_inf)
+        import pandas as pd
+
+        return pd.DataFrame({'tick': nd_tick, 'n_infected': nd_n_inf[nd_tick],
+                             'r': nd_n_bite[nd_tick] / nd_n_inf[nd_tick]})
+
+    def get_top_curers(self, k=10, max_tick=None):
+        """
+        The Doctors who cured the most other agents.
+        :param k: (int) The number of Doctors returned.
+        :param max_tick: (int) Only cures at or before this tick count. None counts all.
+        :return: (DataFrame) Columns: 'aid', 'n_cure', in descending 'n_cure'.
+        """
+        if max_tick is None:
+            nd_n_cure = np.diff(self.m_nd_cure_ptr)
+        else:
+            # Map each cure by `max_tick` back to its CSR row.
+            nd_by_tick = np.flatnonzero(self.m_nd_cure_tick <= max_tick)
+            nd_owner = np.searchsorted(self.m_nd_cure_ptr, nd_by_tick, side='right') - 1
+            nd_n_cure = np.bincount(nd_owner, minlength=self.m_n_agent)
+        k = min(k, int(np.count_nonzero(nd_n_cure)))
+        nd_top = np.argpartition(-nd_n_cure, k - 1)[:k] if k > 0 else np.array([], dtype=np.int64)
+        nd_top = nd_top[np.argsort(-nd_n_cure[nd_top], kind='stable')]
+        import pandas as pd
+
+        return pd.DataFrame({'aid': nd_top, 'n_cure': nd_n_cure[nd_top]})
+
+
+def utest_EventLog():
+    """
+    Energies beyond 16 bits round-trip, and version 1 files are still readable.
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        event_path = pathlib.Path(tmp_dir, 'events.bin')
+        event_log = EventLog(event_path)
+        event_log.emit(1, EV_CURE, 0, 1, 40000, 40005)
+        event_log.close()
+        nd_event = EventLog.load(event_path)
+        if (int(nd_event[0]['e_before']), int(nd_event[0]['e_after'])) != (40000, 40005):
+            raise Exception('[utest_EventLog] Wrong energies: %s' % nd_event[0])
+        event_path_v1 = pathlib.Path(tmp_dir, 'events_v1.bin')
+        with open(event_path_v1, 'wb') as out_fd:
+            out_fd.write(EventLog.HDR.pack(EventLog.MAGIC, 1, EVENT_DTYPE_V1.itemsize))
+            out_fd.write(np.array([(2, EV_BITE, 3, 4, 100, 95)], dtype=EVENT_DTYPE_V1).tobytes())
+        nd_event = EventLog.load(event_path_v1, mmap=True)
+        if nd_event.dtype != EVENT_DTYPE or int(nd_event[0]['e_after']) != 95:
+            raise Exception('[utest_EventLog] Wrong version 1 events: %s' % nd_event)
+    print('[utest_EventLog] Passed.')
+
+
+def utest_EventIndex():
+    """
+    A later direct bite must not hide an earlier chain: 0->1@1, 1->2@2, 2->3@3, 0->3@100, 3->4@50. Agent 3 is
+    infected at tick 3 through 1 and 2, and so infects 4 at tick 50.
+    """
+    nd_event = np.zeros(5, dtype=EVENT_DTYPE)
+    nd_event['etype'] = EV_BITE
+    for idx, (actor, target, tick) in enumerate([(0, 1, 1), (1, 2, 2), (2, 3, 3), (0, 3, 100), (3, 4, 50)]):
+        nd_event[idx]['actor'] = actor
+        nd_event[idx]['target'] = target
+        nd_event[idx]['tick'] = tick
+    df_desc = EventIndex(nd_event).get_descendants(0)
+    l_desc = list(zip(df_desc['aid'], df_desc['tick'], df_desc['gen']))
+    if l_desc != [(1, 1, 1), (2, 2, 2), (3, 3, 3), (4, 50, 4)]:
+        raise Exception('[utest_EventIndex] Wrong descendants: %s' % l_desc)
+    df_desc = EventIndex(nd_event).get_descendants(0, max_tick=40)
+    if list(df_desc['aid']) != [1, 2, 3]:
+        raise Exception('[utest_EventIndex] Wrong descendants by tick 40: %s' % list(df_desc['aid']))
+    # An agent in no event, e.g., a late-spawned one, has no descendants.
+    df_desc = EventIndex(nd_event).get_descendants(10)
+    if len(df_desc) != 0 or list(df_desc.columns) != ['aid', 'tick', 'gen']:
+        raise Exception('[utest_EventIndex] Wrong descendants of an agent in no event: %s' % df_desc)
+    print('[utest_EventIndex] Passed.')
+
+
+if __name__ == '__main__':
+    utest_EventLog()
+    utest_EventIndex()
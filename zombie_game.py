@@ -5,15 +5,26 @@ import os
 import sys
 import pathlib
 import time
+import math
 from datetime import datetime
 import json
+import re
 import multiprocessing as mp
 import socket
+from multiprocessing import shared_memory, resource_tracker
+import struct
+import asyncio
+import queue
+import dataclasses
+import threading
+import gzip
+import shutil
+import contextlib
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import psycopg as pg
+
+from zombie_config import RunConfig
+from zombie_event import EventLog, EV_BITE, EV_CURE, EV_DEATH
 
 
 ##################################################
@@ -29,12 +40,8 @@ RUN_ID = 'test_only'
 # RUN_ID file
 RUN_ID_FILE = pathlib.Path('.', 'RUN_ID')
 
-# Output folder:
+# Output folder: Keyed by the config hash, see `set_out_folder`. Created by `run_init`.
 OUT_FOLDER = pathlib.Path(pathlib.Path.cwd(), 'out', RUN_ID)
-if not OUT_FOLDER.exists():
-    OUT_FOLDER.mkdir(parents=True)
-else:
-    raise Exception('Output Folder %s already existed.' % OUT_FOLDER)
 
 # Log level
 LOG_LEVEL = logging.DEBUG
@@ -42,12 +49,43 @@ LOG_LEVEL = logging.DEBUG
 
 # Log file
 LOG_FILE = pathlib.Path(OUT_FOLDER, '%s.log' % RUN_ID)
-if os.path.exists(LOG_FILE):
-    os.remove(LOG_FILE)
 
 # Config summary file
 CONFIG_SUM_FILE = pathlib.Path(OUT_FOLDER, 'config_%s.json' % RUN_ID)
 
+
+def set_out_folder(config_hash):
+    """
+    Key the output folder by the config hash, i.e., 'out/[RUN_ID]/[CONFIG_HASH]', so that the runs of different
+    configs never share a folder. Invoked by `GameConfig.set_run_config` in every process, so that workers write to
+    the same folder as the main process.
+    :param config_hash: (str) See `RunConfig.get_hash`.
+    :return: None.
+    """
+    global OUT_FOLDER, LOG_FILE, CONFIG_SUM_FILE
+    OUT_FOLDER = pathlib.Path(pathlib.Path.cwd(), 'out', RUN_ID, config_hash[:16])
+    if LOG_FILE is not None:
+        LOG_FILE = pathlib.Path(OUT_FOLDER, '%s.log' % RUN_ID)
+    CONFIG_SUM_FILE = pathlib.Path(OUT_FOLDER, 'config_%s.json' % RUN_ID)
+
+
+def run_init():
+    """
+    Set up the output of this run. Importing this module touches no files, so that workers and tests can import it
+    freely, and the main process calls this once before starting the run.
+    Heavy dependencies, e.g., psycopg, are imported on first use.
+    NOTE:
+        Call this after `GameConfig.config_init`, since the output folder is keyed by the config hash.
+    :return: None.
+    """
+    GameConfig.get_run_config()
+    if OUT_FOLDER.exists():
+        raise Exception('Output Folder %s already existed.' % OUT_FOLDER)
+    OUT_FOLDER.mkdir(parents=True)
+    if LOG_FILE is not None and os.path.exists(LOG_FILE):
+        os.remove(LOG_FILE)
+    GameTransport.clear_stale()
+
 # Agent types
 HUMAN = 1
 DOCTOR = 2
@@ -62,14 +100,86 @@ DEAD = 4
 ##################################################
 #   Simulation
 ##################################################
+class SimState:
+    """
+    The global state of all agents as a structure of arrays in one shared memory segment, indexed by aid. Each
+    worker writes only the slice of its own partition, and reads all of it.
+    The segment name is generated by `SharedMemory`, so that concurrent runs never collide, and is passed to the
+    workers by value.
+    """
+    # The columns of the global state.
+    STATE_DTYPE = [('role', np.int16), ('state', np.int16), ('energy', np.int32), ('bite_start', np.int32)]
+
+    def __init__(self, shm, num_agents, is_owner):
+        self.m_shm = shm
+        self.m_is_owner = is_owner
+        self.m_num_agents = num_agents
+        offset = 0
+        for col, col_dtype in SimState.STATE_DTYPE:
+            setattr(self, 'm_nd_%s' % col, np.ndarray((num_agents,), dtype=col_dtype, buffer=shm.buf, offset=offset))
+            offset += num_agents * np.dtype(col_dtype).itemsize
+
+    @staticmethod
+    def get_size(num_agents):
+        return sum(num_agents * np.dtype(col_dtype).itemsize for _, col_dtype in SimState.STATE_DTYPE)
+
+    def get_name(self):
+        """
+        :return: (str) The segment name to be passed to `attach`.
+        """
+        return self.m_shm.name
+
+    @staticmethod
+    def create(num_agents):
+        shm = shared_memory.SharedMemory(create=True, size=SimState.get_size(num_agents))
+        return SimState(shm, num_agents, True)
+
+    @staticmethod
+    def attach(shm_name, num_agents):
+        """
+        :param shm_name: (str) See `get_name`.
+        :param num_agents: (int)
+        :return: (SimState)
+        """
+        shm = shared_memory.SharedMemory(name=shm_name, create=False)
+        # The segment is owned by the main process.
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return SimState(shm, num_agents, False)
+
+    def close(self):
+        for col, _ in SimState.STATE_DTYPE:
+            setattr(self, 'm_nd_%s' % col, None)
+        self.m_shm.close()
+        if self.m_is_owner:
+            # A process attached from a fork shares the resource tracker of the owner, and has unregistered the
+            # segment. Register it again so that `unlink` unregisters it cleanly.
+            resource_tracker.register(self.m_shm._name, 'shared_memory')
+            self.m_shm.unlink()
+
+
 class ZombieGameSim:
-    # (class variable) The current moment
+    """
+    Runs the agents across `GameConfig.SIM_N_WORKER` worker processes. The agents are split into contiguous
+    partitions of aids, one for each worker, and the global state lives in `SimState`. Each tick has two phases
+    separated by a barrier:
+        - Decide: Each worker reads the global state as of the start of the tick, and decides the bites of its
+          Zombies and the cures of its Doctors. The interactions targeting agents of other partitions are sent to
+          their owners, exactly one message to each peer per tick, possibly empty.
+        - Apply: Each worker applies the cures and then the bites targeting its partition, updates its agents, and
+          writes its slice of the global state. The snapshot of its partition is sent to DataBroker.
+    As all agents see the same state within a tick, the results differ from the sequential updates of
+    zombie_simple, e.g., two Zombies may bite the same Human in a tick, and both gain from it.
+    Message between workers: (tick, sender, bite actors, bite targets, cure actors, cure targets).
+    """
+    # (class variable) The current moment, shared by all processes.
     m_cur_moment = None
     # Instance of GameLog
     m_logger = None
 
     def __init__(self):
         self.m_logger = GameLog()
+        if ZombieGameSim.m_cur_moment is None:
+            ZombieGameSim.m_cur_moment = mp.Value('i', -1)
 
     def get_logger(self, logger_name=None):
         if self.m_logger is None:
@@ -78,24 +188,346 @@ class ZombieGameSim:
 
     @classmethod
     def GET_CUR_MOMENT(cls):
-        return ZombieGameSim.m_cur_moment
+        if ZombieGameSim.m_cur_moment is None:
+            return None
+        return ZombieGameSim.m_cur_moment.value
+
+    @staticmethod
+    def get_full_energy_lut():
+        """
+        :return: (1D-ndarray) The full energy of each role, indexed by role.
+        """
+        nd_full = np.zeros(ZOMBIE + 1, dtype=np.int32)
+        nd_full[HUMAN] = GameConfig.H_ENERGY
+        nd_full[DOCTOR] = GameConfig.D_ENERGY
+        nd_full[ZOMBIE] = GameConfig.Z_ENERGY
+        return nd_full
+
+    def start(self, seed=None):
+        """
+        Initialize the agents, run all ticks on the workers, and collect the final state.
+        :param seed: (int) The seed of the run. None for a random run.
+        :return: (dict) The final counts of agents by role and state, e.g., {'HUMAN_ALIVE': 10, ...}
+        """
+        logger = self.get_logger('SIM_MAIN')
+        run_config = GameConfig.get_run_config()
+        n_worker = run_config.get_n_worker()
+        if GameConfig.SIM_EN_BROKER and GameConfig.BR_Q_EXP_LEN // n_worker < GameConfig.BR_CREDIT_BATCH:
+            logger.warning('[ZombieGameSim:start] %s workers share %s broker credits, fewer than `BR_CREDIT_BATCH` '
+                           'each. Snapshots will stall on credits.' % (n_worker, GameConfig.BR_Q_EXP_LEN))
+        seed_seq = np.random.SeedSequence(seed)
+        l_worker_seed = seed_seq.spawn(n_worker)
+
+        # Agents of each role are placed at random aids, so that every partition gets a similar mix.
+        rng = np.random.default_rng(seed_seq)
+        nd_agent_cnt = rng.multinomial(GameConfig.NUM_AGENTS, pvals=[GameConfig.H_PROB, GameConfig.D_PROB,
+                                                                     GameConfig.Z_PROB])
+        sim_state = SimState.create(GameConfig.NUM_AGENTS)
+        try:
+            sim_state.m_nd_role[:] = rng.permutation(np.repeat([HUMAN, DOCTOR, ZOMBIE], nd_agent_cnt))
+            sim_state.m_nd_state[:] = ALIVE
+            sim_state.m_nd_energy[:] = ZombieGameSim.get_full_energy_lut()[sim_state.m_nd_role]
+            sim_state.m_nd_bite_start[:] = -1
+            logger.info('[ZombieGameSim:start] %s Humans, %s Doctors, and %s Zombies have joined the game on %s '
+                        'workers.' % (nd_agent_cnt[0], nd_agent_cnt[1], nd_agent_cnt[2], n_worker))
+
+            nd_bound = np.linspace(0, GameConfig.NUM_AGENTS, n_worker + 1).astype(np.int64)
+            l_inbox = [mp.Queue() for _ in range(n_worker)]
+            barrier = mp.Barrier(n_worker)
+            start_time = time.time()
+            l_worker = [mp.Process(target=ZombieGameSim.__worker_func,
+                                   args=(wid, nd_bound, run_config, sim_state.get_name(), l_inbox, barrier,
+                                         ZombieGameSim.m_cur_moment, l_worker_seed[wid]),
+                                   name='SIM_W_%s' % wid)
+                        for wid in range(n_worker)]
+            for worker in l_worker:
+                worker.start()
+            for worker in l_worker:
+                worker.join()
+            if any(worker.exitcode != 0 for worker in l_worker):
+                raise Exception('[ZombieGameSim:start] Workers failed: %s' % [worker.exitcode for worker in l_worker])
+            for inbox in l_inbox:
+                inbox.close()
+
+            d_agg = dict()
+            for role_str, role in [('HUMAN', HUMAN), ('DOCTOR', DOCTOR), ('ZOMBIE', ZOMBIE)]:
+                nd_state = sim_state.m_nd_state[sim_state.m_nd_role == role]
+                for state_str, state in [('ALIVE', ALIVE), ('INFECTED', INFECTED), ('DEAD', DEAD)]:
+                    d_agg['%s_%s' % (role_str, state_str)] = int(np.count_nonzero(nd_state == state))
+            logger.info('[ZombieGameSim:start] Game Over. Overall Elapse: %s. Aggregates: %s'
+                        % (time.time() - start_time, d_agg))
+        finally:
+            sim_state.close()
+        return d_agg
+
+    @staticmethod
+    def __worker_func(wid, nd_bound, run_config, state_shm_name, l_inbox, barrier, cur_moment, worker_seed):
+        """
+        The worker process function running the partition [nd_bound[wid], nd_bound[wid + 1]) for all ticks.
+        :param wid: (int) The worker ID.
+        :param nd_bound: (1D-ndarray) The aid bounds of all partitions.
+        :param run_config: (RunConfig) The config of the run, passed by value.
+        :param state_shm_name: (str) The segment name of `SimState`.
+        :param l_inbox: (list of multiprocessing.Queue) The inbox of each worker.
+        :param barrier: (multiprocessing.Barrier) Shared by all workers.
+        :param cur_moment: (multiprocessing.Value) The current moment.
+        :param worker_seed: (numpy.random.SeedSequence) The seed of this worker.
+        :return: None.
+        """
+        GameConfig.set_run_config(run_config)
+        ZombieGameSim.m_cur_moment = cur_moment
+        logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
+        sim_state = SimState.attach(state_shm_name, GameConfig.NUM_AGENTS)
+        worker = SimWorker(wid, nd_bound, sim_state, np.random.default_rng(worker_seed))
+        br_client = None
+        if GameConfig.SIM_EN_BROKER:
+            if GameConfig.SIM_CLIENT_PORT_BASE is not None:
+                br_client = BrClient(GameConfig.BR_HOST, GameConfig.SIM_CLIENT_PORT_BASE + wid)
+            else:
+                br_client = BrClient(GameConfig.BR_HOST, 0)
+        event_log = None
+        if GameConfig.SIM_EN_EVENT:
+            event_log = EventLog(pathlib.Path(OUT_FOLDER, 'events_%s_w%s.bin' % (RUN_ID, wid)))
+        n_worker = len(nd_bound) - 1
+        logger.info('[ZombieGameSim:__worker_func] Worker %s started with aids [%s, %s).'
+                    % (wid, nd_bound[wid], nd_bound[wid + 1]))
+        try:
+            for tick in range(GameConfig.MAX_ITER):
+                if wid == 0:
+                    cur_moment.value = tick
+                # Decide
+                d_out = worker.decide(tick)
+                for peer in range(n_worker):
+                    if peer != wid:
+                        l_inbox[peer].put((tick, wid) + d_out[peer])
+                barrier.wait(GameConfig.SIM_BARRIER_TIMEOUT)
+                # Apply. The messages are ordered by sender, not by arrival, so that the same seed credits the same
+                # actors.
+                l_in = [None] * n_worker
+                l_in[wid] = d_out[wid]
+                for _ in range(n_worker - 1):
+                    msg = l_inbox[wid].get(timeout=GameConfig.SIM_BARRIER_TIMEOUT)
+                    if msg[0] != tick:
+                        raise Exception('Message of tick %s from worker %s at tick %s.' % (msg[0], msg[1], tick))
+                    l_in[msg[1]] = msg[2:]
+                worker.apply(tick, l_in, event_log)
+                if br_client is not None and tick % GameConfig.SIM_SNAP_INTERVAL == 0:
+                    worker.send_snapshot(tick, br_client)
+                barrier.wait(GameConfig.SIM_BARRIER_TIMEOUT)
+                if wid == 0 and tick % 100 == 0:
+                    logger.info('[ZombieGameSim:__worker_func] Tick %s done.' % tick)
+        except Exception as e:
+            # Release the peers waiting at the barrier.
+            barrier.abort()
+            logger.error('[ZombieGameSim:__worker_func] Worker %s failed: %s' % (wid, e))
+            raise
+        finally:
+            if event_log is not None:
+                event_log.close()
+            if br_client is not None:
+                br_client.close()
+            sim_state.close()
+        if wid == 0:
+            cur_moment.value = GameConfig.MAX_ITER
+        logger.info('[ZombieGameSim:__worker_func] Worker %s done.' % wid)
+
+
+class SimWorker:
+    """
+    The vectorized agent logic of one partition. It follows the rules of zombie_simple:
+        - Zombie: Bites with `BITE_PROB` the first ALIVE one among `NUM_NEIG` random Humans/Doctors, and gains
+          `BITE_GAIN` from a bite. Decays by `Z_DECAY`.
+        - Doctor: Cures the first INFECTED one among `NUM_NEIG` random Humans. Treats itself after being infected
+          for more than `BITE_EFF` ticks.
+        - Human/Doctor: Decays by `H_DECAY` if INFECTED, and heals by `LIFE_GAIN` if ALIVE and not in full energy.
+        - Any agent reaching 0 energy is DEAD, and never changes afterwards.
+    """
+    def __init__(self, wid, nd_bound, sim_state, rng):
+        self.m_wid = wid
+        self.m_nd_bound = nd_bound
+        self.m_lo = int(nd_bound[wid])
+        self.m_hi = int(nd_bound[wid + 1])
+        self.m_sim_state = sim_state
+        self.m_rng = rng
+        self.m_nd_full = ZombieGameSim.get_full_energy_lut()
+        # Roles never change, so the candidate pools are fixed.
+        nd_role = sim_state.m_nd_role
+        self.m_nd_bite_pool = np.flatnonzero((nd_role == HUMAN) | (nd_role == DOCTOR))
+        self.m_nd_cure_pool = np.flatnonzero(nd_role == HUMAN)
+        nd_aid = np.arange(self.m_lo, self.m_hi)
+        self.m_nd_aid = nd_aid
+        self.m_nd_zombie = nd_aid[nd_role[self.m_lo:self.m_hi] == ZOMBIE]
+        self.m_nd_doctor = nd_aid[nd_role[self.m_lo:self.m_hi] == DOCTOR]
+        # The Zombies of this partition who bit in the current tick.
+        self.m_nd_biter = np.array([], dtype=np.int64)
+
+    def __pick(self, nd_actor, nd_pool, target_state):
+        """
+        Each actor picks the first agent in `target_state` among `NUM_NEIG` random agents of the pool.
+        :return: (1D-ndarray, 1D-ndarray) The actors who picked one, and the agents picked.
+        """
+        if len(nd_actor) <= 0 or len(nd_pool) <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        nd_cand = nd_pool[self.m_rng.integers(0, len(nd_pool), size=(len(nd_actor), GameConfig.NUM_NEIG))]
+        nd_ok = self.m_sim_state.m_nd_state[nd_cand] == target_state
+        nd_has = nd_ok.any(axis=1)
+        nd_first = nd_ok.argmax(axis=1)
+        return nd_actor[nd_has], nd_cand[nd_has, nd_first[nd_has]]
+
+    def __split(self, nd_src, nd_dst):
+        """
+        :return: (list of (1D-ndarray, 1D-ndarray)) The interactions targeting each partition.
+        """
+        nd_owner = np.searchsorted(self.m_nd_bound, nd_dst, side='right') - 1
+        nd_order = np.argsort(nd_owner, kind='stable')
+        nd_split = np.searchsorted(nd_owner[nd_order], np.arange(1, len(self.m_nd_bound) - 1))
+        return list(zip(np.split(nd_src[nd_order], nd_split), np.split(nd_dst[nd_order], nd_split)))
+
+    def decide(self, tick):
+        """
+        Decide the bites and the cures of this partition from the global state.
+        :return: (list of tuple) For each partition: (bite actors, bite targets, cure actors, cure targets).
+        """
+        nd_state = self.m_sim_state.m_nd_state
+        nd_zombie = self.m_nd_zombie[nd_state[self.m_nd_zombie] != DEAD]
+        nd_zombie = nd_zombie[self.m_rng.random(len(nd_zombie)) < GameConfig.BITE_PROB]
+        nd_bite_src, nd_bite_dst = self.__pick(nd_zombie, self.m_nd_bite_pool, ALIVE)
+        self.m_nd_biter = nd_bite_src
+        nd_doctor = self.m_nd_doctor[nd_state[self.m_nd_doctor] != DEAD]
+        nd_cure_src, nd_cure_dst = self.__pick(nd_doctor, self.m_nd_cure_pool, INFECTED)
+        l_bite = self.__split(nd_bite_src, nd_bite_dst)
+        l_cure = self.__split(nd_cure_src, nd_cure_dst)
+        return [l_bite[peer] + l_cure[peer] for peer in range(len(self.m_nd_bound) - 1)]
+
+    def __change_energy(self, nd_aid, energy_change):
+        """
+        Change the energy of the agents not DEAD, and mark those at 0 as DEAD.
+        :return: (1D-ndarray, 1D-ndarray, 1D-ndarray) The agents died, their energy before, and after.
+        """
+        nd_energy = self.m_sim_state.m_nd_energy
+        nd_state = self.m_sim_state.m_nd_state
+        nd_aid = nd_aid[nd_state[nd_aid] != DEAD]
+        nd_before = nd_energy[nd_aid]
+        nd_after = np.clip(nd_before + energy_change, 0, self.m_nd_full[self.m_sim_state.m_nd_role[nd_aid]])
+        nd_energy[nd_aid] = nd_after
+        nd_dead = nd_after == 0
+        nd_state[nd_aid[nd_dead]] = DEAD
+        return nd_aid[nd_dead], nd_before[nd_dead], nd_after[nd_dead]
+
+    def __heal(self, nd_aid):
+        nd_aid = nd_aid[self.m_sim_state.m_nd_energy[nd_aid] < self.m_nd_full[self.m_sim_state.m_nd_role[nd_aid]]]
+        return self.__change_energy(nd_aid, GameConfig.LIFE_GAIN)
+
+    def apply(self, tick, l_in, event_log=None):
+        """
+        Apply the interactions targeting this partition, and update its agents.
+        :param l_in: (list of tuple) (bite actors, bite targets, cure actors, cure targets) from each partition, in
+            the order of partitions. The first actor of a target wins.
+        :param event_log: (EventLog) None disables events.
+        :return: None.
+        """
+        nd_role = self.m_sim_state.m_nd_role
+        nd_state = self.m_sim_state.m_nd_state
+        nd_energy = self.m_sim_state.m_nd_energy
+        l_death = []
+
+        # Cures. An agent is cured at most once.
+        nd_cure_src = np.concatenate([msg[2] for msg in l_in]).astype(np.int64)
+        nd_cure_dst = np.concatenate([msg[3] for msg in l_in]).astype(np.int64)
+        nd_cure_dst, nd_first = np.unique(nd_cure_dst, return_index=True)
+        nd_cure_src = nd_cure_src[nd_first]
+        nd_is_inf = nd_state[nd_cure_dst] == INFECTED
+        nd_cure_src, nd_cure_dst = nd_cure_src[nd_is_inf], nd_cure_dst[nd_is_inf]
+        nd_before = nd_energy[nd_cure_dst]
+        nd_state[nd_cure_dst] = ALIVE
+        self.__heal(nd_cure_dst)
+        if event_log is not None:
+            event_log.emit_array(tick, EV_CURE, nd_cure_src, nd_cure_dst, nd_before, nd_energy[nd_cure_dst])
+
+        # Bites. An agent is bitten at most once.
+        nd_bite_src = np.concatenate([msg[0] for msg in l_in]).astype(np.int64)
+        nd_bite_dst = np.concatenate([msg[1] for msg in l_in]).astype(np.int64)
+        nd_bite_dst, nd_first = np.unique(nd_bite_dst, return_index=True)
+        nd_bite_src = nd_bite_src[nd_first]
+        nd_is_alive = nd_state[nd_bite_dst] == ALIVE
+        nd_bite_src, nd_bite_dst = nd_bite_src[nd_is_alive], nd_bite_dst[nd_is_alive]
+        nd_state[nd_bite_dst] = INFECTED
+        nd_is_doctor = nd_role[nd_bite_dst] == DOCTOR
+        self.m_sim_state.m_nd_bite_start[nd_bite_dst[nd_is_doctor]] = tick
+        if event_log is not None:
+            event_log.emit_array(tick, EV_BITE, nd_bite_src, nd_bite_dst, nd_energy[nd_bite_dst],
+                                 nd_energy[nd_bite_dst])
+        # Zombies gain from their bites.
+        l_death.append(self.__change_energy(self.m_nd_biter, GameConfig.BITE_GAIN))
+
+        # Doctors treat themselves.
+        nd_self = self.m_nd_doctor[(nd_state[self.m_nd_doctor] == INFECTED)
+                                   & (tick - self.m_sim_state.m_nd_bite_start[self.m_nd_doctor] > GameConfig.BITE_EFF)]
+        nd_before = nd_energy[nd_self]
+        nd_state[nd_self] = ALIVE
+        self.m_sim_state.m_nd_bite_start[nd_self] = -1
+        self.__heal(nd_self)
+        if event_log is not None:
+            event_log.emit_array(tick, EV_CURE, nd_self, nd_self, nd_before, nd_energy[nd_self])
+
+        # Updates
+        nd_local_role = nd_role[self.m_lo:self.m_hi]
+        nd_local_state = nd_state[self.m_lo:self.m_hi]
+        nd_is_hd = nd_local_role != ZOMBIE
+        l_death.append(self.__change_energy(self.m_nd_aid[nd_is_hd & (nd_local_state == INFECTED)],
+                                            GameConfig.H_DECAY))
+        l_death.append(self.__heal(self.m_nd_aid[nd_is_hd & (nd_local_state == ALIVE)]))
+        l_death.append(self.__change_energy(self.m_nd_zombie, GameConfig.Z_DECAY))
+        if event_log is not None:
+            for nd_dead, nd_before, nd_after in l_death:
+                event_log.emit_array(tick, EV_DEATH, nd_dead, nd_dead, nd_before, nd_after)
+
+    def send_snapshot(self, tick, br_client):
+        """
+        Persist the state of this partition through DataBroker. There are no positions, which are sent as 0.
+        :return: None.
+        """
+        nd_zero = np.zeros(len(self.m_nd_aid), dtype=np.float32)
+        br_client.send_snapshot(tick, self.m_nd_aid, self.m_sim_state.m_nd_role[self.m_lo:self.m_hi],
+                                self.m_sim_state.m_nd_state[self.m_lo:self.m_hi],
+                                self.m_sim_state.m_nd_energy[self.m_lo:self.m_hi], nd_zero, nd_zero)
 
 
 ##################################################
 #   Data Backend
 ##################################################
 class DataBroker:
+    # Matches a whole equality term on `aid` or `tick` of a condition string, e.g., 'aid=5'.
+    KEY_TERM_RE = re.compile(r'(aid|tick)\s*=\s*(\d+)', re.IGNORECASE)
+    # Splits a condition string into disjuncts, and a disjunct into conjuncts.
+    OR_RE = re.compile(r'\s+or\s+', re.IGNORECASE)
+    AND_RE = re.compile(r'\s+and\s+', re.IGNORECASE)
+
+    # The header of a snapshot chunk.
+    SNAP_HDR = struct.Struct('<cIIHHI')
+    # The columns of a snapshot.
+    SNAP_DTYPE = np.dtype([('aid', '<i4'), ('role', '<i2'), ('state', '<i2'), ('energy', '<i4'),
+                           ('x_pos', '<f4'), ('y_pos', '<f4')])
+    # The columns of `agent_status` in the binary `COPY` format, i.e., big-endian in the table types.
+    PG_COPY_COL_DTYPE = [('tick', '>i4'), ('aid', '>i4'), ('role', '>i2'), ('state', '>i2'), ('energy', '>i4'),
+                         ('x_pos', '>f4'), ('y_pos', '>f4')]
+    SNAP_COPY_SQL = 'COPY agent_status (%s) FROM STDIN (FORMAT BINARY)' \
+                    % ','.join([col for col, _ in PG_COPY_COL_DTYPE])
+
     #----- Request Format -----#
     # [CMD]#[COND]#[ATTR1|ATTR2|...]#[VAL1|VAL2|...]
     # - CMD: (Mandatory)
     #   - 'T': Terminate the server.
-    #   - 'R': Register notification listener.
+    #   - 'R': Register a client, or resync its credits. The only field.
+    #   - 'X': Unregister a closed client. The only field.
     #   - 'S': select
     #   - 'U': update
     #   - 'I': insert
+    #   - 'L': Read the latest states of agents. Served from `BrStateCache` whenever possible.
     # - COND: (Mandatory)
     #   - Condition string.
     #   - Can be the empty string, i.e., ''.
+    #   - For 'L', the agent IDs separated by '|'.
     # - ATTRi: (Mandatory)
     #   - ith attribute name.
     #   - Separated by '|'.
@@ -104,17 +536,31 @@ class DataBroker:
     #   - Value associated with ith attribute.
     #   - 'S' cmd does not have the value field.
 
+    #----- Snapshot Request Format -----#
+    # Ships the states of a partition of agents at a tick in one or multiple binary chunks, each fitting in
+    # `GameConfig.BR_BUFF_SIZE`. See `BrClient.send_snapshot`.
+    # - Header: 'N', tick (uint32), snapshot ID (uint32), chunk index (uint16), count of chunks (uint16),
+    #   count of records (uint32).
+    # - Body: Columns in the order of `SNAP_DTYPE`, each as a little-endian array.
+    # The chunks of a snapshot are reassembled by the broker, and ingested by one binary `COPY`.
+
     #----- Response Format -----#
-    # - Respond to 'S'
+    # - Respond to 'S' and 'L'
     #   - One or multiple messages will be sent back to client.
     #   - For each response message: [AID]#[ATTR1|ATTR2|...]#[VAL1|VAL2|...]
 
+    #----- Notification Format -----#
+    # Sent to registered clients. See `BrCreditLedger` for the credit-based flow control.
+    # - 'S#[E]#[N]': Start epoch E of the client, and set the credits it holds to N. Respond to 'R'.
+    # - 'G#[E]#[N]': Grant N more credits to the client in epoch E. Ignored by a client in another epoch.
+    # - 'T': Terminate the client.
+
     # The request receiver process.
     m_receiver = None
-    # The request queue.
-    m_request_q = None
-    # The server process.
-    m_server = None
+    # The request queues, one for each server process.
+    m_l_request_q = None
+    # The server processes, i.e., the DB worker pool.
+    m_l_server = None
 
     def __init__(self, ref_config):
         self.m_logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name='BR_MAIN')
@@ -122,50 +568,129 @@ class DataBroker:
             raise Exception('[DataBroker:__init__] GameConfig has not been initialized.')
         self.m_ref_config = ref_config
         self.__init_db()
-        self.m_request_q = mp.Queue(-1)
-        self.m_receiver = mp.Process(target=self.__receiver_func, args=(self.m_request_q,), name='BR_RECV')
-        self.m_server = mp.Process(target=self.__server_func, args=(self.m_request_q,), name='BR_SERV')
-        self.m_server.start()
+        self._start_br()
+
+    def _start_br(self):
+        """
+        Start the receiver and the server processes. Subclasses override this to provide other front ends.
+        :return: None.
+        """
+        self.m_l_request_q = [mp.Queue(-1) for _ in range(GameConfig.BR_DB_POOL_SIZE)]
+        run_config = GameConfig.get_run_config()
+        self.m_receiver = mp.Process(target=self.__receiver_func, args=(self.m_l_request_q, run_config),
+                                     name='BR_RECV')
+        self.m_l_server = [mp.Process(target=self.__server_func, args=(request_q, run_config),
+                                      name='BR_SERV_%s' % idx)
+                           for idx, request_q in enumerate(self.m_l_request_q)]
+        self.m_receiver.start()
+        for server in self.m_l_server:
+            server.start()
+
+    def __connect_db(self):
+        import psycopg as pg
+
+        return pg.connect(host=self.m_ref_config.DB_HOST,
+                          port=self.m_ref_config.DB_PORT,
+                          dbname=self.m_ref_config.DB_NAME,
+                          user=self.m_ref_config.DB_USER,
+                          password=self.m_ref_config.DB_PASSWORD)
 
     def __init_db(self):
         """
         Create `agent_status` table in DB, if it doesn't exist.
+        The table is range partitioned by `tick`, `GameConfig.DB_TICK_PART_SIZE` ticks per partition, plus a default
+        partition for ticks beyond `GameConfig.MAX_ITER`. With `GameConfig.DB_BULK_INGEST`, partitions are created
+        unlogged and without the primary key and indexes, which are built by `finalize_db` after ingestion.
+        NOTE:
+            An existing `agent_status` table is kept as is. Drop it to switch to the partitioned schema.
         :return: None.
         """
-        with pg.connect(host=self.m_ref_config.DB_HOST,
-                        dbname=self.m_ref_config.DB_NAME,
-                        user=self.m_ref_config.DB_USER,
-                        password=self.m_ref_config.DB_PASSWORD) as db_con:
+        part_persistence = 'unlogged' if self.m_ref_config.DB_BULK_INGEST else ''
+        part_size = self.m_ref_config.DB_TICK_PART_SIZE
+        l_sql_str = ["""create table if not exists agent_status (
+                            tick integer not null,
+                            aid integer not null,
+                            role smallint,
+                            state smallint,
+                            energy integer,
+                            x_pos real,
+                            y_pos real
+                            ) partition by range (tick)
+                     """]
+        for part_start in range(0, self.m_ref_config.MAX_ITER + 1, part_size):
+            l_sql_str.append("""create %s table if not exists agent_status_p%s partition of agent_status
+                                for values from (%s) to (%s)"""
+                             % (part_persistence, part_start // part_size, part_start, part_start + part_size))
+        l_sql_str.append("""create %s table if not exists agent_status_pdef partition of agent_status default"""
+                         % part_persistence)
+        with self.__connect_db() as db_con:
             with db_con.cursor() as db_cur:
-                sql_str = """create table if not exists agent_status (
-                                    tick serial,
-                                    aid serial,
-                                    role serial,
-                                    state smallserial,
-                                    energy integer,
-                                    x_pos real,
-                                    y_pos real,
-                                    primary key (tick, aid)
-                                    )
-                           """
                 try:
-                    db_cur.execute(sql_str)
+                    for sql_str in l_sql_str:
+                        db_cur.execute(sql_str)
+                    if not self.m_ref_config.DB_BULK_INGEST:
+                        DataBroker.__create_indexes(db_cur)
                 except Exception as e:
                     self.m_logger.error('[DataBroker:__init_db] Failed to create table `agent_status`: %s' % e)
                     sys.exit(-1)
         self.m_logger.info('[DataBroker:__init_db] Done.')
 
     @staticmethod
-    def send_request(host, port, cmd_str, cond_str, attr_str, val_str=None):
+    def __create_indexes(db_cur):
         """
-        Invoked by working processes to send a request to DataBroker.
-        :param host: (str)
-        :param port: (int)
+        Create the primary key and the indexes of `agent_status`:
+            - A BRIN index on `tick` for tick-range scans, tiny since ticks are appended in order.
+            - Partial indexes on (tick, role) for INFECTED and DEAD agents respectively.
+        :param db_cur: (psycopg.Cursor)
+        :return: None.
+        """
+        db_cur.execute("""select 1 from pg_constraint where conname = 'agent_status_pkey'""")
+        if db_cur.fetchone() is None:
+            db_cur.execute("""alter table agent_status add constraint agent_status_pkey primary key (tick, aid)""")
+        db_cur.execute("""create index if not exists agent_status_tick_brin on agent_status using brin (tick)""")
+        db_cur.execute("""create index if not exists agent_status_infected_idx on agent_status (tick, role)
+                          where state = %s""" % INFECTED)
+        db_cur.execute("""create index if not exists agent_status_dead_idx on agent_status (tick, role)
+                          where state = %s""" % DEAD)
+
+    def finalize_db(self):
+        """
+        Finish a bulk ingestion: turn the unlogged partitions into logged ones, build the primary key and the
+        indexes, and refresh the statistics. Nothing to do if `GameConfig.DB_BULK_INGEST` is off.
+        :return: None.
+        """
+        if not self.m_ref_config.DB_BULK_INGEST:
+            return
+        with self.__connect_db() as db_con:
+            with db_con.cursor() as db_cur:
+                db_cur.execute("""select inhrelid::regclass::text from pg_inherits
+                                  where inhparent = 'agent_status'::regclass""")
+                l_part = [data_rec[0] for data_rec in db_cur.fetchall()]
+                for part in l_part:
+                    db_cur.execute("""alter table %s set logged""" % part)
+                DataBroker.__create_indexes(db_cur)
+                db_cur.execute("""analyze agent_status""")
+        self.m_logger.info('[DataBroker:finalize_db] Done.')
+
+    @staticmethod
+    def _compose_grant(credit_ledger, addr, cnt_grant):
+        """
+        :param credit_ledger: (BrCreditLedger)
+        :param addr: (tuple) The client address.
+        :param cnt_grant: (int) The number of credits granted.
+        :return: (bytes) The 'G' notification in the current epoch of the client.
+        """
+        return str.encode('G#%s#%s' % (credit_ledger.get_epoch(addr), cnt_grant))
+
+    @staticmethod
+    def _compose_request(cmd_str, cond_str, attr_str, val_str=None):
+        """
+        Compose a request string following the request format.
         :param cmd_str: (str)
         :param cond_str: (str)
         :param attr_str: (str)
         :param val_str: (str)
-        :return: None
+        :return: (str or None) The request string. None if any mandatory field is missing.
         """
         logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
         l_req_field = []
@@ -176,171 +701,459 @@ class DataBroker:
                 if attr_str is not None:
                     l_req_field.append(attr_str)
                 else:
-                    logger.error('[DataBroker:send_request] `attr_str` is needed.')
-                    return
+                    logger.error('[DataBroker:_compose_request] `attr_str` is needed.')
+                    return None
             else:
-                logger.error('[DataBroker:send_request] `cond_str` is needed.')
-                return
+                logger.error('[DataBroker:_compose_request] `cond_str` is needed.')
+                return None
         else:
-            logger.error('[DataBroker:send_request] `cmd_str` is needed.')
-            return
+            logger.error('[DataBroker:_compose_request] `cmd_str` is needed.')
+            return None
         if val_str is not None:
             l_req_field.append(val_str)
-        request_str = '#'.join(l_req_field)
+        return '#'.join(l_req_field)
 
-        client_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        client_sock.bind((host, port))
-        client_sock.sendto(str.encode(request_str), (GameConfig.BR_HOST, GameConfig.BR_PORT))
+    @staticmethod
+    def get_client(host, port):
+        """
+        Invoked by working processes to get a client sending requests to DataBroker.
+        :param host: (str)
+        :param port: (int)
+        :return: (BrClient)
+        """
+        return BrClient(host, port)
 
     @staticmethod
-    def get_notifier(host, port):
+    def _get_pin_cond(cond_str):
         """
-        Start a process listening to notifications sent from DataBroker.
-        :return: (multiprocessing.Queue)
+        Check if a condition is exactly 'aid=N' or 'aid=N and tick=M', in any order.
+        :param cond_str: (str)
+        :return: (int, int or None) The aid and the tick. None if the condition is anything else.
         """
-        notification_q = mp.Queue(-1)
-        listen_proc = mp.Process(target=DataBroker.__notification_listen_func,
-                                 args=(host, port, notification_q),
-                                 name='%s_N' % mp.current_process().name)
-        listen_proc.start()
+        d_key = dict()
+        for conj in DataBroker.AND_RE.split(cond_str.strip()):
+            key_match = DataBroker.KEY_TERM_RE.fullmatch(conj.strip())
+            if key_match is None or key_match.group(1).lower() in d_key:
+                return None
+            d_key[key_match.group(1).lower()] = int(key_match.group(2))
+        if 'aid' not in d_key:
+            return None
+        return d_key['aid'], d_key.get('tick')
 
     @staticmethod
-    def __notification_listen_func(host, port, notification_q):
+    def _get_cond_aids(cond_str):
         """
-        Notifications:
-            - 'P': Pause incoming requests.
-            - 'C': Continue sending requests.
-            - 'T': Terminate notifier.
-        :param host: (str)
-        :param port: (int)
-        :param notification_q: (multiprocessing.Queue)
-        :return: None
+        The agents a condition can match, from its 'aid=N' terms. Each disjunct of the condition needs an 'aid=N'
+        conjunct, e.g., 'aid=5 and state=1' or 'aid=5 or aid=6'.
+        :param cond_str: (str)
+        :return: (list of int or None) The sorted aids, a superset of the matched ones. None if the condition may match
+            any agent, e.g., '', 'state=1', 'aid=5 or state=1', or conditions with parentheses.
         """
-        client_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        client_sock.bind((host, port))
-        logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
-        logger.debug('[DataBroker:__notification_listen_func] Notifier started.')
-        while True:
-            msg, addr = client_sock.recvfrom(1024)
-            if addr[0] != GameConfig.BR_HOST or addr[1] != GameConfig.BR_PORT:
-                continue
-            msg = msg.decode('utf-8')
-            if msg == 'P':
-                logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
-                logger.debug('[DataBroker:__notification_listen_func] Pause sending requests.')
-                notification_q.put_nowait('P')
-            elif msg == 'C':
-                logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
-                logger.debug('[DataBroker:__notification_listen_func] Continue sending requests.')
-                notification_q.put_nowait('C')
-            elif msg == 'T':
-                break
-        logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
-        logger.debug('[DataBroker:__notification_listen_func] Terminate notifier.')
+        if cond_str.strip() == '' or '(' in cond_str or ')' in cond_str:
+            return None
+        s_aid = set()
+        for disj in DataBroker.OR_RE.split(cond_str.strip()):
+            l_aid = []
+            for conj in DataBroker.AND_RE.split(disj.strip()):
+                key_match = DataBroker.KEY_TERM_RE.fullmatch(conj.strip())
+                if key_match is not None and key_match.group(1).lower() == 'aid':
+                    l_aid.append(int(key_match.group(2)))
+            if len(l_aid) <= 0:
+                return None
+            s_aid.update(l_aid)
+        return sorted(s_aid)
 
     @staticmethod
-    def __receiver_func(request_q):
+    def _get_request_aids(msg):
         """
-        Receive data operation requests from working processes, and enqueue requests. When the queue length reaches
-        80% of the expected length, the receiver pauses incoming streams, and will continue when the length is lower
-        than 50%. The pause msg sent by the receiver is a single msg with 'P'.
+        Extract the agent IDs a request operates on.
+        :param msg: (str) The request.
+        :return: (list of int or None) None if the request may operate on any agent.
+        """
+        l_msg_fields = msg.split('#')
+        if len(l_msg_fields) < 3:
+            return None
+        if l_msg_fields[0] == 'I':
+            if len(l_msg_fields) < 4:
+                return None
+            l_attr = l_msg_fields[2].split('|')
+            l_val = l_msg_fields[3].split('|')
+            if 'aid' in l_attr and len(l_attr) == len(l_val):
+                try:
+                    return [int(l_val[l_attr.index('aid')])]
+                except ValueError:
+                    return None
+            return None
+        if l_msg_fields[0] == 'L':
+            l_aid = l_msg_fields[1].split('|')
+            if not all([aid.isdigit() for aid in l_aid]):
+                return None
+            return sorted(set([int(aid) for aid in l_aid]))
+        return DataBroker._get_cond_aids(l_msg_fields[1])
+
+    @staticmethod
+    def _split_request(msg):
+        """
+        Split a request on multiple agents into one request for each agent, so that each goes to the server of its
+        agent, and the requests of the same agent are executed in order. A 'S' or 'U' request gets the condition
+        'aid=N and ([COND])', and an 'L' request reads one agent.
+        :param msg: (str) The request.
+        :return: (list of (int or None, str)) The aid and the request of each part. The aid is None for a request that
+            may operate on any agent, which is not split.
+        """
+        l_aid = DataBroker._get_request_aids(msg)
+        if l_aid is None:
+            return [(None, msg)]
+        if len(l_aid) == 1:
+            return [(l_aid[0], msg)]
+        l_msg_fields = msg.split('#')
+        l_part = []
+        for aid in l_aid:
+            if l_msg_fields[0] == 'L':
+                l_msg_fields[1] = str(aid)
+                l_part.append((aid, '#'.join(l_msg_fields)))
+            else:
+                l_part_fields = list(l_msg_fields)
+                l_part_fields[1] = 'aid=%s and (%s)' % (aid, l_msg_fields[1])
+                l_part.append((aid, '#'.join(l_part_fields)))
+        return l_part
+
+    @staticmethod
+    def __receiver_func(l_request_q, run_config):
+        """
+        Receive data operation requests from working processes, and enqueue requests. Incoming requests are bounded
+        by credits (see `BrCreditLedger`): a request sent without a credit is dropped, and credits are granted back
+        to the client when the servers report its requests done via 'D' messages.
+        Requests are routed to the servers by the hash of `aid`, so the requests of the same agent are executed in
+        order. Requests on several given agents are split into one request for each agent. Requests that may target
+        any agent are spread in a round-robin manner. The servers report each finished 'I' or 'U' request via an 'A'
+        message, which applies it to the state cache.
+        :param l_request_q: (list of multiprocessing.Queue) One request queue for each server.
+        :param run_config: (RunConfig) The config of the run, passed by value.
         :return: None
         """
+        GameConfig.set_run_config(run_config)
         logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
         logger.info('[DataBroker:__receiver_func] Receiver started.')
 
-        l_listener_addr = []
-        recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        recv_sock.bind((GameConfig.BR_HOST, GameConfig.BR_PORT))
+        credit_ledger = BrCreditLedger()
+        state_cache = BrStateCache()
+        rr_idx = 0
+        recv_transport = GameTransport.get_server('BR')
         while True:
-            msg, addr = recv_sock.recvfrom(GameConfig.BR_BUFF_SIZE)
+            msg, addr = recv_transport.recv()
+            if msg[:1] == b'N':
+                # A snapshot chunk. Its records are split by `aid` as other requests, and each server reassembles
+                # the snapshot of its agents.
+                if not credit_ledger.consume(addr):
+                    logger.debug('[DataBroker:__receiver_func] Dropped snapshot chunk without credit from %s' % (addr,))
+                    continue
+                state_cache.apply_snapshot_chunk(msg)
+                l_piece = DataBroker._split_snapshot_chunk(msg, len(l_request_q))
+                credit_ledger.expand(addr, len(l_piece) - 1)
+                for shard_idx, piece in enumerate(l_piece):
+                    l_request_q[shard_idx].put_nowait([piece, addr, credit_ledger.get_epoch(addr)])
+                continue
             msg = msg.decode('utf-8')
             if msg == 'T':
-                # Terminate the server process.
-                request_q.put_nowait('T')
-                # Terminate all notification listener processes.
-                for listener_addr in l_listener_addr:
-                    recv_sock.sendto('T', listener_addr)
+                # Terminate the server processes.
+                for request_q in l_request_q:
+                    request_q.put_nowait('T')
+                # Terminate all clients.
+                for client_addr in credit_ledger.get_all_clients():
+                    recv_transport.sendto(str.encode('T'), client_addr)
                 break
             elif msg == 'R':
-                # Register notification listener.
-                l_listener_addr.append(addr)
-            elif msg == 'C':
-                # Notify all listeners to continue sending requests.
-                for listener_addr in l_listener_addr:
-                    recv_sock.sendto('C', listener_addr)
+                # Register a client, or resync the credits of a registered client.
+                epoch, cnt_credit = credit_ledger.register(addr)
+                recv_transport.sendto(str.encode('S#%s#%s' % (epoch, cnt_credit)), addr)
+            elif msg == 'X':
+                # Unregister a closed client, and hand its credits to the others.
+                credit_ledger.unregister(addr)
+                for client_addr, cnt_grant in credit_ledger.rebalance():
+                    recv_transport.sendto(DataBroker._compose_grant(credit_ledger, client_addr, cnt_grant),
+                                          client_addr)
+            elif msg[:2] == 'D#':
+                # Requests done by the server. Grant the credits back to the client, and the retired ones to the
+                # clients below their window.
+                _, client_host, client_port, epoch, cnt_done = msg.split('#')
+                client_addr = (client_host, int(client_port))
+                cnt_grant = credit_ledger.release(client_addr, int(cnt_done), int(epoch))
+                if cnt_grant > 0:
+                    recv_transport.sendto(DataBroker._compose_grant(credit_ledger, client_addr, cnt_grant),
+                                          client_addr)
+                for short_addr, cnt_grant in credit_ledger.rebalance():
+                    recv_transport.sendto(DataBroker._compose_grant(credit_ledger, short_addr, cnt_grant), short_addr)
+            elif msg[:2] == 'A#':
+                # An 'I' or 'U' request finished by the server, as 'A#[APPLIED]#[REQUEST]'.
+                state_cache.end_request(msg[4:], msg[2] == '1')
             else:
-                # If the request queue is likely to be overwhelmed, send msg 'P' to request senders to pause incoming
-                # requests.
-                if request_q.qsize() >= GameConfig.BR_Q_EXP_LEN * 0.8:
-                    recv_sock.sendto('P', addr)
-                    request_q.put_nowait('P')
-                request_q.put_nowait([msg, addr])
-        recv_sock.close()
-        logger.info('[DataBroker:__receiver_func] Receiver stopped.')
+                if not credit_ledger.consume(addr):
+                    logger.debug('[DataBroker:__receiver_func] Dropped request without credit from %s: %s'
+                                 % (addr, msg))
+                    continue
+                if msg[:2] == 'L#':
+                    # Serve the cached agents, and only read the missed ones from the DB.
+                    msg = state_cache.serve_read(msg, addr, recv_transport.sendto)
+                    if msg is None:
+                        cnt_grant = credit_ledger.release(addr, 1, credit_ledger.get_epoch(addr))
+                        if cnt_grant > 0:
+                            recv_transport.sendto(DataBroker._compose_grant(credit_ledger, addr, cnt_grant), addr)
+                        continue
+                l_part = DataBroker._split_request(msg)
+                credit_ledger.expand(addr, len(l_part) - 1)
+                for aid, part_msg in l_part:
+                    if aid is not None:
+                        shard_idx = DataBroker._get_shard_idx(aid, len(l_request_q))
+                    else:
+                        shard_idx = rr_idx
+                        rr_idx = (rr_idx + 1) % len(l_request_q)
+                    state_cache.begin_request(part_msg)
+                    l_request_q[shard_idx].put_nowait([part_msg, addr, credit_ledger.get_epoch(addr)])
+        recv_transport.close()
+        logger.info('[DataBroker:__receiver_func] Receiver stopped. Stats: %s, Cache: %s'
+                    % (credit_ledger.get_stats(), state_cache.get_stats()))
 
     @staticmethod
-    def __server_func(request_q):
+    def __server_func(request_q, run_config):
         """
-        The server process function processing incoming DB requests.
-        NOTE:
-            `psycopg` will automatically commit before every `select`. Thus, we refrain manual commit.
+        The server process function processing incoming DB requests. Each server holds its own DB connection for its
+        lifetime, and serves the requests routed to its queue. The requests done for each client are
+        committed and reported to the receiver in batches of `GameConfig.BR_CREDIT_BATCH`, or after
+        `GameConfig.BR_CREDIT_FLUSH_SEC` without incoming requests. The 'I' and 'U' requests are reported only after
+        their commit, so the receiver caches no write the DB has rolled back.
+        :param request_q: (multiprocessing.Queue) The request queue of this server.
+        :param run_config: (RunConfig) The config of the run, passed by value.
         :return: None.
-        TODO
-            Need a request queue.
         """
+        GameConfig.set_run_config(run_config)
         logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
         logger.info('[DataBroker:__server_func] Server started.')
 
-        serv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        serv_sock.bind((GameConfig.BR_HOST, GameConfig.BR_PORT))
-        need_continue = False
+        serv_transport = GameTransport.get_client('BR')
+        # The count of requests done for each (client, epoch), and not yet reported to the receiver.
+        d_done = dict()
+        # The 'A' messages of the finished 'I' and 'U' requests, reported after the commit.
+        l_applied = []
+        snap_buffer = BrSnapshotBuffer()
+
+        def flush_done(db_con):
+            if len(d_done) <= 0:
+                return
+            db_con.commit()
+            for applied_str in l_applied:
+                while not serv_transport.send(str.encode(applied_str)):
+                    time.sleep(GameConfig.SHM_POLL_SEC)
+            l_applied.clear()
+            for (client_addr, epoch), cnt_done in d_done.items():
+                done_str = 'D#%s#%s#%s#%s' % (client_addr[0], client_addr[1], epoch, cnt_done)
+                while not serv_transport.send(str.encode(done_str)):
+                    time.sleep(GameConfig.SHM_POLL_SEC)
+            d_done.clear()
+
+        import psycopg as pg
+
         with pg.connect(host=GameConfig.DB_HOST,
+                        port=GameConfig.DB_PORT,
                         dbname=GameConfig.DB_NAME,
                         user=GameConfig.DB_USER,
                         password=GameConfig.DB_PASSWORD) as db_con:
             with db_con.cursor() as db_cur:
                 while True:
-                    request = request_q.get()
+                    try:
+                        request = request_q.get(timeout=GameConfig.BR_CREDIT_FLUSH_SEC)
+                    except queue.Empty:
+                        flush_done(db_con)
+                        continue
                     if request == 'T':
-                        db_con.commit()
+                        for tick, nd_snap in snap_buffer.flush_all():
+                            DataBroker.__copy_snapshot(db_cur, tick, nd_snap)
+                        flush_done(db_con)
                         break
-                    if request == 'P':
-                        need_continue = True
-                        continue
-                    sql_str, data_fb = DataBroker.__parse_request(request)
-                    db_cur.execute(sql_str)
-                    # Data feedback is needed.
-                    # TODO
-                    if data_fb:
-                        fb_size = db_cur.rowcount
-                        # serv_sock.sendto(, addr)
-                    # Notify Receiver to continue receiving requests.
-                    if need_continue and request_q.qsize() <= GameConfig.BR_Q_EXP_LEN * 0.5:
-                        serv_sock.sendto('C', (GameConfig.BR_HOST, GameConfig.BR_PORT))
-        serv_sock.close()
-        logger.info('[DataBroker:__server_func] Server stopped.')
-
-    @staticmethod
-    def __parse_request(raw_msg):
+                    msg, addr, epoch = request
+                    if isinstance(msg, bytes):
+                        for tick, nd_snap in snap_buffer.add_chunk(addr, msg):
+                            DataBroker.__copy_snapshot(db_cur, tick, nd_snap)
+                        sql_str = None
+                    else:
+                        sql_str, data_fb = DataBroker._parse_request(msg)
+                    applied = False
+                    if sql_str is not None:
+                        try:
+                            with DataBroker.__savepoint(db_cur):
+                                db_cur.execute(sql_str)
+                                # Send back selected records.
+                                if data_fb:
+                                    l_col = [col.name for col in db_cur.description]
+                                    for data_rec in db_cur:
+                                        serv_transport.sendto(DataBroker._compose_response(l_col, data_rec), addr)
+                            applied = True
+                        except Exception as e:
+                            logger.error('[DataBroker:__server_func] Failed request %s: %s' % (msg, e))
+                    if isinstance(msg, str) and msg[:2] in ('I#', 'U#'):
+                        l_applied.append('A#%d#%s' % (applied, msg))
+                    d_done[(addr, epoch)] = d_done.get((addr, epoch), 0) + 1
+                    if d_done[(addr, epoch)] >= GameConfig.BR_CREDIT_BATCH:
+                        flush_done(db_con)
+        serv_transport.close()
+        logger.info('[DataBroker:__server_func] Server stopped. Snapshot stats: %s' % snap_buffer.get_stats())
+
+    @staticmethod
+    @contextlib.contextmanager
+    def __savepoint(db_cur):
+        """
+        Run a statement in its own savepoint of the batch transaction, so a failure only rolls back this statement,
+        and the earlier writes of the batch are still committed by `flush_done`.
+        NOTE:
+            `db_con.transaction()` is not used, since it opens and commits an outer transaction when the connection is
+            idle, i.e., it would commit each request alone.
+        :param db_cur: (psycopg.Cursor)
+        """
+        db_cur.execute('SAVEPOINT br_req')
+        try:
+            yield
+        except Exception:
+            db_cur.execute('ROLLBACK TO SAVEPOINT br_req')
+            raise
+        db_cur.execute('RELEASE SAVEPOINT br_req')
+
+    @staticmethod
+    def __copy_snapshot(db_cur, tick, nd_snap):
+        """
+        Ingest a snapshot into `agent_status` by one binary `COPY` in its own savepoint.
+        :param db_cur: (psycopg.Cursor)
+        :param tick: (int) The tick of the snapshot.
+        :param nd_snap: (1D structured ndarray of `SNAP_DTYPE`) The snapshot records.
+        :return: None.
+        """
+        if len(nd_snap) <= 0:
+            return
+        try:
+            with DataBroker.__savepoint(db_cur):
+                with db_cur.copy(DataBroker.SNAP_COPY_SQL) as copy:
+                    copy.write(DataBroker._snapshot_to_pgcopy(tick, nd_snap))
+        except Exception as e:
+            logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
+            logger.error('[DataBroker:__copy_snapshot] Failed snapshot at tick %s: %s' % (tick, e))
+
+    @staticmethod
+    def _get_shard_idx(aid, n_shard):
+        """
+        The server of an agent. All requests and snapshot records of an agent go to its server, so they are executed
+        in order.
+        :param aid: (int or ndarray of int)
+        :param n_shard: (int) The number of servers.
+        :return: (int or ndarray of int)
+        """
+        return aid % n_shard
+
+    @staticmethod
+    def _split_snapshot_chunk(raw_chunk, n_shard):
+        """
+        Split the records of a snapshot chunk by the server of their agents. Each piece keeps the header of the chunk,
+        and every server gets a piece, empty or not, so that each server can tell when it has all the pieces of a
+        snapshot.
+        :param raw_chunk: (bytes) The snapshot chunk.
+        :param n_shard: (int) The number of servers.
+        :return: (list of bytes) The piece of each server.
+        """
+        if n_shard <= 1:
+            return [raw_chunk]
+        tick, snap_id, chunk_idx, cnt_chunk, nd_chunk = DataBroker._decode_snapshot_chunk(raw_chunk)
+        nd_shard = DataBroker._get_shard_idx(nd_chunk['aid'], n_shard)
+        return [DataBroker._encode_snapshot_chunk(tick, snap_id, chunk_idx, cnt_chunk, nd_chunk[nd_shard == shard_idx])
+                for shard_idx in range(n_shard)]
+
+    @staticmethod
+    def _encode_snapshot_chunk(tick, snap_id, chunk_idx, cnt_chunk, nd_chunk):
+        """
+        :param tick: (int) The tick of the snapshot.
+        :param snap_id: (int) The snapshot ID unique for the sender.
+        :param chunk_idx: (int) The index of this chunk.
+        :param cnt_chunk: (int) The count of chunks of the snapshot.
+        :param nd_chunk: (1D structured ndarray of `SNAP_DTYPE`) The records of this chunk.
+        :return: (bytes) The chunk.
+        """
+        l_buf = [DataBroker.SNAP_HDR.pack(b'N', tick, snap_id, chunk_idx, cnt_chunk, len(nd_chunk))]
+        l_buf += [np.ascontiguousarray(nd_chunk[col]).tobytes() for col in DataBroker.SNAP_DTYPE.names]
+        return b''.join(l_buf)
+
+    @staticmethod
+    def _encode_snapshot(tick, snap_id, nd_snap):
+        """
+        Encode a snapshot into chunks, each fitting in a datagram of `GameConfig.BR_BUFF_SIZE`.
+        :param tick: (int) The tick of the snapshot.
+        :param snap_id: (int) The snapshot ID unique for the sender.
+        :param nd_snap: (1D structured ndarray of `SNAP_DTYPE`) The snapshot records.
+        :return: (list of bytes) The chunks.
+        """
+        cnt_rec_per_chunk = (GameConfig.BR_BUFF_SIZE - DataBroker.SNAP_HDR.size) // DataBroker.SNAP_DTYPE.itemsize
+        cnt_chunk = max(1, math.ceil(len(nd_snap) / cnt_rec_per_chunk))
+        l_chunk = []
+        for chunk_idx in range(cnt_chunk):
+            nd_chunk = nd_snap[chunk_idx * cnt_rec_per_chunk: (chunk_idx + 1) * cnt_rec_per_chunk]
+            l_chunk.append(DataBroker._encode_snapshot_chunk(tick, snap_id, chunk_idx, cnt_chunk, nd_chunk))
+        return l_chunk
+
+    @staticmethod
+    def _decode_snapshot_chunk(raw_chunk):
+        """
+        Decode a snapshot chunk.
+        :param raw_chunk: (bytes)
+        :return: (tuple) tick, snapshot ID, chunk index, count of chunks, and the records as a 1D structured ndarray
+            of `SNAP_DTYPE`.
+        """
+        _, tick, snap_id, chunk_idx, cnt_chunk, cnt_rec = DataBroker.SNAP_HDR.unpack_from(raw_chunk)
+        nd_chunk = np.empty(cnt_rec, dtype=DataBroker.SNAP_DTYPE)
+        offset = DataBroker.SNAP_HDR.size
+        for col in DataBroker.SNAP_DTYPE.names:
+            col_dtype = DataBroker.SNAP_DTYPE.fields[col][0]
+            nd_chunk[col] = np.frombuffer(raw_chunk, dtype=col_dtype, count=cnt_rec, offset=offset)
+            offset += col_dtype.itemsize * cnt_rec
+        return tick, snap_id, chunk_idx, cnt_chunk, nd_chunk
+
+    @staticmethod
+    def _snapshot_to_pgcopy(tick, nd_snap):
+        """
+        Convert a snapshot to the PostgreSQL binary `COPY` format. The tuples are built as one structured array, so no
+        per-record Python work is done.
+        :param tick: (int) The tick of the snapshot.
+        :param nd_snap: (1D structured ndarray of `SNAP_DTYPE`) The snapshot records.
+        :return: (bytes)
+        """
+        l_field = [('cnt_field', '>i2')]
+        for col, col_dtype in DataBroker.PG_COPY_COL_DTYPE:
+            l_field += [('len_%s' % col, '>i4'), (col, col_dtype)]
+        nd_tuple = np.empty(len(nd_snap), dtype=np.dtype(l_field))
+        nd_tuple['cnt_field'] = len(DataBroker.PG_COPY_COL_DTYPE)
+        for col, col_dtype in DataBroker.PG_COPY_COL_DTYPE:
+            nd_tuple['len_%s' % col] = np.dtype(col_dtype).itemsize
+            nd_tuple[col] = tick if col == 'tick' else nd_snap[col]
+        # Signature, flags, header extension length, tuples, and trailer.
+        return b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0) + nd_tuple.tobytes() + struct.pack('>h', -1)
+
+    @staticmethod
+    def _parse_request(raw_msg):
         """
         Parse a raw message received from a simulation working process to a SQL query string.
-        :param raw_msg: (bytes) The raw message.
+        :param raw_msg: (bytes or str) The raw message.
         :return:  tuple((str or None), bool) The first component is the translated SQL string. The second component
             indicates if data feedback is needed.
         """
         logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
-        if raw_msg is None or len(raw_msg) <= 0 or not isinstance(raw_msg, str):
-            logger.error('[DataBroker:__parse_request] Invalid message: %s' % raw_msg)
+        if raw_msg is None or len(raw_msg) <= 0 or not isinstance(raw_msg, (bytes, str)):
+            logger.error('[DataBroker:_parse_request] Invalid message: %s' % raw_msg)
             return None, False
 
-        l_msg_fields = raw_msg.decode('utf-8').split('#')
+        if isinstance(raw_msg, bytes):
+            raw_msg = raw_msg.decode('utf-8')
+        l_msg_fields = raw_msg.split('#')
         # Termination cmd
         if l_msg_fields[0] == 'T':
             return 'T', False
 
         if len(l_msg_fields) < 3:
-            logger.error('[DataBroker:__parse_request] Need at least 3 fields: %s' % raw_msg)
+            logger.error('[DataBroker:_parse_request] Need at least 3 fields: %s' % raw_msg)
             return None, False
 
         # Parse conditions
@@ -353,7 +1166,7 @@ class DataBroker:
         # Parse attributes
         l_attr = l_msg_fields[2].split('|')
         if len(l_attr) < 1:
-            logger.error('[DataBroker:__parse_request] Invalid ATTRIBUTE field: %s' % raw_msg)
+            logger.error('[DataBroker:_parse_request] Invalid ATTRIBUTE field: %s' % raw_msg)
             return None, False
 
         # Parse command
@@ -366,16 +1179,25 @@ class DataBroker:
                 sql_str = """SELECT %s FROM agent_status WHERE %s""" % (sql_attr, sql_cond)
             else:
                 sql_str = """SELECT %s FROM agent_status""" % (sql_attr)
+        elif cmd == 'L':
+            data_feedback = True
+            l_aid = cond.split('|')
+            if not all([aid.isdigit() for aid in l_aid]):
+                logger.error('[DataBroker:_parse_request] Invalid agent IDs: %s' % raw_msg)
+                return None, False
+            sql_attr = ','.join(['aid'] + [attr for attr in l_attr if attr != 'aid'])
+            sql_str = """SELECT DISTINCT ON (aid) %s FROM agent_status WHERE aid IN (%s) ORDER BY aid, tick DESC""" \
+                      % (sql_attr, ','.join(l_aid))
         else:
             if len(l_msg_fields) < 4:
-                logger.error('[DataBroker:__parse_request] Need at least 4 fields: %s' % raw_msg)
+                logger.error('[DataBroker:_parse_request] Need at least 4 fields: %s' % raw_msg)
                 return None, False
             l_val = l_msg_fields[3].split('|')
             if len(l_val) < 1:
-                logger.error('[DataBroker:__parse_request] Invalid VALUE field: %s' % raw_msg)
+                logger.error('[DataBroker:_parse_request] Invalid VALUE field: %s' % raw_msg)
                 return None, False
             if len(l_attr) != len(l_val):
-                logger.error('[DataBroker:__parse_request] VALUE field does not match ATTRIBUTE field: %s'
+                logger.error('[DataBroker:_parse_request] VALUE field does not match ATTRIBUTE field: %s'
                                     % raw_msg)
                 return None, False
             if cmd == 'U':
@@ -386,30 +1208,1052 @@ class DataBroker:
                     sql_str = """UPDATE agent_status SET %s""" % (sql_set_str)
             elif cmd == 'I':
                 if len(l_attr) != 7:
-                    logger.error('[DataBroker:__parse_request] Need exactly 7 attributes for INSERT: %s'
+                    logger.error('[DataBroker:_parse_request] Need exactly 7 attributes for INSERT: %s'
                                         % raw_msg)
                     return None, False
                 sql_attr = ','.join(l_attr)
                 sql_val = ','.join(l_val)
                 sql_str = """INSERT INTO agent_status(%s) VALUES (%s)""" % (sql_attr, sql_val)
             else:
-                logger.error('[DataBroker:__parse_request] Unsupported data cmd: %s' % cmd)
+                logger.error('[DataBroker:_parse_request] Unsupported data cmd: %s' % cmd)
                 return None, False
         return sql_str, data_feedback
 
+    @staticmethod
+    def _compose_response(l_col, data_rec):
+        """
+        Compose a response message for a selected record following the response format.
+        :param l_col: (list of str) The column names of the selected record.
+        :param data_rec: (tuple) The selected record.
+        :return: (bytes) The response message.
+        """
+        aid = data_rec[l_col.index('aid')] if 'aid' in l_col else ''
+        resp_str = '#'.join([str(aid), '|'.join(l_col), '|'.join([str(val) for val in data_rec])])
+        return str.encode(resp_str)
+
     def stop_br(self):
         """
         Send the termination cmd to the server process.
         :return: None.
         """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(str.encode('T'), (GameConfig.BR_HOST, GameConfig.BR_PORT))
-        self.m_server.join()
+        stop_transport = GameTransport.get_client('BR')
+        stop_transport.send(str.encode('T'))
+        stop_transport.close()
+        for server in self.m_l_server:
+            server.join()
         self.m_receiver.join()
-        self.m_request_q.close()
+        for request_q in self.m_l_request_q:
+            request_q.close()
+        self.finalize_db()
         self.m_logger.info('[DataBroker:stop_br] DataBroker stopped.')
 
 
+class AsyncDataBroker(DataBroker):
+    """
+    An alternative DataBroker running as a single asyncio process. Requests are received by a `DatagramProtocol`,
+    and executed concurrently by `GameConfig.BR_DB_POOL_SIZE` shard coroutines, each holding a connection from an
+    async PostgreSQL connection pool. Requests are routed to shards by `aid` as in `DataBroker`. Requests stay in the
+    same process from `recvfrom` to the DB, i.e., no request is pickled through a `multiprocessing.Queue`.
+    Requests and notifications follow the same formats as `DataBroker`.
+    NOTE:
+        Requires `psycopg_pool`.
+    """
+    # The asyncio server process.
+    m_async_server = None
+
+    def _start_br(self):
+        self.m_async_server = mp.Process(target=AsyncDataBroker.__async_server_func,
+                                         args=(GameConfig.get_run_config(),), name='BR_ASYNC')
+        self.m_async_server.start()
+
+    @staticmethod
+    def __async_server_func(run_config):
+        """
+        The asyncio server process function.
+        :param run_config: (RunConfig) The config of the run, passed by value.
+        :return: None.
+        """
+        GameConfig.set_run_config(run_config)
+        logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
+        logger.info('[AsyncDataBroker:__async_server_func] Server started.')
+        asyncio.run(AsyncDataBroker.__serve())
+        logger.info('[AsyncDataBroker:__async_server_func] Server stopped.')
+
+    @staticmethod
+    async def __serve():
+        """
+        Open the connection pool and the datagram endpoint, and serve until 'T' is received.
+        :return: None.
+        """
+        from psycopg_pool import AsyncConnectionPool
+
+        loop = asyncio.get_running_loop()
+        stop_fut = loop.create_future()
+        d_db_kwargs = {'host': GameConfig.DB_HOST,
+                       'port': GameConfig.DB_PORT,
+                       'dbname': GameConfig.DB_NAME,
+                       'user': GameConfig.DB_USER,
+                       'password': GameConfig.DB_PASSWORD}
+        async with AsyncConnectionPool(kwargs=d_db_kwargs,
+                                       min_size=GameConfig.BR_DB_POOL_SIZE,
+                                       max_size=GameConfig.BR_DB_POOL_SIZE,
+                                       open=False) as db_pool:
+            if GameConfig.TRANSPORT == 'shm':
+                # Pump messages from shared memory channels into the protocol.
+                transport = GameTransport.get_server('BR')
+                protocol = BrDatagramProtocol(db_pool, stop_fut)
+                protocol.connection_made(transport)
+                try:
+                    while not stop_fut.done():
+                        msg, addr = transport.recv(0)
+                        if msg is None:
+                            await asyncio.sleep(GameConfig.SHM_POLL_SEC)
+                        else:
+                            protocol.datagram_received(msg, addr)
+                            await asyncio.sleep(0)
+                    await protocol.drain()
+                finally:
+                    transport.close()
+                return
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: BrDatagramProtocol(db_pool, stop_fut),
+                local_addr=(GameConfig.BR_HOST, GameConfig.BR_PORT))
+            try:
+                await stop_fut
+                await protocol.drain()
+            finally:
+                transport.close()
+
+    def stop_br(self):
+        """
+        Send the termination cmd to the asyncio server process.
+        :return: None.
+        """
+        stop_transport = GameTransport.get_client('BR')
+        stop_transport.send(str.encode('T'))
+        stop_transport.close()
+        self.m_async_server.join()
+        self.finalize_db()
+        self.m_logger.info('[AsyncDataBroker:stop_br] AsyncDataBroker stopped.')
+
+
+class BrDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    The request receiver of `AsyncDataBroker`. Requests are routed to shard coroutines by the hash of `aid`, and the
+    shards run their requests on the DB concurrently. Credits are granted back to clients in batches as their
+    requests finish.
+    """
+    def __init__(self, db_pool, stop_fut):
+        """
+        Constructor.
+        :param db_pool: (psycopg_pool.AsyncConnectionPool) The opened connection pool.
+        :param stop_fut: (asyncio.Future) Set when the termination cmd is received.
+        """
+        self.m_logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
+        self.m_db_pool = db_pool
+        self.m_stop_fut = stop_fut
+        self.m_transport = None
+        self.m_credit_ledger = BrCreditLedger()
+        self.m_state_cache = BrStateCache()
+        # The count of requests done for each (client, epoch), and not yet granted back.
+        self.m_d_done = dict()
+        self.m_flush_handle = None
+        # The request queues and the tasks of shards.
+        self.m_l_shard_q = [asyncio.Queue() for _ in range(GameConfig.BR_DB_POOL_SIZE)]
+        self.m_l_shard_task = []
+        self.m_rr_idx = 0
+
+    def connection_made(self, transport):
+        self.m_transport = transport
+        self.m_l_shard_task = [asyncio.ensure_future(self.__shard_func(shard_q)) for shard_q in self.m_l_shard_q]
+
+    def datagram_received(self, data, addr):
+        if data[:1] == b'N':
+            # A snapshot chunk. Its records are split by `aid` as other requests, and each shard reassembles the
+            # snapshot of its agents.
+            if not self.m_credit_ledger.consume(addr):
+                self.m_logger.debug('[BrDatagramProtocol:datagram_received] Dropped snapshot chunk without credit '
+                                    'from %s' % (addr,))
+                return
+            self.m_state_cache.apply_snapshot_chunk(data)
+            l_piece = DataBroker._split_snapshot_chunk(data, len(self.m_l_shard_q))
+            self.m_credit_ledger.expand(addr, len(l_piece) - 1)
+            for shard_idx, piece in enumerate(l_piece):
+                self.m_l_shard_q[shard_idx].put_nowait((piece, addr, self.m_credit_ledger.get_epoch(addr)))
+            return
+        msg = data.decode('utf-8')
+        if msg == 'T':
+            # Terminate all clients.
+            for client_addr in self.m_credit_ledger.get_all_clients():
+                self.m_transport.sendto(str.encode('T'), client_addr)
+            if not self.m_stop_fut.done():
+                self.m_stop_fut.set_result(None)
+        elif msg == 'R':
+            # Register a client, or resync the credits of a registered client.
+            epoch, cnt_credit = self.m_credit_ledger.register(addr)
+            self.m_transport.sendto(str.encode('S#%s#%s' % (epoch, cnt_credit)), addr)
+        elif msg == 'X':
+            # Unregister a closed client, and hand its credits to the others.
+            self.m_credit_ledger.unregister(addr)
+            self.__rebalance()
+        else:
+            if not self.m_credit_ledger.consume(addr):
+                self.m_logger.debug('[BrDatagramProtocol:datagram_received] Dropped request without credit from %s: %s'
+                                    % (addr, msg))
+                return
+            if msg[:2] == 'L#':
+                # Serve the cached agents, and only read the missed ones from the DB.
+                msg = self.m_state_cache.serve_read(msg, addr, self.m_transport.sendto)
+                if msg is None:
+                    self.__grant(addr, 1, self.m_credit_ledger.get_epoch(addr))
+                    return
+            l_part = DataBroker._split_request(msg)
+            self.m_credit_ledger.expand(addr, len(l_part) - 1)
+            for aid, part_msg in l_part:
+                if aid is not None:
+                    shard_idx = DataBroker._get_shard_idx(aid, len(self.m_l_shard_q))
+                else:
+                    shard_idx = self.m_rr_idx
+                    self.m_rr_idx = (self.m_rr_idx + 1) % len(self.m_l_shard_q)
+                self.m_state_cache.begin_request(part_msg)
+                self.m_l_shard_q[shard_idx].put_nowait((part_msg, addr, self.m_credit_ledger.get_epoch(addr)))
+
+    def error_received(self, exc):
+        self.m_logger.error('[BrDatagramProtocol:error_received] %s' % exc)
+
+    async def __shard_func(self, shard_q):
+        """
+        Execute the requests of a shard in order on one pooled connection, and send back the selected records if
+        needed. The finished 'I' and 'U' requests are applied to the state cache. The shard stops when it sees `None`.
+        :param shard_q: (asyncio.Queue) The request queue of this shard.
+        :return: None.
+        """
+        snap_buffer = BrSnapshotBuffer()
+        async with self.m_db_pool.connection() as db_con:
+            await db_con.set_autocommit(True)
+            while True:
+                request = await shard_q.get()
+                if request is None:
+                    for tick, nd_snap in snap_buffer.flush_all():
+                        await self.__copy_snapshot(db_con, tick, nd_snap)
+                    break
+                msg, addr, epoch = request
+                if isinstance(msg, bytes):
+                    for tick, nd_snap in snap_buffer.add_chunk(addr, msg):
+                        await self.__copy_snapshot(db_con, tick, nd_snap)
+                    sql_str = None
+                else:
+                    sql_str, data_fb = DataBroker._parse_request(msg)
+                applied = False
+                if sql_str is not None:
+                    try:
+                        async with db_con.cursor() as db_cur:
+                            await db_cur.execute(sql_str)
+                            if data_fb:
+                                l_col = [col.name for col in db_cur.description]
+                                async for data_rec in db_cur:
+                                    self.m_transport.sendto(DataBroker._compose_response(l_col, data_rec), addr)
+                        applied = True
+                    except Exception as e:
+                        self.m_logger.error('[BrDatagramProtocol:__shard_func] Failed request %s: %s' % (msg, e))
+                if isinstance(msg, str):
+                    self.m_state_cache.end_request(msg, applied)
+                self.__request_done(addr, epoch)
+
+    async def __copy_snapshot(self, db_con, tick, nd_snap):
+        """
+        Ingest a snapshot into `agent_status` by one binary `COPY`.
+        :param db_con: (psycopg.AsyncConnection)
+        :param tick: (int) The tick of the snapshot.
+        :param nd_snap: (1D structured ndarray of `SNAP_DTYPE`) The snapshot records.
+        :return: None.
+        """
+        if len(nd_snap) <= 0:
+            return
+        try:
+            async with db_con.cursor() as db_cur:
+                async with db_cur.copy(DataBroker.SNAP_COPY_SQL) as copy:
+                    await copy.write(DataBroker._snapshot_to_pgcopy(tick, nd_snap))
+        except Exception as e:
+            self.m_logger.error('[BrDatagramProtocol:__copy_snapshot] Failed snapshot at tick %s: %s' % (tick, e))
+
+    def __request_done(self, addr, epoch):
+        """
+        Count a finished request. Credits are granted back once a batch is full, or after
+        `GameConfig.BR_CREDIT_FLUSH_SEC`.
+        :param addr: (tuple) The address of the request sender.
+        :param epoch: (int) The epoch the request was accepted in.
+        :return: None.
+        """
+        self.m_d_done[(addr, epoch)] = self.m_d_done.get((addr, epoch), 0) + 1
+        if self.m_d_done[(addr, epoch)] >= GameConfig.BR_CREDIT_BATCH:
+            self.__grant(addr, self.m_d_done.pop((addr, epoch)), epoch)
+        elif self.m_flush_handle is None:
+            self.m_flush_handle = asyncio.get_running_loop().call_later(GameConfig.BR_CREDIT_FLUSH_SEC,
+                                                                        self.__flush_done)
+
+    def __flush_done(self):
+        self.m_flush_handle = None
+        for (client_addr, epoch), cnt_done in self.m_d_done.items():
+            self.__grant(client_addr, cnt_done, epoch)
+        self.m_d_done.clear()
+
+    def __grant(self, addr, cnt_done, epoch):
+        cnt_grant = self.m_credit_ledger.release(addr, cnt_done, epoch)
+        if cnt_grant > 0 and not self.m_transport.is_closing():
+            self.m_transport.sendto(DataBroker._compose_grant(self.m_credit_ledger, addr, cnt_grant), addr)
+        self.__rebalance()
+
+    def __rebalance(self):
+        for short_addr, cnt_grant in self.m_credit_ledger.rebalance():
+            if not self.m_transport.is_closing():
+                self.m_transport.sendto(DataBroker._compose_grant(self.m_credit_ledger, short_addr, cnt_grant),
+                                        short_addr)
+
+    async def drain(self):
+        """
+        Wait for all queued requests to finish, and stop the shards.
+        :return: None.
+        """
+        for shard_q in self.m_l_shard_q:
+            shard_q.put_nowait(None)
+        await asyncio.gather(*self.m_l_shard_task, return_exceptions=True)
+        if self.m_flush_handle is not None:
+            self.m_flush_handle.cancel()
+            self.m_flush_handle = None
+        self.m_logger.info('[BrDatagramProtocol:drain] Stats: %s, Cache: %s'
+                           % (self.m_credit_ledger.get_stats(), self.m_state_cache.get_stats()))
+
+
+class BrCreditLedger:
+    """
+    The credit-based flow control of DataBroker.
+    Each registered client holds a number of request credits, and every request it sends consumes one credit. A
+    client stops sending at zero credits, and a request arriving without a credit is dropped and counted. Credits
+    return to the client when its requests are done. The total number of credits, held by clients or in flight,
+    never exceeds `GameConfig.BR_Q_EXP_LEN`, which bounds the request queue without relying on `qsize()`.
+    The pool is shared fairly: the window of each client is `max(1, pool // clients)`, capped by
+    `GameConfig.BR_CREDIT_WINDOW`. When a client joins, the others shrink to the new window as their credits come
+    back, and the freed credits are handed to the clients below their window by `rebalance`. A client unregisters
+    when it closes.
+    A resync starts a new epoch of the client. Requests are tagged with the epoch they are accepted in, and so are
+    their 'D' messages. The in-flight credits of older epochs become stale: they stay in the pool and in the window
+    of the client until their 'D' messages arrive, since their requests may still be queued, and then they are
+    handed back to the client in its current epoch. So a resync never lets a client exceed its window, however slow
+    the DB is.
+    NOTE:
+        With more clients than credits, each client still gets a window of one credit, so the total may exceed the
+        pool by at most the number of clients.
+        The stale credits of a lost 'D' message are only freed when the client unregisters.
+    """
+    def __init__(self, max_credit=None, window=None):
+        """
+        Constructor.
+        :param max_credit: (int) The total number of credits. Default: `GameConfig.BR_Q_EXP_LEN`.
+        :param window: (int) The max number of credits for each client. Default: `GameConfig.BR_CREDIT_WINDOW`.
+        """
+        self.m_max_credit = max_credit if max_credit is not None else GameConfig.BR_Q_EXP_LEN
+        self.m_window = window if window is not None else GameConfig.BR_CREDIT_WINDOW
+        # Credits held by each client.
+        self.m_d_held = dict()
+        # Requests accepted in the current epoch but not done for each client.
+        self.m_d_inflight = dict()
+        # Requests accepted in older epochs but not done for each client.
+        self.m_d_stale = dict()
+        # The current epoch of each client.
+        self.m_d_epoch = dict()
+        # The clients below their window.
+        self.m_s_short = set()
+        # Credits held or in flight over all clients.
+        self.m_total = 0
+        self.m_cnt_register = 0
+        self.m_cnt_unregister = 0
+        self.m_cnt_resync = 0
+        self.m_cnt_late_done = 0
+        self.m_cnt_accept = 0
+        self.m_cnt_drop = 0
+
+    def get_window(self):
+        """
+        :return: (int) The max number of credits held or in flight for each client.
+        """
+        return max(1, min(self.m_window, self.m_max_credit // max(1, len(self.m_d_held))))
+
+    def __get_used(self, addr):
+        """
+        :return: (int) The credits of a client held, in flight, or stale.
+        """
+        return self.m_d_held[addr] + self.m_d_inflight[addr] + self.m_d_stale[addr]
+
+    def __top_up(self, addr):
+        """
+        Top up the credits of a client to the window from the free credits.
+        :return: (int) The number of credits added.
+        """
+        window = self.get_window()
+        cnt_used = self.__get_used(addr)
+        cnt_top_up = window - cnt_used
+        if cnt_used <= 0:
+            # Every client gets at least one credit.
+            cnt_top_up = max(1, min(cnt_top_up, self.m_max_credit - self.m_total))
+        else:
+            cnt_top_up = max(0, min(cnt_top_up, self.m_max_credit - self.m_total))
+        self.m_d_held[addr] += cnt_top_up
+        self.m_total += cnt_top_up
+        if cnt_used + cnt_top_up < window:
+            self.m_s_short.add(addr)
+        else:
+            self.m_s_short.discard(addr)
+        return cnt_top_up
+
+    def register(self, addr):
+        """
+        Register a client, and top up its credits to the window if possible. A registered client re-registers when
+        it has waited too long for credits, e.g., grants or requests were lost, or the DB is slow, which resyncs its
+        credits in a new epoch: its in-flight credits become stale, and the held ones are announced again.
+        :param addr: (tuple) The client address.
+        :return: (int, int) The epoch of the client and the number of credits it holds now.
+        """
+        if addr in self.m_d_held:
+            self.m_cnt_resync += 1
+            self.m_d_stale[addr] += self.m_d_inflight[addr]
+            self.m_d_inflight[addr] = 0
+            self.m_d_epoch[addr] += 1
+        else:
+            self.m_cnt_register += 1
+            self.m_d_held[addr] = 0
+            self.m_d_inflight[addr] = 0
+            self.m_d_stale[addr] = 0
+            self.m_d_epoch[addr] = 0
+        self.__top_up(addr)
+        return self.m_d_epoch[addr], self.m_d_held[addr]
+
+    def get_epoch(self, addr):
+        """
+        :param addr: (tuple) The client address.
+        :return: (int) The current epoch of the client. None if it is not registered.
+        """
+        return self.m_d_epoch.get(addr)
+
+    def unregister(self, addr):
+        """
+        Remove a closed client, and free all its credits.
+        :param addr: (tuple) The client address.
+        :return: None.
+        """
+        if addr not in self.m_d_held:
+            return
+        self.m_cnt_unregister += 1
+        self.m_total -= self.m_d_held.pop(addr) + self.m_d_inflight.pop(addr) + self.m_d_stale.pop(addr)
+        self.m_d_epoch.pop(addr)
+        self.m_s_short.discard(addr)
+        # The window may grow, so every client is a candidate of `rebalance`.
+        self.m_s_short.update(self.m_d_held.keys())
+
+    def rebalance(self):
+        """
+        Hand the free credits to the clients below their window.
+        :return: (list of (tuple, int)) The client addresses and the numbers of credits to be granted to them.
+        """
+        l_grant = []
+        for addr in list(self.m_s_short):
+            if self.m_total >= self.m_max_credit:
+                break
+            cnt_grant = self.__top_up(addr)
+            if cnt_grant > 0:
+                l_grant.append((addr, cnt_grant))
+        return l_grant
+
+    def consume(self, addr):
+        """
+        Consume a credit for an incoming request.
+        :param addr: (tuple) The client address.
+        :return: (bool) True if the request is accepted. False if it should be dropped.
+        """
+        if self.m_d_held.get(addr, 0) <= 0:
+            self.m_cnt_drop += 1
+            return False
+        self.m_d_held[addr] -= 1
+        self.m_d_inflight[addr] += 1
+        self.m_cnt_accept += 1
+        return True
+
+    def expand(self, addr, cnt_extra):
+        """
+        Count the extra parts an accepted request is split into as in flight, so that the 'D' messages of all parts
+        are matched. See `DataBroker._split_request`.
+        :param addr: (tuple) The client address.
+        :param cnt_extra: (int) The number of parts minus one.
+        :return: None.
+        """
+        if cnt_extra <= 0 or addr not in self.m_d_inflight:
+            return
+        self.m_d_inflight[addr] += cnt_extra
+        self.m_total += cnt_extra
+
+    def release(self, addr, cnt_done, epoch):
+        """
+        Return the credits of done requests to the client.
+        :param addr: (tuple) The client address.
+        :param cnt_done: (int) The number of done requests.
+        :param epoch: (int) The epoch the requests were accepted in.
+        :return: (int) The number of credits to be granted to the client in its current epoch.
+        """
+        if addr not in self.m_d_inflight:
+            return 0
+        if epoch != self.m_d_epoch[addr]:
+            # Requests of older epochs free their stale credits, which go back to the client within its window.
+            cnt_done = min(cnt_done, self.m_d_stale[addr])
+            self.m_cnt_late_done += cnt_done
+            self.m_d_stale[addr] -= cnt_done
+            self.m_total -= cnt_done
+            return self.__top_up(addr)
+        cnt_done = min(cnt_done, self.m_d_inflight[addr])
+        self.m_d_inflight[addr] -= cnt_done
+        # Retire the credits beyond the window, e.g., after other clients joined.
+        cnt_retire = min(cnt_done, max(0, self.__get_used(addr) + cnt_done - self.get_window()))
+        self.m_d_held[addr] += cnt_done - cnt_retire
+        self.m_total -= cnt_retire
+        return cnt_done - cnt_retire
+
+    def get_all_clients(self):
+        return list(self.m_d_held.keys())
+
+    def get_stats(self):
+        """
+        :return: (dict) The counters of the flow control.
+        """
+        return {'clients': len(self.m_d_held),
+                'window': self.get_window(),
+                'register': self.m_cnt_register,
+                'unregister': self.m_cnt_unregister,
+                'resync': self.m_cnt_resync,
+                'late_done': self.m_cnt_late_done,
+                'accept': self.m_cnt_accept,
+                'drop': self.m_cnt_drop,
+                'inflight': sum(self.m_d_inflight.values()),
+                'stale': sum(self.m_d_stale.values())}
+
+
+def utest_BrCreditLedger():
+    """
+    A client resyncs while its requests are still queued, e.g., on a slow DB. The resync must not grant a fresh
+    window on top of the queued requests, and the late 'D' messages of the old epoch must not be counted against the
+    requests of the new one.
+    """
+    addr = ('localhost', 3000)
+    credit_ledger = BrCreditLedger(max_credit=8, window=4)
+    if credit_ledger.register(addr) != (0, 4):
+        raise Exception('[utest_BrCreditLedger] Wrong registration.')
+    for _ in range(4):
+        credit_ledger.consume(addr)
+    for _ in range(3):
+        epoch, cnt_credit = credit_ledger.register(addr)
+        if cnt_credit != 0:
+            raise Exception('[utest_BrCreditLedger] A resync granted %s credits over queued requests.' % cnt_credit)
+    if epoch != 3:
+        raise Exception('[utest_BrCreditLedger] Wrong epoch: %s' % epoch)
+    # The late 'D' of the old epoch hands the credits back in the current epoch.
+    if credit_ledger.release(addr, 4, 0) != 4:
+        raise Exception('[utest_BrCreditLedger] Late credits are not handed back.')
+    credit_ledger.consume(addr)
+    credit_ledger.consume(addr)
+    # A duplicated late 'D' must leave the requests of the current epoch in flight.
+    if credit_ledger.release(addr, 4, 0) != 0 or credit_ledger.get_stats()['inflight'] != 2:
+        raise Exception('[utest_BrCreditLedger] A late D was counted against the current epoch: %s'
+                        % credit_ledger.get_stats())
+    if credit_ledger.release(addr, 2, 3) != 2 or credit_ledger.m_total != 4:
+        raise Exception('[utest_BrCreditLedger] Wrong credits: %s' % credit_ledger.get_stats())
+    print('[utest_BrCreditLedger] Passed.')
+
+
+class BrSnapshotBuffer:
+    """
+    Reassemble the chunks of snapshots sent by clients. A snapshot is ready when all its chunks have arrived. Since
+    UDP may lose chunks, a pending snapshot is given up, i.e., made ready as is, once a newer snapshot arrives from
+    the same client.
+    """
+    def __init__(self):
+        # The pending snapshot of each client: [tick, snapshot ID, list of chunks, count of arrived chunks].
+        self.m_d_pending = dict()
+        self.m_cnt_snap = 0
+        self.m_cnt_partial = 0
+
+    def add_chunk(self, addr, raw_chunk):
+        """
+        Add a chunk.
+        :param addr: (tuple) The client address.
+        :param raw_chunk: (bytes) The snapshot chunk.
+        :return: (list of tuple) The ready snapshots, each as (tick, 1D structured ndarray of `SNAP_DTYPE`).
+        """
+        tick, snap_id, chunk_idx, cnt_chunk, nd_chunk = DataBroker._decode_snapshot_chunk(raw_chunk)
+        l_ready = []
+        pending = self.m_d_pending.get(addr)
+        if pending is not None and pending[1] != snap_id:
+            l_ready.append(self.__assemble(self.m_d_pending.pop(addr)))
+            pending = None
+        if pending is None:
+            pending = [tick, snap_id, [None] * cnt_chunk, 0]
+            self.m_d_pending[addr] = pending
+        if pending[2][chunk_idx] is None:
+            pending[2][chunk_idx] = nd_chunk
+            pending[3] += 1
+        if pending[3] == cnt_chunk:
+            l_ready.append(self.__assemble(self.m_d_pending.pop(addr)))
+        return l_ready
+
+    def flush_all(self):
+        """
+        Give up all pending snapshots.
+        :return: (list of tuple) The snapshots, each as (tick, 1D structured ndarray of `SNAP_DTYPE`).
+        """
+        l_ready = [self.__assemble(pending) for pending in self.m_d_pending.values()]
+        self.m_d_pending.clear()
+        return l_ready
+
+    def __assemble(self, pending):
+        tick, _, l_chunk, cnt_arrived = pending
+        self.m_cnt_snap += 1
+        if cnt_arrived < len(l_chunk):
+            self.m_cnt_partial += 1
+        nd_snap = np.concatenate([nd_chunk for nd_chunk in l_chunk if nd_chunk is not None])
+        return tick, nd_snap
+
+    def get_stats(self):
+        """
+        :return: (dict) The counts of snapshots and incomplete snapshots.
+        """
+        return {'snapshot': self.m_cnt_snap, 'partial': self.m_cnt_partial}
+
+
+class BrStateCache:
+    """
+    The latest state of each agent, kept in memory by the broker front end and indexed by `aid`. It is updated from
+    snapshot requests before they are queued for the DB, and from 'I' and 'U' requests once the DB has applied them,
+    so a write rolled back by the DB never reaches the cache. 'L' reads of cached agents never touch the DB, except
+    while an 'I' or 'U' request on the agent is pending, when the read is queued behind it.
+    NOTE:
+        A 'U' request is written through only if its condition is exactly 'aid=N' or 'aid=N and tick=M', i.e., it
+        surely updates the latest record of a cached agent. An update of an older tick than the cached one is
+        ignored. Any other 'U' request invalidates the agents it may update, or the whole cache if they are unknown.
+    """
+    # The cached columns.
+    CACHE_DTYPE = np.dtype([('tick', '<i4'), ('role', '<i2'), ('state', '<i2'), ('energy', '<i4'),
+                            ('x_pos', '<f4'), ('y_pos', '<f4')])
+
+    def __init__(self, init_size=None):
+        """
+        Constructor.
+        :param init_size: (int) The initial capacity. Default: `GameConfig.NUM_AGENTS`.
+        """
+        init_size = init_size if init_size is not None else GameConfig.NUM_AGENTS
+        self.m_nd_state = np.zeros(max(1, init_size), dtype=BrStateCache.CACHE_DTYPE)
+        self.m_nd_valid = np.zeros(max(1, init_size), dtype=bool)
+        # The count of 'I' and 'U' requests queued for the DB and not yet applied, for each agent.
+        self.m_nd_pending = np.zeros(max(1, init_size), dtype=np.int32)
+        self.m_cnt_hit = 0
+        self.m_cnt_miss = 0
+        self.m_cnt_invalidate = 0
+
+    def __ensure_capacity(self, max_aid):
+        if max_aid < len(self.m_nd_state):
+            return
+        new_size = max(max_aid + 1, 2 * len(self.m_nd_state))
+        nd_state = np.zeros(new_size, dtype=BrStateCache.CACHE_DTYPE)
+        nd_state[:len(self.m_nd_state)] = self.m_nd_state
+        nd_valid = np.zeros(new_size, dtype=bool)
+        nd_valid[:len(self.m_nd_valid)] = self.m_nd_valid
+        nd_pending = np.zeros(new_size, dtype=np.int32)
+        nd_pending[:len(self.m_nd_pending)] = self.m_nd_pending
+        self.m_nd_state = nd_state
+        self.m_nd_valid = nd_valid
+        self.m_nd_pending = nd_pending
+
+    @staticmethod
+    def __get_write_aids(msg):
+        """
+        :param msg: (str) An 'I' or 'U' request.
+        :return: (list of int or None) The agents the request writes. None if they are unknown.
+        """
+        l_aid = DataBroker._get_request_aids(msg)
+        if l_aid is None or min(l_aid) < 0:
+            return None
+        return l_aid
+
+    def begin_request(self, msg):
+        """
+        Mark the agents of an 'I' or 'U' request queued for the DB as pending, or invalidate the whole cache if they
+        are unknown. Other requests are ignored.
+        :param msg: (str) The request, as queued for a server.
+        :return: None.
+        """
+        if msg[:2] not in ('I#', 'U#'):
+            return
+        l_aid = BrStateCache.__get_write_aids(msg)
+        if l_aid is None:
+            self.invalidate(None)
+            return
+        self.__ensure_capacity(max(l_aid))
+        self.m_nd_pending[l_aid] += 1
+
+    def end_request(self, msg, applied):
+        """
+        Apply an 'I' or 'U' request marked by `begin_request` once the DB has finished it. Other requests are ignored.
+        :param msg: (str) The request, as queued for a server.
+        :param applied: (bool) False if the DB failed or rolled back the request, and its agents are invalidated.
+        :return: None.
+        """
+        if msg[:2] not in ('I#', 'U#'):
+            return
+        l_aid = BrStateCache.__get_write_aids(msg)
+        if l_aid is not None:
+            self.m_nd_pending[l_aid] = np.maximum(self.m_nd_pending[l_aid] - 1, 0)
+        if applied:
+            self.apply_request(msg)
+        else:
+            self.invalidate(l_aid)
+
+    def apply_request(self, msg):
+        """
+        Apply an 'I' or 'U' request applied by the DB. Other requests are ignored. The agents of a request that cannot
+        be parsed are invalidated.
+        :param msg: (str) The request.
+        :return: None.
+        """
+        l_msg_fields = msg.split('#')
+        if len(l_msg_fields) < 4 or l_msg_fields[0] not in ('I', 'U'):
+            return
+        l_attr = l_msg_fields[2].split('|')
+        l_val = l_msg_fields[3].split('|')
+        try:
+            if len(l_attr) != len(l_val):
+                raise ValueError
+            d_attr_val = {attr.strip(): float(val) for attr, val in zip(l_attr, l_val)}
+        except ValueError:
+            self.invalidate(BrStateCache.__get_write_aids(msg))
+            return
+        if l_msg_fields[0] == 'I':
+            if 'aid' not in d_attr_val:
+                return
+            aid = int(d_attr_val['aid'])
+            if aid < 0:
+                return
+            if 'tick' not in d_attr_val:
+                # The inserted record may be the latest one of the agent.
+                self.invalidate([aid])
+                return
+        else:
+            if 'aid' in d_attr_val:
+                # Records move between agents.
+                self.invalidate(None)
+                return
+            pin_cond = DataBroker._get_pin_cond(l_msg_fields[1])
+            if pin_cond is None:
+                self.invalidate(DataBroker._get_cond_aids(l_msg_fields[1]))
+                return
+            aid, tick = pin_cond
+            if aid >= len(self.m_nd_valid) or not self.m_nd_valid[aid]:
+                return
+            if 'tick' in d_attr_val or (tick is not None and tick > self.m_nd_state[aid]['tick']):
+                # The update moves the latest record, or hits a record newer than the cached one.
+                self.invalidate([aid])
+                return
+            if tick is not None:
+                d_attr_val['tick'] = tick
+        self.__ensure_capacity(aid)
+        if self.m_nd_valid[aid] and d_attr_val.get('tick', self.m_nd_state[aid]['tick']) < self.m_nd_state[aid]['tick']:
+            return
+        for attr, val in d_attr_val.items():
+            if attr in BrStateCache.CACHE_DTYPE.names:
+                self.m_nd_state[attr][aid] = val
+        self.m_nd_valid[aid] = True
+
+    def invalidate(self, l_aid):
+        """
+        Drop agents from the cache, so their next reads go to the DB.
+        :param l_aid: (list of int or None) None for all agents.
+        :return: None.
+        """
+        self.m_cnt_invalidate += 1
+        if l_aid is None:
+            self.m_nd_valid[:] = False
+            return
+        nd_aid = np.asarray(l_aid, dtype=np.int64)
+        self.m_nd_valid[nd_aid[nd_aid < len(self.m_nd_valid)]] = False
+
+    def apply_snapshot_chunk(self, raw_chunk):
+        """
+        Apply a snapshot chunk. Agents having a newer tick cached are kept.
+        :param raw_chunk: (bytes) The snapshot chunk.
+        :return: None.
+        """
+        tick, _, _, _, nd_chunk = DataBroker._decode_snapshot_chunk(raw_chunk)
+        if len(nd_chunk) <= 0:
+            return
+        self.__ensure_capacity(int(nd_chunk['aid'].max()))
+        nd_aid = nd_chunk['aid']
+        nd_newer = ~self.m_nd_valid[nd_aid] | (self.m_nd_state['tick'][nd_aid] <= tick)
+        nd_aid = nd_aid[nd_newer]
+        nd_chunk = nd_chunk[nd_newer]
+        self.m_nd_state['tick'][nd_aid] = tick
+        for col in BrStateCache.CACHE_DTYPE.names:
+            if col != 'tick':
+                self.m_nd_state[col][nd_aid] = nd_chunk[col]
+        self.m_nd_valid[nd_aid] = True
+
+    def serve_read(self, msg, addr, send_func):
+        """
+        Serve an 'L' request from the cache. One response is sent for each cached agent.
+        :param msg: (str) The 'L' request.
+        :param addr: (tuple) The requester address.
+        :param send_func: (function) Called as `send_func(bytes, addr)` to send a response.
+        :return: (str or None) An 'L' request of the missed agents to be read from the DB. None if all are served.
+        """
+        l_msg_fields = msg.split('#')
+        if len(l_msg_fields) < 3:
+            return msg
+        try:
+            l_aid = [int(aid) for aid in l_msg_fields[1].split('|')]
+        except ValueError:
+            return msg
+        l_attr = l_msg_fields[2].split('|')
+        if not all([attr in BrStateCache.CACHE_DTYPE.names or attr == 'aid' for attr in l_attr]):
+            return msg
+        l_col = ['aid'] + [attr for attr in l_attr if attr != 'aid']
+        l_miss = []
+        for aid in l_aid:
+            if aid < len(self.m_nd_valid) and self.m_nd_valid[aid] and self.m_nd_pending[aid] <= 0:
+                cached_rec = self.m_nd_state[aid]
+                data_rec = tuple([aid] + [cached_rec[col].item() for col in l_col[1:]])
+                send_func(DataBroker._compose_response(l_col, data_rec), addr)
+            else:
+                l_miss.append(str(aid))
+        self.m_cnt_hit += len(l_aid) - len(l_miss)
+        self.m_cnt_miss += len(l_miss)
+        if len(l_miss) <= 0:
+            return None
+        return '#'.join(['L', '|'.join(l_miss), '|'.join(l_col)])
+
+    def get_stats(self):
+        """
+        :return: (dict) The counts of cached agents, cache hits, cache misses and invalidations.
+        """
+        return {'cached': int(self.m_nd_valid.sum()), 'hit': self.m_cnt_hit, 'miss': self.m_cnt_miss,
+                'invalidate': self.m_cnt_invalidate}
+
+
+def utest_BrStateCache():
+    """
+    Writes reach the cache only once the DB has applied them. Reads of an agent having a pending write go to the DB,
+    and a write that fails or cannot be parsed drops the agent from the cache.
+    """
+    state_cache = BrStateCache(init_size=4)
+    l_resp = []
+    insert_msg = 'I##aid|tick|energy|x_pos|y_pos|role|state#1|5|10|0.5|0.5|0|0'
+    state_cache.begin_request(insert_msg)
+    if state_cache.serve_read('L#1#energy', None, lambda resp, addr: l_resp.append(resp)) is None:
+        raise Exception('[utest_BrStateCache] A pending insert is served from the cache.')
+    state_cache.end_request(insert_msg, True)
+    if state_cache.serve_read('L#1#energy', None, lambda resp, addr: l_resp.append(resp)) is not None \
+            or l_resp != [b'1#aid|energy#1|10']:
+        raise Exception('[utest_BrStateCache] An applied insert is not cached: %s' % l_resp)
+    # A rolled back update leaves the agent to the DB.
+    update_msg = 'U#aid=1 and tick=5#energy#20'
+    state_cache.begin_request(update_msg)
+    state_cache.end_request(update_msg, False)
+    if state_cache.m_nd_valid[1] or state_cache.m_nd_state['energy'][1] != 10:
+        raise Exception('[utest_BrStateCache] A rolled back update reached the cache.')
+    state_cache.begin_request(insert_msg)
+    state_cache.end_request(insert_msg, True)
+    # An insert that cannot be parsed drops the previous state.
+    bad_msg = 'I##aid|tick|energy#1|6|abc'
+    state_cache.begin_request(bad_msg)
+    state_cache.end_request(bad_msg, True)
+    if state_cache.m_nd_valid[1]:
+        raise Exception('[utest_BrStateCache] An insert that cannot be parsed kept the previous state cached.')
+    print('[utest_BrStateCache] Passed.')
+
+
+class BrClient:
+    """
+    The client used by working processes to send requests to DataBroker. The client registers itself, holds the
+    credits granted by the broker, and blocks when it runs out of credits. If no grant arrives within
+    `GameConfig.BR_CREDIT_TIMEOUT`, it re-registers to resync its credits, and counts a retry.
+    """
+    def __init__(self, host, port):
+        """
+        Constructor.
+        :param host: (str) The host the client socket binds to.
+        :param port: (int) The port the client socket binds to.
+        """
+        self.m_logger = GameLog.get_logger(log_level=LOG_LEVEL, logger_name=mp.current_process().name)
+        self.m_transport = GameTransport.get_client('BR', (host, port))
+        self.m_credit = 0
+        # The epoch of the credits, set by the broker at each (re-)registration.
+        self.m_epoch = None
+        self.m_terminated = False
+        # Responses to 'S' requests.
+        self.m_l_resp = []
+        self.m_cnt_sent = 0
+        self.m_cnt_stall = 0
+        self.m_cnt_retry = 0
+        # Sends given up for lack of credits.
+        self.m_cnt_drop = 0
+        self.m_snap_id = 0
+        self.__send(str.encode('R'))
+        self.__recv_notification(GameConfig.BR_CREDIT_TIMEOUT)
+
+    def __send(self, msg):
+        while not self.m_transport.send(msg):
+            time.sleep(GameConfig.SHM_POLL_SEC)
+
+    def __recv_notification(self, timeout):
+        """
+        Receive one message from DataBroker.
+        :param timeout: (float) In seconds.
+        :return: (bool) False if nothing is received before timeout.
+        """
+        msg = self.m_transport.recv(timeout)
+        if msg is None:
+            return False
+        msg = msg.decode('utf-8')
+        if msg[:2] == 'G#':
+            _, epoch, cnt_grant = msg.split('#')
+            # Grants of another epoch were computed against credits this client no longer counts.
+            if int(epoch) == self.m_epoch:
+                self.m_credit += int(cnt_grant)
+        elif msg[:2] == 'S#':
+            _, epoch, cnt_credit = msg.split('#')
+            self.m_epoch = int(epoch)
+            self.m_credit = int(cnt_credit)
+        elif msg == 'T':
+            self.m_logger.debug('[BrClient:__recv_notification] Terminated by DataBroker.')
+            self.m_terminated = True
+        else:
+            self.m_l_resp.append(msg)
+        return True
+
+    def __wait_credit(self):
+        """
+        Block until at least one credit is held.
+        :return: (bool) False if the client is terminated or gives up.
+        """
+        if self.m_credit > 0:
+            return True
+        self.m_cnt_stall += 1
+        cnt_retry = 0
+        while self.m_credit <= 0 and not self.m_terminated:
+            if not self.__recv_notification(GameConfig.BR_CREDIT_TIMEOUT):
+                cnt_retry += 1
+                self.m_cnt_retry += 1
+                if cnt_retry > GameConfig.BR_CREDIT_MAX_RETRY:
+                    self.m_cnt_drop += 1
+                    self.m_logger.error('[BrClient:__wait_credit] No credit after %s retries. The send is dropped.'
+                                        % cnt_retry)
+                    return False
+                self.__send(str.encode('R'))
+        return not self.m_terminated
+
+    def send_request(self, cmd_str, cond_str, attr_str, val_str=None):
+        """
+        Send a request to DataBroker. Block if no credit is held.
+        :param cmd_str: (str)
+        :param cond_str: (str)
+        :param attr_str: (str)
+        :param val_str: (str)
+        :return: (bool) True if the request is sent.
+        """
+        request_str = DataBroker._compose_request(cmd_str, cond_str, attr_str, val_str)
+        if request_str is None:
+            return False
+        if not self.__wait_credit():
+            return False
+        self.__send(str.encode(request_str))
+        self.m_credit -= 1
+        self.m_cnt_sent += 1
+        return True
+
+    def send_snapshot(self, tick, nd_aid, nd_role, nd_state, nd_energy, nd_x_pos, nd_y_pos):
+        """
+        Send the states of a partition of agents at a tick as one snapshot. The broker ingests the whole snapshot by
+        one `COPY`. Each chunk of the snapshot consumes one credit.
+        :param tick: (int) The tick.
+        :param nd_aid: (1D ndarray) Agent IDs. The following arrays are aligned with it.
+        :param nd_role: (1D ndarray) Agent roles.
+        :param nd_state: (1D ndarray) Agent states.
+        :param nd_energy: (1D ndarray) Agent energies.
+        :param nd_x_pos: (1D ndarray) Agent x positions.
+        :param nd_y_pos: (1D ndarray) Agent y positions.
+        :return: (bool) True if all chunks are sent.
+        """
+        nd_snap = np.empty(len(nd_aid), dtype=DataBroker.SNAP_DTYPE)
+        nd_snap['aid'] = nd_aid
+        nd_snap['role'] = nd_role
+        nd_snap['state'] = nd_state
+        nd_snap['energy'] = nd_energy
+        nd_snap['x_pos'] = nd_x_pos
+        nd_snap['y_pos'] = nd_y_pos
+        l_chunk = DataBroker._encode_snapshot(tick, self.m_snap_id, nd_snap)
+        self.m_snap_id = (self.m_snap_id + 1) % (1 << 32)
+        for chunk in l_chunk:
+            if not self.__wait_credit():
+                return False
+            self.__send(chunk)
+            self.m_credit -= 1
+            self.m_cnt_sent += 1
+        return True
+
+    def read_latest(self, l_aid, l_attr, timeout=None):
+        """
+        Read the latest states of agents. Served by the cache of DataBroker whenever possible.
+        :param l_aid: (list of int) Agent IDs.
+        :param l_attr: (list of str) Attributes to read, e.g., ['state', 'energy'].
+        :param timeout: (float) In seconds. Default: `GameConfig.BR_CREDIT_TIMEOUT`.
+        :return: (dict or None) Keys are agent IDs. Values are dicts of attributes to values. Agents without any
+            record are absent. None if the request cannot be sent.
+        """
+        timeout = timeout if timeout is not None else GameConfig.BR_CREDIT_TIMEOUT
+        if not self.send_request('L', '|'.join([str(aid) for aid in l_aid]), '|'.join(l_attr)):
+            return None
+        s_aid = set([int(aid) for aid in l_aid])
+        d_latest = dict()
+        deadline = time.time() + timeout
+        while True:
+            l_resp = self.m_l_resp
+            self.m_l_resp = []
+            for resp in l_resp:
+                l_resp_fields = resp.split('#')
+                if len(l_resp_fields) == 3 and l_resp_fields[0].isdigit() and int(l_resp_fields[0]) in s_aid:
+                    d_latest[int(l_resp_fields[0])] = {attr: float(val) for attr, val in
+                                                       zip(l_resp_fields[1].split('|'), l_resp_fields[2].split('|'))
+                                                       if attr != 'aid'}
+                else:
+                    self.m_l_resp.append(resp)
+            remaining = deadline - time.time()
+            if len(d_latest) >= len(s_aid) or remaining <= 0 or self.m_terminated:
+                break
+            self.__recv_notification(remaining)
+        return d_latest
+
+    def get_stats(self):
+        """
+        :return: (dict) The counters of this client.
+        """
+        return {'sent': self.m_cnt_sent,
+                'stall': self.m_cnt_stall,
+                'retry': self.m_cnt_retry,
+                'drop': self.m_cnt_drop,
+                'epoch': self.m_epoch,
+                'credit': self.m_credit}
+
+    def close(self):
+        self.m_logger.debug('[BrClient:close] Stats: %s' % self.get_stats())
+        if not self.m_terminated:
+            # Free the credits of this client for the others.
+            self.__send(str.encode('X'))
+        self.m_transport.close()
+
+
 def utest_DataBroker():
     ins_gl = GameLog()
     ins_gc = GameConfig(ins_gl)
@@ -426,112 +2270,65 @@ def utest_DataBroker():
 #   Utility Classes
 ##################################################
 class GameConfig:
-    # ----- Logger Config -----#
-    LG_HOST = 'localhost'
-    LG_PORT = 1234
-    LG_BUFF_SIZE = 4096
-
-    # ----- Database Config -----#
-    DB_HOST = 'localhost'
-    DB_NAME = 'zombie_game_db'
-    DB_USER = 'fmeng'
+    """
+    The config of this process. Every field of `RunConfig` is a class attribute, taking its default from `RunConfig`
+    (set right after this class), and the config of the run from `set_run_config`. Change them only through
+    `set_run_config`, so that workers receive the same config by value.
+    Below are the settings that are not fields of `RunConfig`.
+    """
+    # The name prefix of shared memory channels.
+    SHM_PREFIX = 'zg_%s' % RUN_ID
+    # Not a field of `RunConfig`, so that it never lands in config summaries.
     DB_PASSWORD = 'michal'
 
-    # ----- DataBroker Config -----#
-    BR_HOST = 'localhost'
-    BR_PORT = 2345
-    BR_BUFF_SIZE = 10240
-    BR_Q_EXP_LEN = 1000
-
-    # ----- Simulation Config -----#
-    # Max iterations
-    # TODO
-    #   Change it.
-    MAX_ITER = 2000
-
-    # Total number of agents
-    # TODO
-    #   Change it.
-    NUM_AGENTS = 500
-
-    # Number of neighbors for each agent
-    # TODO
-    #   Change it.
-    #   NOTE: Only applicable to cases of a constant number of neighbors.
-    NUM_NEIG = 10
-
-    # Probabilities of agents
-    # TODO
-    #   Change them.
-    H_PROB = 0.25
-    D_PROB = 0.25
-    Z_PROB = 0.5
-
-    # Initial energies
-    # TODO
-    #   Change them.
-    H_ENERGY = 500
-    D_ENERGY = 500
-    Z_ENERGY = 100
-
-    # TODO
-    #   Change the following parameters.
-    # ----- Zombie Config -----#
-    BITE_PROB = 0.3
-    # The energy increase from a bite.
-    BITE_GAIN = 5
-    # The energy change of being a Zombie
-    Z_DECAY = -1
-
-    # ----- Human Config -----#
-    # The energy change caused by a bite.
-    BITE_HURT = -5
-    # The energy change due to the infection.
-    H_DECAY = -1
-    # The energy increase due to the healing.
-    LIFE_GAIN = 1
-
-    # ----- Doctor Config -----#
-    BITE_EFF = 5
-
-    # Config data
-    m_d_config = None
-    # Logger
-    m_logger = None
+    # The validated config of this run. See `RunConfig`.
+    m_run_config = None
 
     @classmethod
     def config_init(cls, config_file_path=None):
-        if config_file_path is not None and not os.path.exists(config_file_path):
-            with open(config_file_path, 'r') as in_fd:
-                try:
-                    d_config = json.load(in_fd)
-                    cls.__set_config(d_config)
-                except Exception as e:
-                    print('[GameConfig:__init__] Failed to open config file: %s' % e)
-                    sys.exit(-1)
+        """
+        Load a custom config on top of the defaults above, validate it, and apply it.
+        :param config_file_path: (str or pathlib.Path) A JSON or TOML file. None uses the defaults.
+        :return: None.
+        """
+        run_config = cls.get_run_config()
+        if config_file_path is not None:
+            try:
+                run_config = RunConfig.from_file(config_file_path, base=run_config)
+            except Exception as e:
+                print('[GameConfig:config_init] Failed to load config file: %s' % e)
+                sys.exit(-1)
+            print('[GameConfig:config_init] Successfully loaded in custom config: %s' % config_file_path)
+        else:
+            print('[GameConfig:config_init] Use default config.')
+        cls.set_run_config(run_config)
 
     @classmethod
-    def __set_config(cls, d_config):
-        if d_config is None:
-            print('[GameConfig:__set_config] Use default config.')
-        else:
-            cls.MAX_ITER = d_config['MAX_ITER'] if 'MAX_ITER' in d_config else cls.MAX_ITER
-            cls.NUM_AGENTS = d_config['NUM_AGENTS'] if 'NUM_AGENTS' in d_config else cls.NUM_AGENTS
-            cls.NUM_NEIG = d_config['NUM_NEIG'] if 'NUM_NEIG' in d_config else cls.NUM_NEIG
-            cls.H_PROB = d_config['H_PROB'] if 'H_PROB' in d_config else cls.H_PROB
-            cls.D_PROB = d_config['D_PROB'] if 'D_PROB' in d_config else cls.D_PROB
-            cls.Z_PROB = d_config['Z_PROB'] if 'Z_PROB' in d_config else cls.Z_PROB
-            cls.H_ENERGY = d_config['H_ENERGY'] if 'H_ENERGY' in d_config else cls.H_ENERGY
-            cls.D_ENERGY = d_config['D_ENERGY'] if 'D_ENERGY' in d_config else cls.D_ENERGY
-            cls.Z_ENERGY = d_config['Z_ENERGY'] if 'Z_ENERGY' in d_config else cls.Z_ENERGY
-            cls.BITE_PROB = d_config['BITE_PROB'] if 'BITE_PROB' in d_config else cls.BITE_PROB
-            cls.BITE_GAIN = d_config['BITE_GAIN'] if 'BITE_GAIN' in d_config else cls.BITE_GAIN
-            cls.Z_DECAY = d_config['Z_DECAY'] if 'Z_DECAY' in d_config else cls.Z_DECAY
-            cls.BITE_HURT = d_config['BITE_HURT'] if 'BITE_HURT' in d_config else cls.BITE_HURT
-            cls.H_DECAY = d_config['H_DECAY'] if 'H_DECAY' in d_config else cls.H_DECAY
-            cls.LIFE_GAIN = d_config['LIFE_GAIN'] if 'LIFE_GAIN' in d_config else cls.LIFE_GAIN
-            cls.BITE_EFF = d_config['BITE_EFF'] if 'MAX_ITER' in d_config else cls.BITE_EFF
-            cls.m_logger.debug('[GameConfig:__set_config] Successfully loaded in custom config.')
+    def get_run_config(cls):
+        """
+        The config of this run, to be passed to workers by value. See `set_run_config`.
+        :return: (RunConfig)
+        """
+        if cls.m_run_config is None:
+            cls.set_run_config(RunConfig.from_dict({fld.name: getattr(cls, fld.name)
+                                                    for fld in dataclasses.fields(RunConfig)}))
+        return cls.m_run_config
+
+    @classmethod
+    def set_run_config(cls, run_config):
+        """
+        Apply a validated config to the class attributes, e.g., in a worker receiving it from the main process.
+        :param run_config: (RunConfig)
+        :return: None.
+        """
+        cls.m_run_config = run_config
+        for key, val in run_config.to_dict().items():
+            setattr(cls, key, val)
+        set_out_folder(run_config.get_hash())
+
+    @classmethod
+    def get_config_hash(cls):
+        return cls.get_run_config().get_hash()
 
     @classmethod
     def config_summary(cls):
@@ -539,95 +2336,741 @@ class GameConfig:
         Summarize all configurations in a JSON file.
         :return: None.
         """
-        d_config = {
-            'MAX_ITER': cls.MAX_ITER,
-            'NUM_AGENTS': cls.NUM_AGENTS,
-            'NUM_NEIG': cls.NUM_NEIG,
-            'H_PROB': cls.H_PROB,
-            'D_PROB': cls.D_PROB,
-            'Z_PROB': cls.Z_PROB,
-            'H_ENERGY': cls.H_ENERGY,
-            'D_ENERGY': cls.D_ENERGY,
-            'Z_ENERGY': cls.Z_ENERGY,
-            'BITE_PROB': cls.BITE_PROB,
-            'BITE_GAIN': cls.BITE_GAIN,
-            'Z_DECAY': cls.Z_DECAY,
-            'BITE_HURT': cls.BITE_HURT,
-            'H_DECAY': cls.H_DECAY,
-            'LIFE_GAIN': cls.LIFE_GAIN,
-            'BITE_EFF': cls.BITE_EFF
-        }
+        d_config = cls.get_run_config().to_dict()
+        d_config['CONFIG_HASH'] = cls.get_config_hash()
         with open(CONFIG_SUM_FILE, 'w') as out_fd:
             json.dump(d_config, out_fd, indent=4)
         print('[GameConfig:config_summary] Done writing config summary file: %s' % CONFIG_SUM_FILE)
 
 
+# The defaults of all fields of `RunConfig`.
+for _fld in dataclasses.fields(RunConfig):
+    setattr(GameConfig, _fld.name, _fld.default)
+
+
+class ShmRing:
+    """
+    A single-producer single-consumer ring of fixed-size slots on a shared buffer. The producer only writes the tail
+    index and the consumer only writes the head index, so neither side takes a lock or makes a syscall per message.
+    Each slot holds a 4-byte message length followed by the message.
+    NOTE:
+        A slot is written before the tail index is advanced, and relies on stores becoming visible in program order
+        across processes, as on x86-64.
+    """
+    # The header holds the head and the tail indices.
+    HDR_SIZE = 64
+    LEN_FMT = struct.Struct('<I')
+
+    def __init__(self, buf, offset, n_slot, slot_size):
+        """
+        Constructor.
+        :param buf: (memoryview) The shared buffer.
+        :param offset: (int) The offset of this ring in `buf`.
+        :param n_slot: (int) The number of slots.
+        :param slot_size: (int) The max size of a message.
+        """
+        self.m_nd_hdr = np.ndarray((2,), dtype=np.uint64, buffer=buf, offset=offset)
+        self.m_buf = buf
+        self.m_data_offset = offset + ShmRing.HDR_SIZE
+        self.m_n_slot = n_slot
+        self.m_slot_size = slot_size
+
+    @staticmethod
+    def get_size(n_slot, slot_size):
+        return ShmRing.HDR_SIZE + n_slot * (ShmRing.LEN_FMT.size + slot_size)
+
+    def put(self, msg):
+        """
+        Invoked by the producer only.
+        :param msg: (bytes)
+        :return: (bool) False if the ring is full or the message is too large.
+        """
+        if len(msg) > self.m_slot_size:
+            return False
+        head = int(self.m_nd_hdr[0])
+        tail = int(self.m_nd_hdr[1])
+        if tail - head >= self.m_n_slot:
+            return False
+        slot_pos = self.m_data_offset + (tail % self.m_n_slot) * (ShmRing.LEN_FMT.size + self.m_slot_size)
+        ShmRing.LEN_FMT.pack_into(self.m_buf, slot_pos, len(msg))
+        msg_pos = slot_pos + ShmRing.LEN_FMT.size
+        self.m_buf[msg_pos: msg_pos + len(msg)] = msg
+        self.m_nd_hdr[1] = tail + 1
+        return True
+
+    def get(self):
+        """
+        Invoked by the consumer only.
+        :return: (bytes or None) None if the ring is empty.
+        """
+        head = int(self.m_nd_hdr[0])
+        tail = int(self.m_nd_hdr[1])
+        if head == tail:
+            return None
+        slot_pos = self.m_data_offset + (head % self.m_n_slot) * (ShmRing.LEN_FMT.size + self.m_slot_size)
+        msg_len = ShmRing.LEN_FMT.unpack_from(self.m_buf, slot_pos)[0]
+        msg_pos = slot_pos + ShmRing.LEN_FMT.size
+        msg = bytes(self.m_buf[msg_pos: msg_pos + msg_len])
+        self.m_nd_hdr[0] = head + 1
+        return msg
+
+    def is_empty(self):
+        return int(self.m_nd_hdr[0]) == int(self.m_nd_hdr[1])
+
+    def release(self):
+        self.m_nd_hdr = None
+        self.m_buf = None
+
+
+class ShmChannel:
+    """
+    A shared memory segment between one client process and the server, holding a request ring (client to server)
+    and a response ring (server to client). A client claims a channel by creating the segment named by
+    '[PREFIX]_[IDX]', which fails if the name is taken, and the server discovers channels by attaching to these names.
+    The channels left over by a crashed client are unlinked when the next run starts. See `unlink_all`.
+    """
+    # The control block holds the closed flag.
+    CTRL_SIZE = 64
+
+    def __init__(self, shm, idx, n_slot, slot_size, is_owner):
+        self.m_shm = shm
+        self.m_idx = idx
+        self.m_is_owner = is_owner
+        self.m_nd_ctrl = np.ndarray((1,), dtype=np.uint64, buffer=shm.buf)
+        ring_size = ShmRing.get_size(n_slot, slot_size)
+        self.m_req_ring = ShmRing(shm.buf, ShmChannel.CTRL_SIZE, n_slot, slot_size)
+        self.m_resp_ring = ShmRing(shm.buf, ShmChannel.CTRL_SIZE + ring_size, n_slot, slot_size)
+
+    @staticmethod
+    def get_size(n_slot, slot_size):
+        return ShmChannel.CTRL_SIZE + 2 * ShmRing.get_size(n_slot, slot_size)
+
+    @staticmethod
+    def create(prefix, n_slot, slot_size):
+        """
+        Claim a free channel.
+        :return: (ShmChannel or None) None if all `GameConfig.SHM_MAX_CHANNEL` channels are taken.
+        """
+        for idx in range(GameConfig.SHM_MAX_CHANNEL):
+            try:
+                shm = shared_memory.SharedMemory(name='%s_%s' % (prefix, idx), create=True,
+                                                 size=ShmChannel.get_size(n_slot, slot_size))
+            except FileExistsError:
+                continue
+            return ShmChannel(shm, idx, n_slot, slot_size, True)
+        return None
+
+    @staticmethod
+    def attach(prefix, idx, n_slot, slot_size):
+        """
+        Attach to a channel created by a client.
+        :return: (ShmChannel or None) None if the channel does not exist.
+        """
+        try:
+            shm = shared_memory.SharedMemory(name='%s_%s' % (prefix, idx), create=False)
+        except FileNotFoundError:
+            return None
+        # The segment is owned by the client. Keep the resource tracker of this process from unlinking it.
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return ShmChannel(shm, idx, n_slot, slot_size, False)
+
+    @staticmethod
+    def unlink_all(prefix):
+        """
+        Unlink the channels left over by processes that have not closed them, e.g., on a crash. Otherwise, the server
+        of a later run would attach to them and serve their stale messages. Call it only before any client or server
+        of this prefix starts.
+        :param prefix: (str)
+        :return: (int) The count of unlinked channels.
+        """
+        cnt_unlink = 0
+        for idx in range(GameConfig.SHM_MAX_CHANNEL):
+            try:
+                shm = shared_memory.SharedMemory(name='%s_%s' % (prefix, idx), create=False)
+            except FileNotFoundError:
+                continue
+            shm.close()
+            shm.unlink()
+            cnt_unlink += 1
+        return cnt_unlink
+
+    def is_closed(self):
+        return int(self.m_nd_ctrl[0]) != 0
+
+    def close(self):
+        """
+        The owner marks the channel closed and unlinks it. The server drains and detaches it afterwards.
+        :return: None.
+        """
+        if self.m_is_owner:
+            self.m_nd_ctrl[0] = 1
+        self.m_nd_ctrl = None
+        self.m_req_ring.release()
+        self.m_resp_ring.release()
+        self.m_shm.close()
+        if self.m_is_owner:
+            # A process attached from a fork shares the resource tracker of the owner, and has unregistered the
+            # segment. Register it again so that `unlink` unregisters it cleanly.
+            resource_tracker.register(self.m_shm._name, 'shared_memory')
+            self.m_shm.unlink()
+
+
+class GameTransport:
+    """
+    The message transports between processes on the same host. `GameConfig.TRANSPORT` selects one of:
+        - 'udp': UDP datagrams on localhost.
+        - 'shm': `ShmChannel`s in shared memory, i.e., no syscall per message.
+    Roles:
+        - 'BR': DataBroker.
+        - 'LG': GameLog.
+    Addresses are (host, port) for 'udp', and ('shm', channel index) for 'shm'.
+    """
+    @staticmethod
+    def __get_role_config(role):
+        if role == 'BR':
+            return GameConfig.BR_HOST, GameConfig.BR_PORT, GameConfig.BR_BUFF_SIZE
+        elif role == 'LG':
+            return GameConfig.LG_HOST, GameConfig.LG_PORT, GameConfig.LG_BUFF_SIZE
+        raise Exception('[GameTransport:__get_role_config] Unknown role: %s' % role)
+
+    @staticmethod
+    def get_server(role):
+        """
+        :param role: (str) 'BR' or 'LG'.
+        :return: (UdpServerTransport or ShmServerTransport)
+        """
+        host, port, buff_size = GameTransport.__get_role_config(role)
+        if GameConfig.TRANSPORT == 'shm':
+            return ShmServerTransport('%s_%s' % (GameConfig.SHM_PREFIX, role.lower()), buff_size)
+        return UdpServerTransport((host, port), buff_size)
+
+    @staticmethod
+    def clear_stale():
+        """
+        Unlink the shared memory channels left over by an earlier run of this `RUN_ID`. Called by `run_init`.
+        :return: None.
+        """
+        if GameConfig.TRANSPORT != 'shm':
+            return
+        for role in ['BR', 'LG']:
+            cnt_unlink = ShmChannel.unlink_all('%s_%s' % (GameConfig.SHM_PREFIX, role.lower()))
+            if cnt_unlink > 0:
+                print('[GameTransport:clear_stale] Unlinked %s stale channels of %s.' % (cnt_unlink, role))
+
+    @staticmethod
+    def get_client(role, bind_addr=None):
+        """
+        :param role: (str) 'BR' or 'LG'.
+        :param bind_addr: (tuple) The address a UDP client binds to. Ignored by 'shm'.
+        :return: (UdpClientTransport or ShmClientTransport)
+        """
+        host, port, buff_size = GameTransport.__get_role_config(role)
+        if GameConfig.TRANSPORT == 'shm':
+            return ShmClientTransport('%s_%s' % (GameConfig.SHM_PREFIX, role.lower()), buff_size)
+        return UdpClientTransport((host, port), buff_size, bind_addr)
+
+
+class UdpServerTransport:
+    def __init__(self, serv_addr, buff_size):
+        self.m_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.m_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, GameConfig.UDP_RCVBUF)
+        self.m_sock.bind(serv_addr)
+        self.m_buff_size = buff_size
+
+    def recv(self, timeout=None):
+        """
+        :param timeout: (float or None) In seconds. None blocks.
+        :return: (bytes, tuple) The message and the sender address. (None, None) if timed out.
+        """
+        self.m_sock.settimeout(timeout)
+        try:
+            return self.m_sock.recvfrom(self.m_buff_size)
+        except socket.timeout:
+            return None, None
+
+    def sendto(self, msg, addr):
+        self.m_sock.sendto(msg, addr)
+
+    def close(self):
+        self.m_sock.close()
+
+
+class UdpClientTransport:
+    def __init__(self, serv_addr, buff_size, bind_addr=None):
+        self.m_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if bind_addr is not None:
+            self.m_sock.bind(bind_addr)
+        self.m_serv_addr = serv_addr
+        self.m_buff_size = buff_size
+
+    def send(self, msg):
+        """
+        Send a message to the server.
+        :param msg: (bytes)
+        :return: (bool) Always True, as UDP drops silently.
+        """
+        self.m_sock.sendto(msg, self.m_serv_addr)
+        return True
+
+    def sendto(self, msg, addr):
+        """
+        Send a message to another client of the server.
+        """
+        self.m_sock.sendto(msg, addr)
+        return True
+
+    def recv(self, timeout=None):
+        """
+        :param timeout: (float or None) In seconds. None blocks.
+        :return: (bytes or None) None if timed out.
+        """
+        self.m_sock.settimeout(timeout)
+        try:
+            msg, _ = self.m_sock.recvfrom(self.m_buff_size)
+        except socket.timeout:
+            return None
+        return msg
+
+    def close(self):
+        self.m_sock.close()
+
+
+class ShmServerTransport:
+    """
+    Polls the request rings of all discovered channels in turn. New channels are discovered every
+    `GameConfig.SHM_SCAN_SEC`, and closed channels are detached once drained. A message 'F#[IDX]#[MSG]' is relayed
+    to the response ring of channel IDX, so that the response ring of each channel keeps a single producer.
+    """
+    def __init__(self, prefix, buff_size):
+        self.m_prefix = prefix
+        self.m_buff_size = buff_size
+        self.m_d_channel = dict()
+        self.m_last_scan = 0
+        self.m_rr_idx = 0
+        self.m_cnt_drop = 0
+
+    def __scan(self):
+        self.m_last_scan = time.time()
+        for idx in range(GameConfig.SHM_MAX_CHANNEL):
+            if idx not in self.m_d_channel:
+                channel = ShmChannel.attach(self.m_prefix, idx, GameConfig.SHM_N_SLOT, self.m_buff_size)
+                if channel is not None:
+                    self.m_d_channel[idx] = channel
+
+    def __poll(self):
+        """
+        :return: (bytes, tuple) The next message and its sender address. (None, None) if all rings are empty.
+        """
+        if time.time() - self.m_last_scan >= GameConfig.SHM_SCAN_SEC:
+            self.__scan()
+        l_idx = list(self.m_d_channel.keys())
+        for offset in range(len(l_idx)):
+            idx = l_idx[(self.m_rr_idx + offset) % len(l_idx)]
+            channel = self.m_d_channel[idx]
+            # Read the closed flag before the ring, so that a message put right before the channel is closed is still
+            # drained.
+            is_closed = channel.is_closed()
+            msg = channel.m_req_ring.get()
+            if msg is not None:
+                self.m_rr_idx = (self.m_rr_idx + offset + 1) % len(l_idx)
+                return msg, ('shm', idx)
+            if is_closed:
+                channel.close()
+                del self.m_d_channel[idx]
+        return None, None
+
+    def recv(self, timeout=None):
+        """
+        :param timeout: (float or None) In seconds. None blocks.
+        :return: (bytes, tuple) The message and the sender address. (None, None) if timed out.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            msg, addr = self.__poll()
+            if msg is not None and msg[:2] == b'F#':
+                _, dest_idx, msg = msg.split(b'#', 2)
+                self.sendto(msg, ('shm', int(dest_idx)))
+                continue
+            if msg is not None:
+                return msg, addr
+            if deadline is not None and time.time() >= deadline:
+                return None, None
+            time.sleep(GameConfig.SHM_POLL_SEC)
+
+    def sendto(self, msg, addr):
+        channel = self.m_d_channel.get(addr[1])
+        if channel is None or not channel.m_resp_ring.put(msg):
+            self.m_cnt_drop += 1
+
+    def is_closing(self):
+        return False
+
+    def close(self):
+        for channel in self.m_d_channel.values():
+            channel.close()
+        self.m_d_channel.clear()
+
+
+class ShmClientTransport:
+    def __init__(self, prefix, buff_size):
+        self.m_channel = ShmChannel.create(prefix, GameConfig.SHM_N_SLOT, buff_size)
+        if self.m_channel is None:
+            raise Exception('[ShmClientTransport:__init__] No free channel for %s.' % prefix)
+
+    def send(self, msg):
+        """
+        Send a message to the server.
+        :param msg: (bytes)
+        :return: (bool) False if the request ring is full.
+        """
+        return self.m_channel.m_req_ring.put(msg)
+
+    def sendto(self, msg, addr):
+        """
+        Send a message to another client of the server, relayed by the server.
+        """
+        return self.send(b'F#%d#' % addr[1] + msg)
+
+    def recv(self, timeout=None):
+        """
+        :param timeout: (float or None) In seconds. None blocks.
+        :return: (bytes or None) None if timed out.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            msg = self.m_channel.m_resp_ring.get()
+            if msg is not None:
+                return msg
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(GameConfig.SHM_POLL_SEC)
+
+    def close(self):
+        # Give the server a chance to discover the channel and drain the pending messages, e.g., 'T', before the
+        # segment is unlinked.
+        deadline = time.time() + 2 * GameConfig.SHM_SCAN_SEC
+        while not self.m_channel.m_req_ring.is_empty() and time.time() < deadline:
+            time.sleep(GameConfig.SHM_POLL_SEC)
+        self.m_channel.close()
+
+
+class BatchLogHandler(logging.Handler):
+    """
+    Buffers log records in the current process and ships them to the log listener in batches through `GameTransport`.
+    A batch is sent as b'B' + a pickled list of record dicts. See `GameConfig.LG_BATCH_*` for when a batch is shipped.
+    After a fork, the child drops the buffer inherited from its parent and opens its own transport.
+    """
+    def __init__(self):
+        super().__init__()
+        self.m_pid = None
+        self.m_transport = None
+        self.m_l_rec = []
+        self.m_batch_size = 0
+        self.m_last_flush = time.time()
+
+    def __check_pid(self):
+        if self.m_pid == os.getpid():
+            return
+        self.m_pid = os.getpid()
+        self.m_transport = None
+        self.m_l_rec = []
+        self.m_batch_size = 0
+        self.m_last_flush = time.time()
+        # Ship the remaining records when this process exits. `Finalize` also runs in `mp.Process` children, which
+        # skip `atexit`.
+        mp.util.Finalize(self, self.__on_exit, exitpriority=10)
+
+    def __on_exit(self):
+        self.flush()
+        if self.m_transport is not None and self.m_pid == os.getpid():
+            self.m_transport.close()
+        self.m_transport = None
+
+    def __to_dict(self, record):
+        """
+        The same preparation as `DatagramHandler.makePickle`, i.e., the message is formatted and the exception text is
+        rendered, so that the record pickles without its args.
+        """
+        d_rec = dict(record.__dict__)
+        d_rec['msg'] = record.getMessage()
+        d_rec['args'] = None
+        d_rec['exc_info'] = None
+        if record.exc_info and not record.exc_text:
+            d_rec['exc_text'] = logging.Formatter().formatException(record.exc_info)
+        d_rec.pop('message', None)
+        return d_rec
+
+    def __ship(self, l_rec):
+        if len(l_rec) <= 0:
+            return
+        msg = b'B' + pickle.dumps(l_rec, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(msg) > GameConfig.LG_BUFF_SIZE:
+            if len(l_rec) > 1:
+                mid = len(l_rec) // 2
+                self.__ship(l_rec[:mid])
+                self.__ship(l_rec[mid:])
+                return
+            # A single oversized record is truncated.
+            l_rec[0]['msg'] = l_rec[0]['msg'][:GameConfig.LG_BUFF_SIZE // 2] + '...'
+            l_rec[0]['exc_text'] = None
+            msg = b'B' + pickle.dumps(l_rec, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.m_transport is None:
+            self.m_transport = GameTransport.get_client('LG')
+        while not self.m_transport.send(msg):
+            time.sleep(GameConfig.SHM_POLL_SEC)
+
+    def emit(self, record):
+        try:
+            self.__check_pid()
+            d_rec = self.__to_dict(record)
+            rec_size = len(d_rec['msg']) + 256
+            if self.m_batch_size + rec_size > GameConfig.LG_BUFF_SIZE:
+                self.flush()
+            self.m_l_rec.append(d_rec)
+            self.m_batch_size += rec_size
+            if len(self.m_l_rec) >= GameConfig.LG_BATCH_MAX_REC \
+                    or record.levelno >= GameConfig.LG_BATCH_FLUSH_LEVEL \
+                    or time.time() - self.m_last_flush >= GameConfig.LG_BATCH_FLUSH_SEC:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.m_pid != os.getpid():
+                return
+            l_rec = self.m_l_rec
+            self.m_l_rec = []
+            self.m_batch_size = 0
+            self.m_last_flush = time.time()
+            self.__ship(l_rec)
+        finally:
+            self.release()
+
+    def close(self):
+        self.__on_exit()
+        super().close()
+
+
+class BufferedFileMixin:
+    """
+    Makes a `FileHandler` not flush per record. The file is written through a buffer of
+    `GameConfig.LG_FILE_BUFF_SIZE` bytes, and `flush_buffer` forces the buffered lines out.
+    """
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=GameConfig.LG_FILE_BUFF_SIZE, encoding=self.encoding,
+                    errors=self.errors)
+
+    def flush(self):
+        pass
+
+    def flush_buffer(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class BufferedFileHandler(BufferedFileMixin, logging.FileHandler):
+    pass
+
+
+class BufferedRotatingFileHandler(BufferedFileMixin, handlers.RotatingFileHandler):
+    pass
+
+
+class BufferedTimedRotatingFileHandler(BufferedFileMixin, handlers.TimedRotatingFileHandler):
+    pass
+
+
+def gzip_namer(name):
+    return name + '.gz'
+
+
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as src_fd, gzip.open(dest, 'wb') as dest_fd:
+        shutil.copyfileobj(src_fd, dest_fd)
+    os.remove(source)
+
+
 class GameLog:
     # Log listener process.
     m_log_listen_proc = None
+    # Listener counters shared with the other processes. See `get_stats`.
+    m_nd_stats = None
+    STATS_FIELDS = ['recv_batch', 'drop_batch', 'drop_rec', 'write_rec']
+    # The local handler of the records logged after `stop_log`.
+    m_stop_handler = None
 
     @classmethod
     def start_log(cls):
-        cls.m_log_listen_proc = mp.Process(target=GameLog.__log_listener, args=())
+        if cls.m_stop_handler is not None:
+            logging.getLogger().removeHandler(cls.m_stop_handler)
+            cls.m_stop_handler = None
+        cls.m_nd_stats = mp.Array('q', len(GameLog.STATS_FIELDS))
+        cls.m_log_listen_proc = mp.Process(target=GameLog.__log_listener,
+                                           args=(cls.m_nd_stats, GameConfig.get_run_config()))
         cls.m_log_listen_proc.start()
 
+    @classmethod
+    def get_stats(cls):
+        """
+        The counters of the log listener:
+            - 'recv_batch': The number of batches received.
+            - 'drop_batch': The number of batches dropped because the write queue was full.
+            - 'drop_rec': The number of records in the dropped batches.
+            - 'write_rec': The number of records handed to the file.
+        :return: (dict)
+        """
+        if cls.m_nd_stats is None:
+            return None
+        return dict(zip(GameLog.STATS_FIELDS, cls.m_nd_stats[:]))
+
     @staticmethod
     def __init_logger():
         # Create global logger.
+        game_logger = logging.getLogger()
+        # The listener may be forked after `get_logger`. It must not ship records to itself.
+        for log_handler in list(game_logger.handlers):
+            if isinstance(log_handler, BatchLogHandler):
+                game_logger.removeHandler(log_handler)
         if LOG_FILE is not None:
-            log_handler = logging.FileHandler(LOG_FILE)
+            if GameConfig.LG_ROTATE == 'size':
+                log_handler = BufferedRotatingFileHandler(LOG_FILE, maxBytes=GameConfig.LG_ROTATE_MAX_BYTES,
+                                                          backupCount=GameConfig.LG_ROTATE_BACKUP)
+            elif GameConfig.LG_ROTATE == 'time':
+                log_handler = BufferedTimedRotatingFileHandler(LOG_FILE, when=GameConfig.LG_ROTATE_WHEN,
+                                                               interval=GameConfig.LG_ROTATE_INTERVAL,
+                                                               backupCount=GameConfig.LG_ROTATE_BACKUP)
+            else:
+                log_handler = BufferedFileHandler(LOG_FILE)
+            if GameConfig.LG_ROTATE is not None and GameConfig.LG_ROTATE_GZIP:
+                log_handler.namer = gzip_namer
+                log_handler.rotator = gzip_rotator
         else:
             log_handler = logging.StreamHandler(sys.stdout)
         log_fmt = logging.Formatter('%(name)s %(levelname)s %(message)s')
-        game_logger = logging.getLogger()
         log_handler.setFormatter(log_fmt)
         game_logger.addHandler(log_handler)
         game_logger.setLevel(LOG_LEVEL)
 
     @staticmethod
-    def __log_listener():
+    def __flush_file():
+        for log_handler in logging.getLogger().handlers:
+            # The rotating handlers only share the mixin with `BufferedFileHandler`.
+            if isinstance(log_handler, BufferedFileMixin):
+                log_handler.flush_buffer()
+
+    @staticmethod
+    def __log_writer(write_q, nd_stats):
+        """
+        The writer thread of the log listener. Unpacks batches and hands the records to the file.
+        """
+        while True:
+            try:
+                # The file is flushed whenever the writer goes idle.
+                msg = write_q.get(timeout=GameConfig.LG_BATCH_FLUSH_SEC)
+            except queue.Empty:
+                GameLog.__flush_file()
+                continue
+            if msg is None:
+                break
+            try:
+                l_rec = pickle.loads(msg[1:])
+                for d_rec in l_rec:
+                    msg_rec = logging.makeLogRecord(d_rec)
+                    logging.getLogger(msg_rec.name).handle(msg_rec)
+                with nd_stats.get_lock():
+                    nd_stats[3] += len(l_rec)
+            except Exception as e:
+                print('[GameLog:__log_writer] Error: %s' % e)
+        GameLog.__flush_file()
+
+    @staticmethod
+    def __log_listener(nd_stats, run_config):
+        """
+        The receive loop only enqueues batches for `__log_writer`, so that slow disk I/O does not leave the transport
+        unread. A batch is dropped if the write queue is full.
+        :param nd_stats: (multiprocessing.Array) See `get_stats`.
+        :param run_config: (RunConfig) The config of the run, passed by value.
+        """
+        GameConfig.set_run_config(run_config)
         GameLog.__init_logger()
-        serv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        serv_sock.bind((GameConfig.LG_HOST, GameConfig.LG_PORT))
+        serv_transport = GameTransport.get_server('LG')
+        write_q = queue.Queue(maxsize=GameConfig.LG_WRITE_Q_LEN)
+        writer = threading.Thread(target=GameLog.__log_writer, args=(write_q, nd_stats), name='LG_WRITER')
+        writer.start()
         logger = logging.getLogger()
         logger.info('[GameLog:__log_listener] Started logging.')
         while True:
             try:
-                msg, addr = serv_sock.recvfrom(GameConfig.LG_BUFF_SIZE)
-                if msg[:1].decode('utf-8') == 'T':
+                msg, addr = serv_transport.recv()
+                if msg[:1] == b'T':
                     break
-                msg_rec = logging.makeLogRecord(pickle.loads(msg[4:]))
-                logger = logging.getLogger(msg_rec.name)
-                logger.handle(msg_rec)
+                if msg[:1] != b'B':
+                    raise Exception('Unknown message: %s' % msg[:16])
+                with nd_stats.get_lock():
+                    nd_stats[0] += 1
+                try:
+                    write_q.put_nowait(msg)
+                except queue.Full:
+                    # Only counting the records of a dropped batch costs an unpickling on this thread.
+                    cnt_rec = len(pickle.loads(msg[1:]))
+                    with nd_stats.get_lock():
+                        nd_stats[1] += 1
+                        nd_stats[2] += cnt_rec
             except Exception as e:
                 print('[GameLog:__log_listener] Error: %s' % e)
+        serv_transport.close()
+        write_q.put(None)
+        writer.join()
         logger = logging.getLogger()
-        logger.info('[GameLog:__log_listener] Stopped logging.')
+        logger.info('[GameLog:__log_listener] Stopped logging. Stats: %s'
+                    % dict(zip(GameLog.STATS_FIELDS, nd_stats[:])))
+        logging.shutdown()
 
     @classmethod
     def stop_log(cls):
         """
         `None` as a special log message is sent to the log listener, and then the listener quits after seeing it.
+        The records logged in this process afterwards go to the local stderr, since no one receives shipped ones.
         :return: None.
         """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(str.encode('T'), (GameConfig.LG_HOST, GameConfig.LG_PORT))
+        # Ship what this process has buffered before the listener quits.
+        for log_handler in logging.getLogger().handlers:
+            if isinstance(log_handler, BatchLogHandler):
+                log_handler.flush()
+        stop_transport = GameTransport.get_client('LG')
+        stop_transport.send(str.encode('T'))
+        stop_transport.close()
         cls.m_log_listen_proc.join()
         logger = logging.getLogger()
-        logger.info('[GameLog:stop_log] GameLog stopped.')
+        for log_handler in list(logger.handlers):
+            if isinstance(log_handler, BatchLogHandler):
+                logger.removeHandler(log_handler)
+                log_handler.close()
+        cls.m_stop_handler = logging.StreamHandler(sys.stderr)
+        cls.m_stop_handler.setFormatter(logging.Formatter('%(name)s %(levelname)s %(message)s'))
+        logger.addHandler(cls.m_stop_handler)
+        logger.info('[GameLog:stop_log] GameLog stopped. Stats: %s' % cls.get_stats())
 
     @classmethod
     def get_logger(cls, log_level=LOG_LEVEL, logger_name=None):
         """
-        Returns a UDP-based logger.
+        Returns a logger shipping records to the log listener in batches. The root logger holds exactly one
+        `BatchLogHandler` no matter how many times this is called, and none after `stop_log`.
         :return: (logging.Logger)
         """
         if cls.m_log_listen_proc is None:
             raise Exception('[GameLog:get_logger] The listener has not been initialized.')
 
-        log_handler = handlers.DatagramHandler(GameConfig.LG_HOST, GameConfig.LG_PORT)
         logger = logging.getLogger()
-        logger.addHandler(log_handler)
+        if cls.m_stop_handler is None \
+                and not any(isinstance(log_handler, BatchLogHandler) for log_handler in logger.handlers):
+            logger.addHandler(BatchLogHandler())
         logger.setLevel(log_level)
         if logger_name is not None:
             logger = logging.getLogger(logger_name)
@@ -671,7 +3114,82 @@ def utest_GameLog():
         w.join()
 
     GameLog.stop_log()
+    # The records logged after the stop must not be shipped to the stopped listener.
+    GameLog.get_logger(log_level=LOG_LEVEL).info('[utest_GameLog] Logged after stop.')
+    if any(isinstance(log_handler, BatchLogHandler) for log_handler in logging.getLogger().handlers):
+        raise Exception('[utest_GameLog] Records logged after stop_log are shipped to the stopped listener.')
+
+
+def utest_BufferedFileMixin():
+    """
+    The idle flush of the log listener reaches every buffered file handler, the rotating ones included.
+    """
+    import tempfile
+
+    root_logger = logging.getLogger()
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        l_handler = [BufferedFileHandler(pathlib.Path(tmp_folder, 'plain.log')),
+                     BufferedRotatingFileHandler(pathlib.Path(tmp_folder, 'size.log'), maxBytes=1 << 20),
+                     BufferedTimedRotatingFileHandler(pathlib.Path(tmp_folder, 'time.log'), when='H')]
+        for log_handler in l_handler:
+            root_logger.addHandler(log_handler)
+        try:
+            root_logger.warning('[utest_BufferedFileMixin] Buffered.')
+            for log_handler in l_handler:
+                if os.path.getsize(log_handler.baseFilename) != 0:
+                    raise Exception('[utest_BufferedFileMixin] %s is not buffered.' % type(log_handler).__name__)
+            GameLog._GameLog__flush_file()
+            for log_handler in l_handler:
+                with open(log_handler.baseFilename, 'r') as in_fd:
+                    if 'Buffered.' not in in_fd.read():
+                        raise Exception('[utest_BufferedFileMixin] %s is not flushed.' % type(log_handler).__name__)
+        finally:
+            for log_handler in l_handler:
+                root_logger.removeHandler(log_handler)
+                log_handler.close()
+    print('[utest_BufferedFileMixin] Passed.')
+
+
+def utest_ZombieGameSim():
+    """
+    A short lockstep run on 3 workers without DataBroker. All agents are accounted for, and the same seed gives the
+    same aggregates and the same events.
+    """
+    run_config = GameConfig.get_run_config()
+    GameConfig.set_run_config(dataclasses.replace(run_config, MAX_ITER=50, SIM_N_WORKER=3, SIM_EN_BROKER=False,
+                                                  SIM_EN_EVENT=True))
+    # The output folder is keyed by the config hash.
+    OUT_FOLDER.mkdir(parents=True, exist_ok=True)
+    l_event_path = [pathlib.Path(OUT_FOLDER, 'events_%s_w%s.bin' % (RUN_ID, wid)) for wid in range(3)]
+
+    def run_once():
+        for event_path in l_event_path:
+            event_path.unlink(missing_ok=True)
+        d_agg = ZombieGameSim().start(seed=0)
+        return d_agg, [EventLog.load(event_path) for event_path in l_event_path]
+
+    GameLog.start_log()
+    try:
+        d_agg, l_event = run_once()
+        if sum(d_agg.values()) != GameConfig.NUM_AGENTS:
+            raise Exception('[utest_ZombieGameSim] Agents are lost: %s' % d_agg)
+        d_agg_again, l_event_again = run_once()
+        if d_agg_again != d_agg:
+            raise Exception('[utest_ZombieGameSim] Aggregates are not reproducible for the same seed.')
+        if not all(np.array_equal(nd_event, nd_event_again)
+                   for nd_event, nd_event_again in zip(l_event, l_event_again)):
+            raise Exception('[utest_ZombieGameSim] Events are not reproducible for the same seed.')
+    finally:
+        GameLog.stop_log()
+        GameConfig.set_run_config(run_config)
+    print('[utest_ZombieGameSim] Passed. Aggregates: %s' % d_agg)
 
 
 if __name__ == '__main__':
-    utest_GameLog()
\ No newline at end of file
+    GameConfig.config_init()
+    run_init()
+    utest_BrCreditLedger()
+    utest_BrStateCache()
+    utest_BufferedFileMixin()
+    utest_GameLog()
+    utest_ZombieGameSim()
\ No newline at end of file
@@ -5,9 +5,12 @@ import pathlib
 import time
 from datetime import datetime
 import json
+import shutil
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+
+from zombie_event import EventLog, EV_BITE, EV_CURE, EV_DEATH
+from zombie_config import RunConfig
+from run_cache import RunCache
 
 
 ##################################################
@@ -31,11 +34,8 @@ EN_PLOT = True
 # Output folder:
 # TODO
 #   The output folder can be changed.
+#   It is created by `run_init`.
 OUT_FOLDER = pathlib.Path(pathlib.Path.cwd(), 'out', RUN_ID)
-if not OUT_FOLDER.exists():
-    OUT_FOLDER.mkdir(parents=True)
-else:
-    raise Exception('Output Folder %s already existed.' % OUT_FOLDER)
 
 # Config summary file
 CONFIG_SUM_FILE = pathlib.Path(OUT_FOLDER, 'config_%s.json' % RUN_ID)
@@ -52,6 +52,12 @@ H_PROF_FILE = pathlib.Path(OUT_FOLDER, H_PROF_FMT % RUN_ID)
 D_PROF_FILE = pathlib.Path(OUT_FOLDER, D_PROF_FMT % RUN_ID)
 Z_PROF_FILE = pathlib.Path(OUT_FOLDER, Z_PROF_FMT % RUN_ID)
 
+# Event file
+# Format: See `EventLog`.
+# TODO
+#   Set to 'None' to disable the event file.
+EVENT_FILE = pathlib.Path(OUT_FOLDER, 'events_%s.bin' % RUN_ID)
+
 # Log level
 # TODO
 #   Adjust the log level according to your need.
@@ -63,7 +69,22 @@ LOG_LEVEL = logging.INFO
 #   Set to 'None' to disable log file.
 LOG_FILE = pathlib.Path(OUT_FOLDER, '%s.log' % RUN_ID)
 
+# Run cache
+# A run with the same config, seed and code as a cached one restores the cached results instead of simulating.
+# TODO
+#   Set to 'None' to disable the run cache. Only runs with a `SEED` are cached.
+RUN_CACHE_FOLDER = pathlib.Path(pathlib.Path.cwd(), 'out', 'run_cache')
+# The disk quota of the run cache in bytes.
+RUN_CACHE_QUOTA = 1 << 30
+# The source files whose contents make the code version of a run.
+RUN_CACHE_SRC = [pathlib.Path(__file__), pathlib.Path(pathlib.Path(__file__).parent, 'zombie_event.py')]
+
 #----- Game Config -----#
+# Random seed
+# TODO
+#   Set to an integer for reproducible runs.
+SEED = None
+
 # Max iterations
 # TODO
 #   Change it.
@@ -125,6 +146,18 @@ LIFE_GAIN = 1
 BITE_EFF = 5
 
 
+def run_init():
+    """
+    Set up the output of this run. Importing this module touches no files, so that workers and tests can import it
+    freely, and the main process calls this once before starting the run.
+    pandas and matplotlib are imported on first use by `GamePlot`.
+    :return: None.
+    """
+    if OUT_FOLDER.exists():
+        raise Exception('Output Folder %s already existed.' % OUT_FOLDER)
+    OUT_FOLDER.mkdir(parents=True)
+
+
 ##################################################
 #   Simulation Class Definition
 ##################################################
@@ -137,8 +170,14 @@ class ZombieGameSim:
     m_cur_moment = None
     # Logger
     m_logger = None
+    # Event log
+    m_event_log = None
 
     def __init__(self):
+        if SEED is not None:
+            np.random.seed(SEED)
+        if EVENT_FILE is not None:
+            self.m_event_log = EventLog(EVENT_FILE)
         # Generate the counts of agents.
         nd_agent_cnt = np.random.multinomial(NUM_AGENTS, pvals=[H_PROB, D_PROB, Z_PROB])
         # Create humans
@@ -157,6 +196,14 @@ class ZombieGameSim:
                       % (len(self.m_l_humans), len(self.m_l_doctors), len(self.m_l_zombies)))
 
     def start(self):
+        run_cache, run_key = self.__get_run_cache()
+        if run_cache is not None:
+            d_path, d_agg = run_cache.get(run_key)
+            if d_path is not None:
+                self.__restore_run(d_path)
+                self.m_logger.info('Game restored from the run cache. Aggregates: %s' % d_agg)
+                return d_agg
+
         self.m_logger.info('Game Started...')
         # Simulation iterations
         start_time = time.time()
@@ -182,11 +229,61 @@ class ZombieGameSim:
 
         # Output time series of profiles
         self.__output_ts_profile()
+        if self.m_event_log is not None:
+            self.m_event_log.close()
+            self.m_logger.info('%s events written to %s' % (self.m_event_log.get_cnt_event(), EVENT_FILE))
 
         # Output RUN_ID
         with open(RUN_ID_FILE, 'w') as out_fd:
             out_fd.write(RUN_ID)
+        d_agg = self.get_aggregates()
+        if run_cache is not None:
+            run_cache.put(run_key, self.__get_result_files(), d_agg,
+                          {'config_hash': get_run_config().get_hash(), 'seed': SEED})
         self.m_logger.info('Game Over. Overall Elapse: %s' % (time.time() - start_time))
+        return d_agg
+
+    def __get_run_cache(self):
+        """
+        :return: (RunCache, str) The run cache and the key of this run. (None, None) if this run is not cached.
+        """
+        if RUN_CACHE_FOLDER is None or SEED is None:
+            return None, None
+        run_key = RunCache.get_key(get_run_config().get_hash(), SEED, RunCache.get_code_version(RUN_CACHE_SRC))
+        return RunCache(RUN_CACHE_FOLDER, RUN_CACHE_QUOTA), run_key
+
+    def __get_result_files(self):
+        d_path = {'h_prof.csv': H_PROF_FILE, 'd_prof.csv': D_PROF_FILE, 'z_prof.csv': Z_PROF_FILE}
+        if EVENT_FILE is not None:
+            d_path['events.bin'] = EVENT_FILE
+        return d_path
+
+    def __restore_run(self, d_cache_path):
+        """
+        Copy the cached results to the output files of this run.
+        :param d_cache_path: (dict) The cached files by result name.
+        :return: None.
+        """
+        if self.m_event_log is not None:
+            self.m_event_log.close()
+        for name, out_path in self.__get_result_files().items():
+            if name in d_cache_path:
+                shutil.copyfile(d_cache_path[name], out_path)
+        with open(RUN_ID_FILE, 'w') as out_fd:
+            out_fd.write(RUN_ID)
+
+    def get_aggregates(self):
+        """
+        The final counts of agents by role and state.
+        :return: (dict) e.g., {'HUMAN_ALIVE': 10, ...}
+        """
+        d_agg = dict()
+        for role_str, l_agents in [('HUMAN', self.m_l_humans), ('DOCTOR', self.m_l_doctors),
+                                   ('ZOMBIE', self.m_l_zombies)]:
+            l_state = [agent.get_state() for agent in l_agents]
+            for state_str, state in [('ALIVE', ALIVE), ('INFECTED', INFECTED), ('DEAD', DEAD)]:
+                d_agg['%s_%s' % (role_str, state_str)] = l_state.count(state)
+        return d_agg
 
     def __output_ts_profile(self):
         """
@@ -219,6 +316,14 @@ class ZombieGameSim:
     def get_cur_moment(self):
         return self.m_cur_moment
 
+    def emit_event(self, etype, actor, target, e_before, e_after):
+        """
+        Record a structured event at the current moment. See `EventLog`.
+        :return: None.
+        """
+        if self.m_event_log is not None:
+            self.m_event_log.emit(self.m_cur_moment, etype, actor, target, e_before, e_after)
+
 
 
 ##################################################
@@ -311,10 +416,12 @@ class AbsAgent:
         elif new_energy > self.get_full_energy():
             new_energy = self.get_full_energy()
 
+        e_before = self.m_energy
         self.m_energy = new_energy
 
         if self.get_energy() == 0:
             self._change_state(DEAD)
+            self.m_ref_sim.emit_event(EV_DEATH, self.m_agent_id, self.m_agent_id, e_before, self.m_energy)
 
     def get_full_energy(self):
         return self.m_full_energy
@@ -450,7 +557,7 @@ class Human(AbsAgent):
         if self.get_state() == ALIVE:
             self.m_logger.debug('Bitten %s by %s' % (self._profile_to_str(), zombie._profile_to_str()))
             self._change_state(INFECTED)
-            self.get_state()
+            self.m_ref_sim.emit_event(EV_BITE, zombie.get_agent_id(), self.m_agent_id, self.m_energy, self.m_energy)
 
     def treated(self, doctor):
         """
@@ -460,8 +567,10 @@ class Human(AbsAgent):
         """
         if self.get_state() == INFECTED:
             self.m_logger.debug('Treated %s by %s' % (self._profile_to_str(), doctor._profile_to_str()))
+            e_before = self.m_energy
             self._change_state(ALIVE)
             self._healing()
+            self.m_ref_sim.emit_event(EV_CURE, doctor.get_agent_id(), self.m_agent_id, e_before, self.m_energy)
 
     def _healing(self):
         if self.get_state() == ALIVE and self.get_energy() < self.get_full_energy():
@@ -589,6 +698,33 @@ class Zombie(AbsAgent):
 ##################################################
 #   Utility Classes
 ##################################################
+def get_run_config():
+    """
+    The validated config of this run made of the settings above.
+    :return: (RunConfig)
+    """
+    return RunConfig.from_dict({
+        # The sequential simulation is a single worker.
+        'SIM_N_WORKER': 1,
+        'MAX_ITER': MAX_ITER,
+        'NUM_AGENTS': NUM_AGENTS,
+        'NUM_NEIG': NUM_NEIG,
+        'H_PROB': H_PROB,
+        'D_PROB': D_PROB,
+        'Z_PROB': Z_PROB,
+        'H_ENERGY': H_ENERGY,
+        'D_ENERGY': D_ENERGY,
+        'Z_ENERGY': Z_ENERGY,
+        'BITE_PROB': BITE_PROB,
+        'BITE_GAIN': BITE_GAIN,
+        'Z_DECAY': Z_DECAY,
+        'BITE_HURT': BITE_HURT,
+        'H_DECAY': H_DECAY,
+        'LIFE_GAIN': LIFE_GAIN,
+        'BITE_EFF': BITE_EFF
+    })
+
+
 class GameLog:
     m_ref_sim = None
 
@@ -604,24 +740,10 @@ class GameLog:
         Summarize all configurations in a JSON file.
         :return: None.
         """
-        d_config = {
-            'MAX_ITER': MAX_ITER,
-            'NUM_AGENTS': NUM_AGENTS,
-            'NUM_NEIG': NUM_NEIG,
-            'H_PROB': H_PROB,
-            'D_PROB': D_PROB,
-            'Z_PROB': Z_PROB,
-            'H_ENERGY': H_ENERGY,
-            'D_ENERGY': D_ENERGY,
-            'Z_ENERGY': Z_ENERGY,
-            'BITE_PROB': BITE_PROB,
-            'BITE_GAIN': BITE_GAIN,
-            'Z_DECAY': Z_DECAY,
-            'BITE_HURT': BITE_HURT,
-            'H_DECAY': H_DECAY,
-            'LIFE_GAIN': LIFE_GAIN,
-            'BITE_EFF': BITE_EFF
-        }
+        run_config = get_run_config()
+        d_config = run_config.to_dict(only_hashed=True)
+        d_config['SEED'] = SEED
+        d_config['CONFIG_HASH'] = run_config.get_hash()
         with open(CONFIG_SUM_FILE, 'w') as out_fd:
             json.dump(d_config, out_fd, indent=4)
         logging.info('Log [GameLog:config_summary] Done writing config summary file: %s' % CONFIG_SUM_FILE)
@@ -655,6 +777,8 @@ class GamePlot:
         :return: (DataFrame, DataFrame, DataFrame) for Human, Doctor, and Zombie respectively.
             Columns: 'tick', 'aid', 'state', 'energy'
         """
+        import pandas as pd
+
         h_ts_prof_file = pathlib.Path(OUT_FOLDER, H_PROF_FMT % run_id)
         if not pathlib.Path(h_ts_prof_file).exists():
             logging.error('Plot [GamePlot:load_ts_profiles] No Human profile file for `run_id`: %s' % run_id)
@@ -676,6 +800,8 @@ class GamePlot:
         return df_h_ts_prof, df_d_ts_prof, df_z_ts_prof
 
     def plot_ts_state(self, run_id, title_prefix, df_ts_state, states=ALIVE|INFECTED|DEAD, out_folder=None):
+        import matplotlib.pyplot as plt
+
         logging.info('Plot [GamePlot:plot_ts_state] Starts...')
         nd_tick = np.array(sorted(list(set(df_ts_state['tick']))))
         l_ts_alive = []
@@ -740,6 +866,7 @@ class GamePlot:
 #   Simulation Main Body
 ##################################################
 if __name__ == '__main__':
+    run_init()
     if EN_SIM:
         ins_game = ZombieGameSim()
         ins_game.start()